@@ -1,26 +1,60 @@
 # backend/app/api/admin.py
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.responses import Response
-from typing import Any, Dict, List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from contextlib import contextmanager
 from datetime import datetime, timezone
 import json
 import csv
 import io
+import logging
+import os
+import textwrap
 import secrets
 import string
 
 from pydantic import BaseModel, EmailStr
-from sqlmodel import select
+from sqlalchemy import func
+from sqlmodel import Session, select
+from starlette.background import BackgroundTask
 
 from app.auth.router import get_current_user
 from app.auth.security import hash_password
 from app.auth.config import ALLOWED_EMAIL_DOMAIN
-from app.auth.db import get_session, User
-from app.questionnaires.models import Questionnaire
+from app.auth.db import get_session, get_read_session, pool_stats, User
+from app.questionnaires.changes import changed_since, data_generation, settled_watermark
+from app.questionnaires.models import ExportJob, Questionnaire, QuestionnaireDrug
+from app.services.admin_export import flatten
+from app.services.admin_filters import OPS, compile_rules
+from app.services.column_registry import BASE_FIELDS, EXTRA_COLUMN, load_registry, register_columns
+from app.services.columnar_export import (
+    NESTED_FIELDS,
+    build_schema,
+    iter_arrow_ipc,
+    iter_parquet,
+    record_to_row,
+    type_name,
+)
+from app.services import export_cache
+from app.services.export_jobs import artifact_path, submit_job
+from app.services.export_query import export_query
+from app.services.rule_sql import rules_to_sql
+from app.services.stats_snapshot import DIMENSIONS, stats_snapshot
+from app.services.table_export import NESTED_COLUMNS, NESTED_TABLES, iter_table_zip
+from app.services.facet_cache import facet_cache
+from app.services.facet_index import facet_index
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
+# Rows fetched per DB round trip / records per streamed chunk in exports
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "500"))
+
+# Max questionnaires per /export/changes response (the rest: has_more)
+CHANGES_PAGE_SIZE = int(os.getenv("CHANGES_PAGE_SIZE", "10000"))
+
 
 # -----------------------------
 # Auth helpers
@@ -221,118 +255,10 @@ def record_passes_filters(record: Dict[str, Any], params: Dict[str, str]) -> boo
     return True
 
 
-def flatten(obj: Any, prefix: str = "", out: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-    """
-    Flattens nested JSON into dot keys. Lists are JSON-stringified.
-    """
-    if out is None:
-        out = {}
-
-    if isinstance(obj, dict):
-        for k, v in obj.items():
-            key = f"{prefix}.{k}" if prefix else str(k)
-            flatten(v, key, out)
-    elif isinstance(obj, list):
-        out[prefix] = json.dumps(obj, ensure_ascii=False)
-    else:
-        out[prefix] = obj
-
-    return out
-
-
-# -----------------------------
-# Export option dropdowns
-# -----------------------------
-@router.get("/export/options")
-def export_options(user=Depends(require_admin)):
-    """
-    Returns dropdown option values derived from SUBMITTED questionnaires only.
-    """
-    hair_colours = set()
-    sexes = set()
-    testing_types = set()
-
-    dyed_bleached_vals = set()
-    thermal_vals = set()
-    swimming_vals = set()
-    sunbeds_vals = set()
-    sprays_vals = set()
-    pregnant_vals = set()
-    hair_cut_vals = set()
-    body_hair_removed_vals = set()
-
-    drug_use_used_names = set()
-    drug_exposure_exposed_names = set()
-
-    def add_nonempty(s, target):
-        v = norm(s)
-        if v:
-            target.add(v)
-
-    def is_used_status(s: Optional[str]) -> bool:
-        return norm_lower(s) == "used"
-
-    def is_exposed_status(s: Optional[str]) -> bool:
-        return norm_lower(s) == "exposed"
-
-    with get_session() as session:
-        qs = session.exec(
-            select(Questionnaire).where(Questionnaire.status == "submitted")
-        ).all()
-
-        for q in qs:
-            data = q.data or {}
-
-            add_nonempty(data.get("natural_hair_colour"), hair_colours)
-            add_nonempty(data.get("sex_at_birth"), sexes)
-            add_nonempty(data.get("testing_type"), testing_types)
-
-            add_nonempty(data.get("hair_dyed_bleached"), dyed_bleached_vals)
-            add_nonempty(data.get("hair_thermal_applications"), thermal_vals)
-            add_nonempty(data.get("frequent_swimming"), swimming_vals)
-            add_nonempty(data.get("frequent_sunbeds"), sunbeds_vals)
-            add_nonempty(data.get("frequent_sprays_on_sites"), sprays_vals)
-            add_nonempty(data.get("pregnant_last_12_months"), pregnant_vals)
-            add_nonempty(data.get("hair_cut_in_last_12_months"), hair_cut_vals)
-            add_nonempty(data.get("hair_removed_body_hair_last_12_months"), body_hair_removed_vals)
-
-            du = data.get("drug_use") or []
-            if isinstance(du, list):
-                for it in du:
-                    if isinstance(it, dict) and is_used_status(it.get("status")):
-                        add_nonempty(it.get("drug_name"), drug_use_used_names)
-
-            de = data.get("drug_exposure") or []
-            if isinstance(de, list):
-                for it in de:
-                    if isinstance(it, dict) and is_exposed_status(it.get("status")):
-                        add_nonempty(it.get("drug_name"), drug_exposure_exposed_names)
-
-    return {
-        "natural_hair_colours": sorted(hair_colours),
-        "sex_at_birth": sorted(sexes),
-        "testing_types": sorted(testing_types),
-
-        "hair_dyed_bleached": sorted(dyed_bleached_vals),
-        "hair_thermal_applications": sorted(thermal_vals),
-        "frequent_swimming": sorted(swimming_vals),
-        "frequent_sunbeds": sorted(sunbeds_vals),
-        "frequent_sprays_on_sites": sorted(sprays_vals),
-        "pregnant_last_12_months": sorted(pregnant_vals),
-        "hair_cut_in_last_12_months": sorted(hair_cut_vals),
-        "hair_removed_body_hair_last_12_months": sorted(body_hair_removed_vals),
-
-        "drug_use_used_names": sorted(drug_use_used_names),
-        "drug_exposure_exposed_names": sorted(drug_exposure_exposed_names),
-    }
-
-
 # -----------------------------
-# Export JSON
+# Export filtering
 # -----------------------------
-@router.get("/export/json")
-def export_json(
-    user=Depends(require_admin),
+def export_filter_params(
     submitted_from: Optional[str] = None,
     submitted_to: Optional[str] = None,
     natural_hair_colour: Optional[str] = None,
@@ -350,7 +276,13 @@ def export_json(
 
     drug_used_name: Optional[str] = None,
     drug_exposed_name: Optional[str] = None,
-):
+
+    latest_only: bool = False,
+) -> Dict[str, str]:
+    """
+    Query parameters shared by the export endpoints (blank = no filter).
+    latest_only keeps just the highest submitted version of each case.
+    """
     params = {
         "submitted_from": submitted_from or "",
         "submitted_to": submitted_to or "",
@@ -369,160 +301,938 @@ def export_json(
 
         "drug_used_name": drug_used_name or "",
         "drug_exposed_name": drug_exposed_name or "",
+
+        "latest_only": "true" if latest_only else "",
     }
+    return params
 
-    out_records: List[Dict[str, Any]] = []
 
+def q_to_export_record(q: Questionnaire) -> Dict[str, Any]:
+    return {
+        "id": q.id,
+        "case_number": q.case_number,
+        "version": q.version,
+        "status": q.status,
+        "created_at": q.created_at,
+        "updated_at": q.updated_at,
+        "submitted_at": q.submitted_at,
+        "redo_of_id": q.redo_of_id,
+        "user_id": q.user_id,
+        "user_email": q.user_email,
+        "data": q.data or {},
+    }
+
+
+def iter_export_records(
+    session,
+    params: Dict[str, str],
+    on_record: Optional[Callable[[], None]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Submitted records matching the export filters. Filters the backend can
+    evaluate are pushed into SQL (see export_query); record_passes_filters
+    then checks the remainder, so results are identical on every backend.
+    """
+    stmt = export_query(
+        params,
+        session.get_bind().dialect.name,
+        submitted_from=parse_date_as_day_start(params.get("submitted_from")),
+        submitted_to=parse_date_as_day_end(params.get("submitted_to")),
+    )
+
+    # yield_per streams rows from a server-side cursor instead of fetching all
+    for q in session.exec(stmt.execution_options(yield_per=EXPORT_CHUNK_SIZE)):
+        record = q_to_export_record(q)
+        if record_passes_filters(record, params):
+            if on_record:
+                on_record()
+            yield record
+
+
+# -----------------------------
+# Export option dropdowns
+# -----------------------------
+@router.get("/export/options")
+def export_options(request: Request, user=Depends(require_admin)):
+    """
+    Returns dropdown option values derived from SUBMITTED questionnaires only.
+    Served from the in-process facet cache (kept up to date by finalize and
+    delete); supports If-None-Match for client caching.
+    """
+    if not facet_cache.is_fresh():
+        with get_session() as session:
+            facet_cache.rebuild(session)
+
+    payload, etag = facet_cache.snapshot()
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(payload, headers=headers)
+
+
+@router.post("/export/options/rebuild")
+def rebuild_export_options(user=Depends(require_admin)):
+    """
+    Rebuilds the facet cache from the database.
+    """
     with get_session() as session:
-        qs = session.exec(
-            select(Questionnaire).where(Questionnaire.status == "submitted")
+        facet_cache.rebuild(session)
+    _, etag = facet_cache.snapshot()
+    return {"ok": True, "etag": etag}
+
+
+@router.get("/export/preview")
+def export_preview(
+    facets: bool = True,
+    params: Dict[str, str] = Depends(export_filter_params),
+    user=Depends(require_admin),
+):
+    """
+    Live counts for the export page: how many records the current filters
+    export, and per dropdown how many each value would give (with the other
+    filters applied). Answered from the in-process bitmap index.
+    """
+    if not facet_index.is_fresh():
+        with get_session() as session:
+            facet_index.rebuild(session)
+
+    submitted_from = parse_date_as_day_start(params.get("submitted_from"))
+    submitted_to = parse_date_as_day_end(params.get("submitted_to"))
+    return facet_index.query(
+        params,
+        submitted_from=submitted_from.isoformat() if submitted_from else None,
+        submitted_to=submitted_to.isoformat() if submitted_to else None,
+        facets=facets,
+    )
+
+
+@router.post("/export/preview/rebuild")
+def rebuild_export_preview(user=Depends(require_admin)):
+    """
+    Rebuilds the bitmap index from the database.
+    """
+    with get_session() as session:
+        facet_index.rebuild(session)
+    return {"ok": True}
+
+
+# -----------------------------
+# Drug statistics
+# -----------------------------
+@router.get("/drugs/stats")
+def drug_stats(user=Depends(require_admin)):
+    """
+    Number of SUBMITTED questionnaires per drug and status, e.g.
+    {"kind": "use", "drug_name": "Powder Cocaine", "status": "used", "count": 12}
+    """
+    with get_read_session() as session:
+        rows = session.exec(
+            select(
+                QuestionnaireDrug.kind,
+                QuestionnaireDrug.drug_name,
+                QuestionnaireDrug.status,
+                func.count(func.distinct(QuestionnaireDrug.questionnaire_id)),
+            )
+            .join(Questionnaire, Questionnaire.id == QuestionnaireDrug.questionnaire_id)
+            .where(Questionnaire.status == "submitted")
+            .group_by(QuestionnaireDrug.kind, QuestionnaireDrug.drug_name, QuestionnaireDrug.status)
+            .order_by(QuestionnaireDrug.kind, QuestionnaireDrug.drug_name, QuestionnaireDrug.status)
         ).all()
 
-        for q in qs:
-            record = {
-                "id": q.id,
-                "case_number": q.case_number,
-                "version": q.version,
-                "status": q.status,
-                "created_at": q.created_at,
-                "updated_at": q.updated_at,
-                "submitted_at": q.submitted_at,
-                "redo_of_id": q.redo_of_id,
-                "user_id": q.user_id,
-                "user_email": q.user_email,
-                "data": q.data or {},
-            }
+    return [
+        {"kind": kind, "drug_name": drug_name, "status": status, "count": count}
+        for kind, drug_name, status, count in rows
+    ]
 
-            if not record_passes_filters(record, params):
-                continue
 
-            clean = dict(record)
-            clean["data"] = strip_signatures(clean.get("data") or {})
-            out_records.append(clean)
+# -----------------------------
+# Aggregate statistics
+# -----------------------------
+STATS_MAX_GROUP_BY = 3
+
+
+@router.get("/stats")
+def aggregate_stats(
+    group_by: str = "",
+    ratio_field: Optional[str] = None,
+    ratio_value: Optional[str] = None,
+    ratio_drug_used: Optional[str] = None,
+    ratio_drug_exposed: Optional[str] = None,
+    user=Depends(require_admin),
+):
+    """
+    Counts of SUBMITTED questionnaires grouped by up to three dimensions
+    (comma separated: any export filter field, submitted_month,
+    submitted_year), e.g.
+
+      /admin/stats?group_by=testing_type,submitted_month
+      /admin/stats?group_by=natural_hair_colour&ratio_drug_used=Cannabis
+      /admin/stats?ratio_field=hair_dyed_bleached&ratio_value=Yes
+
+    With a ratio_* parameter each group also gets "matches" and "ratio"
+    (fraction of the group's records matching it). Computed on the
+    in-memory stats snapshot, not the documents.
+    """
+    dims = [d.strip() for d in group_by.split(",") if d.strip()]
+    unknown = [d for d in dims if d not in DIMENSIONS]
+    if unknown or len(dims) > STATS_MAX_GROUP_BY or len(set(dims)) != len(dims):
+        raise HTTPException(
+            status_code=400,
+            detail=f"group_by takes up to {STATS_MAX_GROUP_BY} distinct of: {', '.join(DIMENSIONS)}",
+        )
+
+    ratios = [
+        (kind, value)
+        for kind, value in (
+            (ratio_field, ratio_value),
+            ("drug_used", ratio_drug_used),
+            ("drug_exposed", ratio_drug_exposed),
+        )
+        if kind and value
+    ]
+    if len(ratios) > 1:
+        raise HTTPException(status_code=400, detail="Only one ratio_* condition at a time")
+    if ratio_field and ratio_field not in DIMENSIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown ratio_field: {ratio_field}")
+    ratio = ratios[0] if ratios else None
+
+    if not stats_snapshot.is_fresh():
+        with get_read_session() as session:
+            stats_snapshot.rebuild(session)
+
+    result = stats_snapshot.aggregate(dims, ratio)
+    return {
+        "group_by": dims,
+        "ratio": {"field": ratio[0], "value": ratio[1]} if ratio else None,
+        **result,
+    }
+
+
+# -----------------------------
+# Export cache
+# -----------------------------
+def export_cache_params(params: Dict[str, str]) -> Dict[str, str]:
+    """
+    Params as they affect the result: dates reduced to the day bounds the
+    filters actually use, so "2024-01-01" and "2024-01-01T09:30" share a key.
+    """
+    out = dict(params)
+    for key, parse in (("submitted_from", parse_date_as_day_start), ("submitted_to", parse_date_as_day_end)):
+        d = parse(params.get(key))
+        out[key] = d.isoformat() if d else ""
+    return out
+
+
+def open_export_snapshot() -> Session:
+    """
+    Read session pinned to one snapshot from its first query on, so the data
+    generation read first (the cache key) describes exactly the rows the
+    export then streams. The caller closes it.
+    """
+    session = get_read_session()
+    if session.get_bind().dialect.name == "postgresql":
+        session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+    else:
+        # pysqlite only opens transactions for writes; reads need an explicit one
+        session.connection().exec_driver_sql("BEGIN")
+    return session
+
+
+@contextmanager
+def export_session(session: Optional[Session] = None) -> Iterator[Session]:
+    """
+    The given session (its owner closes it), else a fresh read session.
+    """
+    if session is not None:
+        yield session
+        return
+    with get_read_session() as session:
+        yield session
+
+
+def closing_stream(session: Session, chunks: Iterator[bytes]) -> Iterator[bytes]:
+    try:
+        yield from chunks
+    finally:
+        session.close()
+
+
+def cached_export_response(
+    request: Request,
+    fmt: str,
+    params: Dict[str, str],
+    make_stream: Callable[[Optional[Session]], Iterator[bytes]],
+    media_type: str,
+    filename: str,
+    headers: Optional[Dict[str, str]] = None,
+    **variant: Any,
+) -> Response:
+    """
+    Serves an export from the disk cache when the same export (params,
+    variant such as the column schema version) was produced for the current
+    data generation; otherwise streams it and caches it on the way out.
+    The cache key doubles as ETag, so unchanged exports can answer 304.
+    On a miss make_stream gets the snapshot session the generation was read
+    in, so the cached bytes match their key.
+    """
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"', **(headers or {})}
+    if not export_cache.enabled():
+        return StreamingResponse(make_stream(None), media_type=media_type, headers=headers)
+
+    session = open_export_snapshot()
+    try:
+        generation = data_generation(session)
+    except Exception:
+        session.close()
+        raise
+    if not generation:  # not seeded yet (e.g. replica behind init_db)
+        session.close()
+        return StreamingResponse(make_stream(None), media_type=media_type, headers=headers)
+    key = export_cache.cache_key(fmt, export_cache_params(params), generation, **variant)
+    etag = export_cache.etag_for(key)
+    headers.update({"ETag": etag, "Cache-Control": "private, no-cache"})
+
+    if request.headers.get("if-none-match") == etag:
+        session.close()
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+    ext = filename.rsplit(".", 1)[-1]
+    path = export_cache.lookup(key, ext)
+    if path is not None:
+        session.close()
+        return FileResponse(path, media_type=media_type, headers={**headers, "X-Export-Cache": "hit"})
+
+    return StreamingResponse(
+        export_cache.tee(key, ext, closing_stream(session, make_stream(session))),
+        media_type=media_type,
+        headers={**headers, "X-Export-Cache": "miss"},
+        # Also closes the snapshot if the stream never started
+        background=BackgroundTask(session.close),
+    )
 
-    payload = json.dumps(out_records, indent=2, ensure_ascii=False, default=str).encode("utf-8")
 
-    return Response(
-        content=payload,
+# -----------------------------
+# Export JSON
+# -----------------------------
+@router.get("/export/json")
+def export_json(
+    request: Request,
+    user=Depends(require_admin),
+    params: Dict[str, str] = Depends(export_filter_params),
+    summary: bool = False,
+):
+    """
+    Streams matching records as a JSON array, one record at a time.
+    With summary=true the array is wrapped as {"records": [...], "count": N}
+    (the count is only known once the last record has been sent).
+    """
+    return cached_export_response(
+        request,
+        "json",
+        params,
+        lambda session: stream_json_export(params, summary=summary, session=session),
         media_type="application/json; charset=utf-8",
-        headers={
-            "Content-Disposition": 'attachment; filename="submitted_questionnaires.json"',
-            "X-Export-Count": str(len(out_records)),
-        },
+        filename="submitted_questionnaires.json",
+        summary=summary,
     )
 
 
+def stream_json_export(
+    params: Dict[str, str],
+    summary: bool = False,
+    on_record: Optional[Callable[[], None]] = None,
+    session: Optional[Session] = None,
+) -> Iterator[bytes]:
+    """
+    Same bytes as json.dumps(records, indent=2), produced incrementally:
+    rows come from a server-side cursor and are sent in chunks of
+    EXPORT_CHUNK_SIZE records, so memory stays flat regardless of size.
+    """
+    pad = "    " if summary else "  "
+    count = 0
+    chunk: List[str] = []
+
+    yield (b'{\n  "records": ' if summary else b"") + b"["
+
+    with export_session(session) as session:
+        for record in iter_export_records(session, params, on_record):
+            clean = dict(record)
+            clean["data"] = strip_signatures(clean.get("data") or {})
+
+            body = json.dumps(clean, indent=2, ensure_ascii=False, default=str)
+            chunk.append(("," if count else "") + "\n" + textwrap.indent(body, pad))
+            count += 1
+
+            if len(chunk) >= EXPORT_CHUNK_SIZE:
+                yield "".join(chunk).encode("utf-8")
+                chunk = []
+
+    tail = "".join(chunk) + ("\n" + pad[:-2] + "]" if count else "]")
+    if summary:
+        tail += f',\n  "count": {count}\n}}'
+    yield tail.encode("utf-8")
+
+
 # -----------------------------
 # Export CSV
 # -----------------------------
 @router.get("/export/csv")
 def export_csv(
+    request: Request,
     user=Depends(require_admin),
-    submitted_from: Optional[str] = None,
-    submitted_to: Optional[str] = None,
-    natural_hair_colour: Optional[str] = None,
-    sex_at_birth: Optional[str] = None,
-    testing_type: Optional[str] = None,
+    params: Dict[str, str] = Depends(export_filter_params),
+):
+    """
+    Streams matching records as CSV. The header comes from the export column
+    registry, so it is written before the first row; data keys that are not
+    registered yet are written to the _extra_fields column (as JSON) and
+    registered afterwards so the next export gets proper columns for them.
+    """
+    with get_read_session() as session:
+        schema_version, fieldnames = load_registry(session)
+
+    return cached_export_response(
+        request,
+        "csv",
+        params,
+        lambda session: stream_csv_export(params, fieldnames, session=session),
+        media_type="text/csv; charset=utf-8",
+        filename="submitted_questionnaires.csv",
+        headers={"X-Export-Schema-Version": str(schema_version)},
+        schema_version=schema_version,
+    )
 
-    hair_dyed_bleached: Optional[str] = None,
-    hair_thermal_applications: Optional[str] = None,
-    frequent_swimming: Optional[str] = None,
-    frequent_sunbeds: Optional[str] = None,
-    frequent_sprays_on_sites: Optional[str] = None,
-    pregnant_last_12_months: Optional[str] = None,
-    hair_cut_in_last_12_months: Optional[str] = None,
-    hair_removed_body_hair_last_12_months: Optional[str] = None,
 
-    drug_used_name: Optional[str] = None,
-    drug_exposed_name: Optional[str] = None,
+def csv_export_row(record: Dict[str, Any], clean_data: Dict[str, Any], known: set, unknown: set) -> Dict[str, Any]:
+    """
+    Flat CSV row; keys outside `known` go to EXTRA_COLUMN and are added to `unknown`.
+    """
+    flat = {k: record.get(k) for k in BASE_FIELDS}
+    flat_data = flatten(clean_data)
+    flat.update({f"data.{k}": v for k, v in flat_data.items()})
+
+    extra = {k: v for k, v in flat.items() if k not in known}
+    if extra:
+        unknown.update(extra)
+        flat[EXTRA_COLUMN] = json.dumps(extra, ensure_ascii=False, default=str)
+    return flat
+
+
+def register_unknown_columns(unknown: set) -> None:
+    """
+    Best effort, after the last chunk went out: the response is already
+    sent, so a failure (e.g. a concurrent export registering the same
+    columns) only gets logged; the next export registers them again.
+    """
+    with get_session() as session:
+        try:
+            register_columns(session, unknown)
+        except Exception:
+            session.rollback()
+            logger.exception("Could not register export columns")
+
+
+def stream_csv_export(
+    params: Dict[str, str],
+    fieldnames: List[str],
+    on_record: Optional[Callable[[], None]] = None,
+    session: Optional[Session] = None,
+) -> Iterator[bytes]:
+    known = set(fieldnames)
+    unknown = set()
+
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=fieldnames, extrasaction="ignore")
+    writer.writeheader()
+    rows_in_chunk = 0
+
+    with export_session(session) as session:
+        for record in iter_export_records(session, params, on_record):
+            clean_data = strip_signatures(record.get("data") or {})
+            flat = csv_export_row(record, clean_data, known, unknown)
+            writer.writerow({k: flat.get(k, "") for k in fieldnames})
+            rows_in_chunk += 1
+
+            if rows_in_chunk >= EXPORT_CHUNK_SIZE:
+                yield out.getvalue().encode("utf-8")
+                out.seek(0)
+                out.truncate()
+                rows_in_chunk = 0
+
+    yield out.getvalue().encode("utf-8")
+
+    if unknown:
+        register_unknown_columns(unknown)
+
+
+# -----------------------------
+# Export related tables (ZIP of CSVs)
+# -----------------------------
+@router.get("/export/tables")
+def export_tables(
+    request: Request,
+    user=Depends(require_admin),
+    params: Dict[str, str] = Depends(export_filter_params),
 ):
-    params = {
-        "submitted_from": submitted_from or "",
-        "submitted_to": submitted_to or "",
-        "natural_hair_colour": natural_hair_colour or "",
-        "sex_at_birth": sex_at_birth or "",
-        "testing_type": testing_type or "",
+    """
+    Streams a ZIP of CSV tables linked by id: questionnaires, drug_use,
+    drug_use_periods, drug_exposure and drug_exposure_periods (see
+    app.services.table_export), so nested answers arrive relational.
+    """
+    with get_read_session() as session:
+        schema_version, fieldnames = load_registry(session)
+
+    return cached_export_response(
+        request,
+        "tables",
+        params,
+        lambda session: stream_tables_export(params, fieldnames, session=session),
+        media_type="application/zip",
+        filename="submitted_questionnaires_tables.zip",
+        headers={"X-Export-Schema-Version": str(schema_version)},
+        schema_version=schema_version,
+    )
 
-        "hair_dyed_bleached": hair_dyed_bleached or "",
-        "hair_thermal_applications": hair_thermal_applications or "",
-        "frequent_swimming": frequent_swimming or "",
-        "frequent_sunbeds": frequent_sunbeds or "",
-        "frequent_sprays_on_sites": frequent_sprays_on_sites or "",
-        "pregnant_last_12_months": pregnant_last_12_months or "",
-        "hair_cut_in_last_12_months": hair_cut_in_last_12_months or "",
-        "hair_removed_body_hair_last_12_months": hair_removed_body_hair_last_12_months or "",
 
-        "drug_used_name": drug_used_name or "",
-        "drug_exposed_name": drug_exposed_name or "",
+def stream_tables_export(
+    params: Dict[str, str],
+    fieldnames: List[str],
+    on_record: Optional[Callable[[], None]] = None,
+    session: Optional[Session] = None,
+) -> Iterator[bytes]:
+    # drug_use / drug_exposure become their own tables
+    fieldnames = [f for f in fieldnames if f not in NESTED_COLUMNS]
+    known = set(fieldnames)
+    unknown = set()
+
+    def rows():
+        with export_session(session) as s:
+            for record in iter_export_records(s, params, on_record):
+                clean_data = strip_signatures(record.get("data") or {})
+                flat_data = {k: v for k, v in clean_data.items() if k not in NESTED_TABLES}
+                yield csv_export_row(record, flat_data, known, unknown), clean_data
+
+    yield from iter_table_zip(rows(), fieldnames, EXPORT_CHUNK_SIZE)
+
+    if unknown:
+        register_unknown_columns(unknown)
+
+
+# -----------------------------
+# Export changes (delta)
+# -----------------------------
+@router.get("/export/changes")
+def export_changes(
+    since: int = 0,
+    limit: int = CHANGES_PAGE_SIZE,
+    user=Depends(require_admin),
+):
+    """
+    Newline-delimited JSON of what changed after the cursor `since`
+    (0 = everything), one line per questionnaire:
+      {"op": "upsert", "seq": 12, "record": {...}}   submitted record, as in /export/json
+      {"op": "delete", "seq": 13, "id": "..."}       tombstone
+    followed by {"op": "cursor", "cursor": N, "has_more": false}.
+    Pass N as `since` next time; the same N is sent as X-Next-Cursor.
+    Drafts are skipped (they only appear once finalized).
+    """
+    if since < 0 or limit < 1:
+        raise HTTPException(status_code=400, detail="since must be >= 0 and limit >= 1")
+
+    with get_read_session() as session:
+        upto = max(settled_watermark(session), since)
+        changed = changed_since(session, since, upto, limit=limit)
+
+    has_more = len(changed) == limit
+    cursor = changed[-1][1] if has_more else upto
+
+    return StreamingResponse(
+        stream_changes(changed, cursor, has_more),
+        media_type="application/x-ndjson",
+        headers={"X-Next-Cursor": str(cursor)},
+    )
+
+
+def stream_changes(changed: List, cursor: int, has_more: bool) -> Iterator[bytes]:
+    with get_read_session() as session:
+        for start in range(0, len(changed), EXPORT_CHUNK_SIZE):
+            chunk = changed[start:start + EXPORT_CHUNK_SIZE]
+            qs = session.exec(
+                select(Questionnaire).where(Questionnaire.id.in_([qid for qid, _ in chunk]))
+            ).all()
+            by_id = {q.id: q for q in qs}
+
+            lines = []
+            for qid, seq in chunk:
+                q = by_id.get(qid)
+                if q is None:
+                    line = {"op": "delete", "seq": seq, "id": qid}
+                elif q.status == "submitted":
+                    record = q_to_export_record(q)
+                    record["data"] = strip_signatures(record["data"])
+                    line = {"op": "upsert", "seq": seq, "record": record}
+                else:
+                    continue
+                lines.append(json.dumps(line, ensure_ascii=False, default=str) + "\n")
+            session.expunge_all()
+            yield "".join(lines).encode("utf-8")
+
+    yield (json.dumps({"op": "cursor", "cursor": cursor, "has_more": has_more}) + "\n").encode("utf-8")
+
+
+# -----------------------------
+# Export Parquet / Arrow
+# -----------------------------
+COLUMNAR_FORMATS = {
+    "parquet": (iter_parquet, "application/vnd.apache.parquet", "parquet"),
+    "arrow": (iter_arrow_ipc, "application/vnd.apache.arrow.stream", "arrows"),
+}
+
+
+@router.get("/export/parquet")
+def export_parquet(
+    request: Request,
+    user=Depends(require_admin),
+    params: Dict[str, str] = Depends(export_filter_params),
+):
+    """
+    Streams matching records as a Parquet file (one row group per
+    EXPORT_CHUNK_SIZE records). Columns are typed: timestamps, booleans,
+    dictionary-encoded categoricals, and drug_use / drug_exposure as
+    list<struct> columns instead of JSON strings.
+    """
+    return columnar_export_response(request, "parquet", params)
+
+
+@router.get("/export/arrow")
+def export_arrow(
+    request: Request,
+    user=Depends(require_admin),
+    params: Dict[str, str] = Depends(export_filter_params),
+):
+    """
+    Same columns as /export/parquet, as an Arrow IPC stream.
+    """
+    return columnar_export_response(request, "arrow", params)
+
+
+def columnar_export_response(request: Request, fmt: str, params: Dict[str, str]) -> Response:
+    writer, media_type, ext = COLUMNAR_FORMATS[fmt]
+    with get_read_session() as session:
+        schema_version, fieldnames = load_registry(session)
+    schema = build_schema(fieldnames)
+
+    return cached_export_response(
+        request,
+        fmt,
+        params,
+        lambda session: writer(iter_columnar_rows(params, schema, session=session), schema, EXPORT_CHUNK_SIZE),
+        media_type=media_type,
+        filename=f"submitted_questionnaires.{ext}",
+        headers={"X-Export-Schema-Version": str(schema_version)},
+        schema_version=schema_version,
+    )
+
+
+def iter_columnar_rows(
+    params: Dict[str, str],
+    schema,
+    on_record: Optional[Callable[[], None]] = None,
+    session: Optional[Session] = None,
+) -> Iterator[Dict[str, Any]]:
+    with export_session(session) as session:
+        for record in iter_export_records(session, params, on_record):
+            yield record_to_row(record, strip_signatures(record.get("data") or {}), schema)
+
+
+# -----------------------------
+# Export jobs (background)
+# -----------------------------
+EXPORT_JOB_FORMATS = {
+    "json": ("application/gzip", "json.gz"),
+    "csv": ("application/gzip", "csv.gz"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "zip": ("application/zip", "zip"),
+}
+
+
+def export_job_to_dict(job: ExportJob) -> Dict[str, Any]:
+    progress = None
+    if job.status == "done":
+        progress = 1.0
+    elif job.rows_estimated:
+        progress = round(min(job.rows_written / job.rows_estimated, 0.99), 3)
+
+    return {
+        "id": job.id,
+        "format": job.format,
+        "params": job.params,
+        "status": job.status,
+        "rows_written": job.rows_written,
+        "rows_estimated": job.rows_estimated,
+        "progress": progress,
+        "size_bytes": job.size_bytes,
+        "error": job.error,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+        "download_url": f"/api/admin/exports/{job.id}/download" if job.status == "done" else None,
     }
 
-    rows: List[Dict[str, Any]] = []
-    all_keys = set()
-
-    base_fields = [
-        "id",
-        "case_number",
-        "version",
-        "status",
-        "created_at",
-        "updated_at",
-        "submitted_at",
-        "redo_of_id",
-        "user_id",
-        "user_email",
-    ]
-    all_keys.update(base_fields)
+
+def export_job_stream(fmt: str, params: Dict[str, str], on_record: Callable[[], None]) -> Iterator[bytes]:
+    if fmt == "json":
+        return stream_json_export(params, on_record=on_record)
+
+    with get_read_session() as session:
+        _, fieldnames = load_registry(session)
+    if fmt == "csv":
+        return stream_csv_export(params, fieldnames, on_record=on_record)
+    if fmt == "zip":
+        return stream_tables_export(params, fieldnames, on_record=on_record)
+
+    writer = COLUMNAR_FORMATS[fmt][0]
+    schema = build_schema(fieldnames)
+    return writer(iter_columnar_rows(params, schema, on_record), schema, EXPORT_CHUNK_SIZE)
+
+
+def count_export_candidates(session, params: Dict[str, str]) -> int:
+    """
+    Rows the export query returns before the in-memory filters (an upper
+    bound of the export size, used for progress).
+    """
+    stmt = export_query(
+        params,
+        session.get_bind().dialect.name,
+        submitted_from=parse_date_as_day_start(params.get("submitted_from")),
+        submitted_to=parse_date_as_day_end(params.get("submitted_to")),
+    )
+    return session.exec(select(func.count()).select_from(stmt.subquery())).one()
+
+
+@router.post("/exports", status_code=202)
+def create_export_job(
+    format: str = "json",
+    params: Dict[str, str] = Depends(export_filter_params),
+    user=Depends(require_admin),
+):
+    """
+    Starts an export in the background and returns the job; poll
+    GET /admin/exports/{id} and download the artifact once status is "done".
+    """
+    if format not in EXPORT_JOB_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_JOB_FORMATS)}")
+
+    with get_read_session() as session:
+        estimated = count_export_candidates(session, params)
 
     with get_session() as session:
-        qs = session.exec(
-            select(Questionnaire).where(Questionnaire.status == "submitted")
-        ).all()
+        job = ExportJob(
+            id=secrets.token_hex(16),
+            format=format,
+            params=params,
+            rows_estimated=estimated,
+            user_id=user.get("id") if isinstance(user, dict) else getattr(user, "id", None),
+        )
+        session.add(job)
+        session.commit()
+        session.refresh(job)
 
-        for q in qs:
-            record = {
-                "id": q.id,
-                "case_number": q.case_number,
-                "version": q.version,
-                "status": q.status,
-                "created_at": q.created_at,
-                "updated_at": q.updated_at,
-                "submitted_at": q.submitted_at,
-                "redo_of_id": q.redo_of_id,
-                "user_id": q.user_id,
-                "user_email": q.user_email,
-                "data": q.data or {},
-            }
+    submit_job(job.id, lambda on_record: export_job_stream(format, params, on_record))
+    return export_job_to_dict(job)
+
+
+@router.get("/exports")
+def list_export_jobs(user=Depends(require_admin)):
+    with get_session() as session:
+        jobs = session.exec(select(ExportJob).order_by(ExportJob.created_at.desc())).all()
+        return [export_job_to_dict(j) for j in jobs]
+
+
+@router.get("/exports/{job_id}")
+def get_export_job(job_id: str, user=Depends(require_admin)):
+    with get_session() as session:
+        job = session.get(ExportJob, job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Export job not found")
+        return export_job_to_dict(job)
+
+
+@router.get("/exports/{job_id}/download")
+def download_export_job(job_id: str, user=Depends(require_admin)):
+    """
+    Serves the finished artifact. Supports Range / If-Range requests, so an
+    interrupted download can be resumed.
+    """
+    with get_session() as session:
+        job = session.get(ExportJob, job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Export job not found")
+        if job.status != "done":
+            raise HTTPException(status_code=409, detail=f"Export job is {job.status}")
+
+    path = artifact_path(job)
+    if path is None or not path.is_file():
+        raise HTTPException(status_code=410, detail="Export artifact has expired")
+
+    media_type, ext = EXPORT_JOB_FORMATS[job.format]
+    return FileResponse(
+        path,
+        media_type=media_type,
+        filename=f"submitted_questionnaires_{job.id}.{ext}",
+    )
+
+
+@router.delete("/exports/{job_id}")
+def delete_export_job(job_id: str, user=Depends(require_admin)):
+    with get_session() as session:
+        job = session.get(ExportJob, job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Export job not found")
+        if job.status in ("queued", "running"):
+            raise HTTPException(status_code=409, detail="Export job is still running")
+
+        path = artifact_path(job)
+        if path:
+            path.unlink(missing_ok=True)
+        session.delete(job)
+        session.commit()
+
+    return {"ok": True, "id": job_id}
+
+
+# -----------------------------
+# Questionnaire search (rule engine)
+# -----------------------------
+SEARCH_MAX_LIMIT = 500
+
+
+class SearchPayload(BaseModel):
+    rules: List[Dict[str, Any]] = []
+    limit: int = 50
+    offset: int = 0
+    include_data: bool = False
+
+
+@router.get("/questionnaires/schema")
+def questionnaire_search_schema(user=Depends(require_admin)):
+    """
+    Fields and operators accepted by /admin/questionnaires/search.
+    "any_fields" lists the item fields usable in {"any": {"field", "where"}}.
+    """
+    with get_read_session() as session:
+        _, fieldnames = load_registry(session)
+    schema = build_schema(fieldnames)
+
+    fields = [
+        {"field": f.name, "type": type_name(f.type)}
+        for f in schema
+        if f.name != EXTRA_COLUMN and f.name.split(".")[-1] not in SIGNATURE_KEYS
+    ]
+    any_fields = {
+        f"data.{key}": [
+            {"field": f.name, "type": type_name(f.type)}
+            for f in typ.value_type
+            if f.name != "periods"
+        ]
+        for key, typ in NESTED_FIELDS.items()
+    }
+    return {"fields": fields, "any_fields": any_fields, "ops": list(OPS)}
 
-            if not record_passes_filters(record, params):
+
+def search_plan(session, rules: List[Dict[str, Any]]):
+    """
+    (WHERE clauses, in-memory predicate or None). Rules that rule_sql can
+    translate run in the database; the rest are evaluated on the rows it
+    returns. Raises HTTP 400 for malformed rules.
+    """
+    try:
+        compile_rules(rules)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    clauses, remaining = rules_to_sql(rules, session.get_bind().dialect.name)
+    return clauses, (compile_rules(remaining) if remaining else None)
+
+
+@router.post("/questionnaires/search")
+def search_questionnaires(payload: SearchPayload, user=Depends(require_admin)):
+    """
+    Questionnaires (any status, newest first) matching every rule, e.g.
+      {"rules": [
+         {"field": "status", "op": "eq", "value": "submitted"},
+         {"any": {"field": "data.drug_use", "where": [
+             {"field": "drug_name", "op": "eq", "value": "Cannabis"},
+             {"field": "status", "op": "eq", "value": "used"}]}}
+      ], "limit": 50, "offset": 0}
+    Rules run in SQL where possible (see search_plan).
+    """
+    limit = max(1, min(payload.limit, SEARCH_MAX_LIMIT))
+    offset = max(0, payload.offset)
+
+    def to_item(q: Questionnaire) -> Dict[str, Any]:
+        record = q_to_export_record(q)
+        item = {k: v for k, v in record.items() if k != "data"}
+        if payload.include_data:
+            item["data"] = strip_signatures(record["data"])
+        return item
+
+    with get_read_session() as session:
+        clauses, predicate = search_plan(session, payload.rules)
+        stmt = select(Questionnaire).where(*clauses).order_by(Questionnaire.created_at.desc())
+
+        if predicate is None:
+            total = session.exec(
+                select(func.count()).select_from(Questionnaire).where(*clauses)
+            ).one()
+            qs = session.exec(stmt.offset(offset).limit(limit)).all()
+            return {"total": total, "limit": limit, "offset": offset, "items": [to_item(q) for q in qs]}
+
+        total = 0
+        items: List[Dict[str, Any]] = []
+        for q in session.exec(stmt.execution_options(yield_per=EXPORT_CHUNK_SIZE)):
+            if not predicate(q_to_export_record(q)):
                 continue
+            if offset <= total < offset + limit:
+                items.append(to_item(q))
+            total += 1
 
-            clean_data = strip_signatures(record.get("data") or {})
+    return {"total": total, "limit": limit, "offset": offset, "items": items}
 
-            flat = {k: record.get(k) for k in base_fields}
-            flat_data = flatten(clean_data)
-            flat.update({f"data.{k}": v for k, v in flat_data.items()})
 
-            rows.append(flat)
-            all_keys.update(flat.keys())
+@router.post("/questionnaires/count")
+def count_questionnaires(payload: SearchPayload, user=Depends(require_admin)):
+    """
+    Number of questionnaires matching the rules, without returning them
+    (preview before exporting). A single COUNT(*) when every rule runs in SQL.
+    """
+    with get_read_session() as session:
+        clauses, predicate = search_plan(session, payload.rules)
 
-    fieldnames = sorted(all_keys)
+        if predicate is None:
+            count = session.exec(
+                select(func.count()).select_from(Questionnaire).where(*clauses)
+            ).one()
+        else:
+            stmt = select(Questionnaire).where(*clauses)
+            count = sum(
+                1 for q in session.exec(stmt.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+                if predicate(q_to_export_record(q))
+            )
 
-    out = io.StringIO()
-    writer = csv.DictWriter(out, fieldnames=fieldnames, extrasaction="ignore")
-    writer.writeheader()
-    for r in rows:
-        writer.writerow({k: r.get(k, "") for k in fieldnames})
+    return {"count": count, "in_memory": predicate is not None}
 
-    csv_bytes = out.getvalue().encode("utf-8")
 
-    return Response(
-        content=csv_bytes,
-        media_type="text/csv; charset=utf-8",
-        headers={
-            "Content-Disposition": 'attachment; filename="submitted_questionnaires.csv"',
-            "X-Export-Count": str(len(rows)),
-        },
-    )
+# -----------------------------
+# Diagnostics
+# -----------------------------
+@router.get("/db/pool")
+def db_pool_stats(user=Depends(require_admin)):
+    """
+    Connection pool checkout statistics for the primary database.
+    """
+    return pool_stats()
 
 
 # -----------------------------
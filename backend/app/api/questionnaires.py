@@ -1,19 +1,40 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header, Query
 from pydantic import BaseModel
-from typing import Any, Dict, Optional, List
+from typing import Any, AsyncIterator, Dict, Optional, List
 from datetime import datetime
+import asyncio
+import logging
 import uuid
 
-from fastapi.responses import Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy import func
 from sqlmodel import select
 
 from app.services.pdf import render_questionnaire_html, html_to_pdf_bytes
 from app.auth.router import get_current_user
-from app.auth.db import get_session
-from app.questionnaires.models import Questionnaire
+from app.auth.db import get_session, get_async_session
+from app.questionnaires.models import Questionnaire, QuestionnaireChange, QuestionnaireSearch
+from app.questionnaires.changes import change_row, changed_since, settled_watermark
+from app.questionnaires.drugs import build_drug_rows, delete_drug_rows_stmt
+from app.questionnaires.facts import build_facts, delete_facts_stmt
+from app.questionnaires.search import build_search_row, delete_search_stmt, search_ids
+from app.questionnaires.signatures import resolve_signatures, split_signatures, store_signature_blobs
+from app.services.change_feed import (
+    CHANGE_FEED_HEARTBEAT_SECONDS,
+    CHANGE_FEED_RETRY_MS,
+    ChangeEvent,
+    change_feed,
+)
+from app.services.column_registry import data_columns, register_columns
+from app.services.facet_cache import facet_cache, record_facets
+from app.services.facet_index import facet_index
+from app.services.stats_snapshot import stats_snapshot
 
 router = APIRouter(dependencies=[Depends(get_current_user)])
 
+logger = logging.getLogger(__name__)
+
 
 def now_iso() -> str:
     return datetime.utcnow().isoformat()
@@ -35,6 +56,19 @@ def _get_user_email(user) -> Optional[str]:
     return getattr(user, "email", None)
 
 
+def register_export_columns(session, data: Dict[str, Any]) -> None:
+    """
+    Best effort, after the record is committed: make sure the CSV export
+    registry knows every key this submitted record has. Exports also handle
+    unregistered keys, so a failure here only gets logged.
+    """
+    try:
+        register_columns(session, data_columns(data))
+    except Exception:
+        session.rollback()
+        logger.exception("Could not register export columns")
+
+
 def next_version_for_case(session, case_number: str) -> int:
     case_number = normalize_case(case_number)
     # Find max version for this case_number
@@ -53,6 +87,18 @@ class QuestionnairePayload(BaseModel):
     status: Optional[str] = None  # "draft" | "submitted"
 
 
+INDEX_COLUMNS = (
+    Questionnaire.id,
+    Questionnaire.case_number,
+    Questionnaire.version,
+    Questionnaire.status,
+    Questionnaire.created_at,
+    Questionnaire.updated_at,
+    Questionnaire.submitted_at,
+    Questionnaire.redo_of_id,
+)
+
+
 def q_to_index_row(q: Questionnaire) -> Dict[str, Any]:
     return {
         "id": q.id,
@@ -86,6 +132,8 @@ def create_questionnaire(payload: QuestionnairePayload, user=Depends(get_current
     if not case_number:
         raise HTTPException(status_code=422, detail="case_number is required")
 
+    data, signatures = split_signatures(payload.data)
+
     with get_session() as session:
         qid = uuid.uuid4().hex
         created_at = now_iso()
@@ -106,41 +154,187 @@ def create_questionnaire(payload: QuestionnairePayload, user=Depends(get_current
             redo_of_id=None,
             user_id=_get_user_id(user),
             user_email=_get_user_email(user),
-            data=payload.data,
+            data=data,
         )
 
+        store_signature_blobs(session, signatures)
+        drug_rows = build_drug_rows(q)
+        change = change_row(qid)
+        row = q_to_index_row(q)
         session.add(q)
+        session.add_all(drug_rows)
+        session.add(build_search_row(q))
+        session.add(change)
+        if record_status == "submitted":
+            facts = build_facts(q)
+            session.add(facts)
         session.commit()
+        change_feed.publish("create", change.seq, row)
+
+        if record_status == "submitted":
+            facet_cache.add(record_facets(facts, drug_rows))
+            stats_snapshot.add(facts, drug_rows)
+            facet_index.add(facts, drug_rows)
+            register_export_columns(session, data)
 
     return {"id": qid, "case_number": case_number, "version": version}
 
 
 @router.get("/questionnaires")
-def list_questionnaires():
+async def list_questionnaires(response: Response):
     """
-    Returns the lightweight index for dashboards (fast).
+    Returns the lightweight index for dashboards (fast). X-Last-Event-Id is
+    a change-feed seq the list already covers: subscribe with
+    ?last_event_id= so writes landing after this read are replayed.
+    """
+    async with get_async_session() as session:
+        # Read before the list, settled so in-flight lower seqs still replay
+        response.headers["X-Last-Event-Id"] = str(await session.run_sync(settled_watermark))
+        # Index columns only: skip loading every record's data JSON
+        qs = (await session.exec(
+            select(*INDEX_COLUMNS).order_by(Questionnaire.created_at.desc())
+        )).all()
+        return [q_to_index_row(q) for q in qs]
+
+
+SEARCH_MAX_LIMIT = 100
+
+
+@router.get("/questionnaires/search")
+def search_questionnaires(q: str = Query(..., min_length=1), limit: int = Query(20, ge=1, le=SEARCH_MAX_LIMIT)):
+    """
+    Case number prefix (autocomplete), client / collector name and free-text
+    search. Returns index rows plus the names, best matches first.
     """
     with get_session() as session:
-        qs = session.exec(
-            select(Questionnaire).order_by(Questionnaire.created_at.desc())
+        ids = search_ids(session, q, limit)
+        if not ids:
+            return []
+
+        rows = session.exec(
+            select(*INDEX_COLUMNS, QuestionnaireSearch.client_name, QuestionnaireSearch.collector_name)
+            .join(QuestionnaireSearch, QuestionnaireSearch.questionnaire_id == Questionnaire.id)
+            .where(Questionnaire.id.in_(ids))
         ).all()
-        return [q_to_index_row(q) for q in qs]
 
+    by_id = {
+        r.id: {**q_to_index_row(r), "client_name": r.client_name, "collector_name": r.collector_name}
+        for r in rows
+    }
+    return [by_id[qid] for qid in ids if qid in by_id]
 
-@router.get("/questionnaires/{qid}")
-def get_questionnaire(qid: str):
+
+# -----------------------------
+# Change feed (Server-Sent Events)
+# -----------------------------
+def replay_from_log(last_id: int) -> List[ChangeEvent]:
     """
-    Returns the full record including data.
+    Events after last_id rebuilt from the change log, for ids the in-memory
+    buffer no longer covers. Repeated changes collapse to the current state,
+    sent as "update" (or "delete").
     """
     with get_session() as session:
-        q = session.get(Questionnaire, qid)
+        upto = session.exec(select(func.max(QuestionnaireChange.seq))).one() or 0
+        changes = changed_since(session, last_id, upto)
+        ids = [qid for qid, _ in changes]
+        rows = {}
+        for start in range(0, len(ids), 500):
+            for r in session.exec(select(*INDEX_COLUMNS).where(Questionnaire.id.in_(ids[start:start + 500]))):
+                rows[r.id] = q_to_index_row(r)
+
+    return [
+        ChangeEvent(id=seq, event="update", data=rows[qid]) if qid in rows
+        else ChangeEvent(id=seq, event="delete", data={"id": qid})
+        for qid, seq in changes
+    ]
+
+
+def buffer_covers_log(last_id: int, events: List[ChangeEvent]) -> bool:
+    """
+    True if the change log has exactly the buffered events after last_id,
+    i.e. no other process wrote in between.
+    """
+    with get_session() as session:
+        seqs = session.exec(
+            select(QuestionnaireChange.seq)
+            .where(QuestionnaireChange.seq > last_id)
+            .order_by(QuestionnaireChange.seq)
+            .limit(len(events) + 1)
+        ).all()
+    return list(seqs) == [e.id for e in events]
+
+
+async def event_stream(last_id: Optional[int]) -> AsyncIterator[str]:
+    # Subscribe before replaying so nothing committed meanwhile is missed
+    sub = change_feed.subscribe()
+    try:
+        yield f"retry: {CHANGE_FEED_RETRY_MS}\n\n"
+
+        replayed = set()
+        if last_id is not None:
+            events = change_feed.buffered_since(last_id)
+            if events is None or not await run_in_threadpool(buffer_covers_log, last_id, events):
+                events = await run_in_threadpool(replay_from_log, last_id)
+            for e in events:
+                replayed.add(e.id)
+                yield e.encode()
+
+        while True:
+            try:
+                e = await asyncio.wait_for(sub.queue.get(), CHANGE_FEED_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            if e is None:
+                return  # fell too far behind; the client reconnects and replays
+            if e.id not in replayed:
+                yield e.encode()
+    finally:
+        change_feed.unsubscribe(sub)
+
+
+@router.get("/questionnaires/events")
+async def questionnaire_events(
+    last_event_id: Optional[int] = Query(None, ge=0),
+    last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID"),
+):
+    """
+    SSE stream of create / update / finalize / delete events carrying the
+    list index row (delete: just the id), so dashboards can patch their list
+    instead of refetching it. Event ids are change-log seqs: EventSource
+    resends the last one as Last-Event-ID on reconnect, and ?last_event_id=
+    resumes a new connection.
+    """
+    last_id = last_event_id
+    if last_event_id_header:
+        try:
+            last_id = int(last_event_id_header)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+
+    return StreamingResponse(
+        event_stream(last_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/questionnaires/{qid}")
+async def get_questionnaire(qid: str):
+    """
+    Returns the full record including data (signatures as data URIs).
+    """
+    async with get_async_session() as session:
+        q = await session.get(Questionnaire, qid)
         if not q:
             raise HTTPException(status_code=404, detail="Not found")
-        return q_to_full_record(q)
+        record = q_to_full_record(q)
+        record["data"] = await session.run_sync(resolve_signatures, record["data"])
+        return record
 
 
 @router.put("/questionnaires/{qid}")
-def update_questionnaire(qid: str, payload: QuestionnairePayload):
+async def update_questionnaire(qid: str, payload: QuestionnairePayload):
     """
     Update questionnaire data (draft-only).
     case_number is required and cannot be changed after creation.
@@ -149,8 +343,8 @@ def update_questionnaire(qid: str, payload: QuestionnairePayload):
     if not incoming_case:
         raise HTTPException(status_code=422, detail="case_number is required")
 
-    with get_session() as session:
-        q = session.get(Questionnaire, qid)
+    async with get_async_session() as session:
+        q = await session.get(Questionnaire, qid)
         if not q:
             raise HTTPException(status_code=404, detail="Not found")
 
@@ -166,22 +360,30 @@ def update_questionnaire(qid: str, payload: QuestionnairePayload):
                 detail="case_number cannot be changed after creation.",
             )
 
-        q.data = payload.data
+        data, signatures = split_signatures(payload.data)
+        await session.run_sync(store_signature_blobs, signatures)
+        q.data = data
         q.updated_at = now_iso()
 
         session.add(q)
-        session.commit()
+        await session.exec(delete_drug_rows_stmt(qid))
+        session.add_all(build_drug_rows(q))
+        await session.merge(build_search_row(q))
+        change = change_row(qid)
+        session.add(change)
+        await session.commit()
+        change_feed.publish("update", change.seq, q_to_index_row(q))
 
     return {"ok": True}
 
 
 @router.post("/questionnaires/{qid}/finalize")
-def finalize_questionnaire(qid: str):
+async def finalize_questionnaire(qid: str):
     """
     Mark a questionnaire submitted/locked.
     """
-    with get_session() as session:
-        q = session.get(Questionnaire, qid)
+    async with get_async_session() as session:
+        q = await session.get(Questionnaire, qid)
         if not q:
             raise HTTPException(status_code=404, detail="Not found")
 
@@ -189,6 +391,8 @@ def finalize_questionnaire(qid: str):
         if not case_number:
             raise HTTPException(status_code=422, detail="case_number is required")
 
+        already_submitted = q.status == "submitted"
+
         ts = now_iso()
         q.case_number = case_number
         q.status = "submitted"
@@ -196,7 +400,23 @@ def finalize_questionnaire(qid: str):
         q.updated_at = ts
 
         session.add(q)
-        session.commit()
+        # Same transaction: facts/drug rows never disagree with the submitted record
+        facts = await session.merge(build_facts(q))
+        drug_rows = build_drug_rows(q)
+        await session.exec(delete_drug_rows_stmt(qid))
+        session.add_all(drug_rows)
+        await session.merge(build_search_row(q))
+        change = change_row(qid)
+        session.add(change)
+        await session.commit()
+        change_feed.publish("finalize", change.seq, q_to_index_row(q))
+
+        if not already_submitted:
+            facet_cache.add(record_facets(facts, drug_rows))
+        stats_snapshot.add(facts, drug_rows)
+        facet_index.add(facts, drug_rows)
+
+        await session.run_sync(register_export_columns, q.data or {})
 
         return {"ok": True, "id": q.id, "case_number": q.case_number, "version": q.version}
 
@@ -234,8 +454,14 @@ def redo_questionnaire(qid: str, user=Depends(get_current_user)):
             data=old.data or {},
         )
 
+        change = change_row(new_id)
+        row = q_to_index_row(q)
         session.add(q)
+        session.add_all(build_drug_rows(q))
+        session.add(build_search_row(q))
+        session.add(change)
         session.commit()
+        change_feed.publish("create", change.seq, row)
 
         return {"id": new_id, "case_number": case_number, "version": version, "redo_of_id": old.id}
 
@@ -247,7 +473,7 @@ def generate_pdf(qid: str):
         if not q:
             raise HTTPException(status_code=404, detail="Not found")
 
-        html = render_questionnaire_html(q.data or {})
+        html = render_questionnaire_html(resolve_signatures(session, q.data or {}))
         pdf_bytes = html_to_pdf_bytes(html)
 
         filename = f"{q.case_number or 'case'}_v{q.version}_{qid}.pdf"
@@ -269,7 +495,22 @@ def delete_questionnaire(qid: str):
         if not q:
             raise HTTPException(status_code=404, detail="Not found")
 
+        was_submitted = q.status == "submitted"
+        if was_submitted:
+            facets = record_facets(build_facts(q), build_drug_rows(q))
+
+        session.exec(delete_facts_stmt(qid))
+        session.exec(delete_drug_rows_stmt(qid))
+        session.exec(delete_search_stmt(qid))
         session.delete(q)
+        change = change_row(qid, "delete")
+        session.add(change)
         session.commit()
+        change_feed.publish("delete", change.seq, {"id": qid})
+
+        if was_submitted:
+            facet_cache.remove(facets)
+            stats_snapshot.remove(qid)
+            facet_index.remove(qid)
 
     return {"ok": True, "id": qid}
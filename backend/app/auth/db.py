@@ -1,12 +1,29 @@
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Any, Dict, Optional
+import logging
+import threading
+import time
 
 from sqlmodel import SQLModel, Field, create_engine, Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import Index, delete, event, inspect, or_, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
 import os
 from pathlib import Path
 
 # ✅ Import models so SQLModel knows to create tables
 from app.questionnaires.models import Questionnaire  # noqa: F401
+from app.questionnaires.backfills import run_once
+from app.questionnaires.changes import seed_change_log, seed_data_generation
+from app.questionnaires.drugs import backfill_drug_rows
+from app.questionnaires.facts import backfill_facts
+from app.questionnaires.search import backfill_search_rows, ensure_search_index
+from app.questionnaires.signatures import backfill_signature_blobs
+from app.services.column_registry import seed_registry
+from app.services.export_query import ensure_export_columns
+
+logger = logging.getLogger(__name__)
 
 
 # -----------------------------
@@ -14,15 +31,212 @@ from app.questionnaires.models import Questionnaire  # noqa: F401
 # -----------------------------
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Connection pool tuning (both backends use a QueuePool)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))  # seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds before a connection is replaced
+
+# SQLite pragmas (local dev)
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(64 * 1024 * 1024)))
+
+POOL_KWARGS = dict(
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=True,
+)
+
 if DATABASE_URL:
     # Render Postgres (recommended)
-    engine = create_engine(DATABASE_URL, echo=False, pool_pre_ping=True)
+    engine = create_engine(DATABASE_URL, echo=False, **POOL_KWARGS)
 else:
     # Local dev fallback (SQLite file)
     DEFAULT_DB_PATH = Path(__file__).resolve().parent.parent / "data" / "auth.sqlite"
     DB_PATH = Path(os.getenv("AUTH_DB_PATH", str(DEFAULT_DB_PATH))).resolve()
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    engine = create_engine(f"sqlite:///{DB_PATH}", echo=False)
+    engine = create_engine(f"sqlite:///{DB_PATH}", echo=False, **POOL_KWARGS)
+
+
+def set_sqlite_pragmas(dbapi_conn, connection_record):
+    """
+    WAL lets readers run alongside a writer, and busy_timeout makes writers
+    wait for the lock instead of failing with "database is locked".
+    """
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cur.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cur.close()
+
+
+if engine.dialect.name == "sqlite":
+    event.listen(engine, "connect", set_sqlite_pragmas)
+
+
+# -----------------------------
+# Read replica (optional) for admin exports / analytics
+# -----------------------------
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+
+# Fall back to the primary when the replica is further behind than this
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "30"))
+# How long a replica health/lag check is trusted before re-checking
+REPLICA_CHECK_INTERVAL_SECONDS = float(os.getenv("REPLICA_CHECK_INTERVAL_SECONDS", "10"))
+# An unreachable replica fails the check after this instead of a full TCP timeout
+REPLICA_CONNECT_TIMEOUT_SECONDS = int(os.getenv("REPLICA_CONNECT_TIMEOUT_SECONDS", "3"))
+
+replica_engine = None
+if DATABASE_REPLICA_URL:
+    replica_connect_args = (
+        {"connect_timeout": REPLICA_CONNECT_TIMEOUT_SECONDS}
+        if make_url(DATABASE_REPLICA_URL).get_backend_name() == "postgresql"
+        else {}
+    )
+    replica_engine = create_engine(DATABASE_REPLICA_URL, echo=False, connect_args=replica_connect_args, **POOL_KWARGS)
+    if replica_engine.dialect.name == "sqlite":
+        event.listen(replica_engine, "connect", set_sqlite_pragmas)
+
+# checking: a thread is probing the replica; others keep the last result meanwhile
+_replica_state: Dict[str, Any] = {"checked_at": 0.0, "usable": False, "lag_seconds": None, "checking": False}
+_replica_lock = threading.Lock()
+
+
+def replica_lag_seconds() -> float:
+    """
+    Replication delay of the replica in seconds (0 for a non-Postgres
+    stand-in such as a SQLite copy). Raises if the replica is unreachable.
+    """
+    with replica_engine.connect() as conn:
+        if replica_engine.dialect.name != "postgresql":
+            conn.execute(text("SELECT 1"))
+            return 0.0
+        # An idle primary makes pg_last_xact_replay_timestamp() look old, so
+        # treat "everything received has been replayed" as caught up.
+        lag = conn.execute(text(
+            """
+            SELECT CASE
+                WHEN NOT pg_is_in_recovery() THEN 0
+                WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+            END
+            """
+        )).scalar()
+        return float(lag or 0)
+
+
+def replica_is_usable() -> bool:
+    if replica_engine is None:
+        return False
+
+    # The probe runs outside the lock: a slow or unreachable replica must
+    # not block every reader, only the one thread doing the check
+    with _replica_lock:
+        fresh = time.monotonic() - _replica_state["checked_at"] < REPLICA_CHECK_INTERVAL_SECONDS
+        if fresh or _replica_state["checking"]:
+            return _replica_state["usable"]
+        _replica_state["checking"] = True
+
+    lag, usable = None, False
+    try:
+        lag = replica_lag_seconds()
+        usable = lag <= REPLICA_MAX_LAG_SECONDS
+        if not usable:
+            logger.warning("Replica lag %.1fs exceeds %.1fs; reading from primary", lag, REPLICA_MAX_LAG_SECONDS)
+    except Exception:
+        logger.exception("Replica unreachable; reading from primary")
+    finally:
+        with _replica_lock:
+            _replica_state.update(checked_at=time.monotonic(), usable=usable, lag_seconds=lag, checking=False)
+    return usable
+
+
+# -----------------------------
+# Async engine (same database, asyncpg / aiosqlite drivers)
+# -----------------------------
+def to_async_url(url) -> str:
+    """
+    postgres://, postgresql://, postgresql+psycopg2:// -> postgresql+asyncpg://
+    sqlite:/// -> sqlite+aiosqlite:///
+    """
+    u = make_url(str(url).replace("postgres://", "postgresql://", 1))
+    if u.get_backend_name() == "postgresql":
+        query = dict(u.query)
+        # asyncpg takes "ssl" rather than libpq's "sslmode"
+        if "sslmode" in query:
+            query["ssl"] = query.pop("sslmode")
+        u = u.set(drivername="postgresql+asyncpg", query=query)
+    elif u.get_backend_name() == "sqlite":
+        u = u.set(drivername="sqlite+aiosqlite")
+    return u.render_as_string(hide_password=False)
+
+
+async_engine = create_async_engine(to_async_url(engine.url), echo=False, **POOL_KWARGS)
+
+if async_engine.dialect.name == "sqlite":
+    event.listen(async_engine.sync_engine, "connect", set_sqlite_pragmas)
+
+
+# -----------------------------
+# Pool statistics
+# -----------------------------
+_pool_counters: Dict[str, Dict[str, int]] = {}
+
+
+def _watch_pool(name: str, sync_engine) -> None:
+    counters = _pool_counters.setdefault(
+        name, {"connects": 0, "checkouts": 0, "checkins": 0, "invalidated": 0}
+    )
+
+    def _count(key: str):
+        def _listener(*args):
+            counters[key] += 1
+        return _listener
+
+    event.listen(sync_engine, "connect", _count("connects"))
+    event.listen(sync_engine, "checkout", _count("checkouts"))
+    event.listen(sync_engine, "checkin", _count("checkins"))
+    event.listen(sync_engine, "invalidate", _count("invalidated"))
+
+
+_watch_pool("sync", engine)
+_watch_pool("async", async_engine.sync_engine)
+if replica_engine is not None:
+    _watch_pool("replica", replica_engine)
+
+
+def _pool_snapshot(name: str, sync_engine) -> Dict[str, Any]:
+    pool = sync_engine.pool
+    stats: Dict[str, Any] = {
+        "backend": sync_engine.dialect.name,
+        "driver": sync_engine.dialect.driver,
+        "pool_class": type(pool).__name__,
+        "status": pool.status(),
+        **_pool_counters[name],
+    }
+    # QueuePool exposes live sizes; other pool classes may not
+    for attr in ("size", "checkedin", "checkedout", "overflow"):
+        fn = getattr(pool, attr, None)
+        if callable(fn):
+            stats[attr] = fn()
+    return stats
+
+
+def pool_stats() -> Dict[str, Any]:
+    stats = {
+        "sync": _pool_snapshot("sync", engine),
+        "async": _pool_snapshot("async", async_engine.sync_engine),
+    }
+    if replica_engine is not None:
+        stats["replica"] = {
+            **_pool_snapshot("replica", replica_engine),
+            "usable": _replica_state["usable"],
+            "lag_seconds": _replica_state["lag_seconds"],
+        }
+    return stats
 
 
 def utcnow_iso() -> str:
@@ -51,6 +265,11 @@ class AuthToken(SQLModel, table=True):
     Stores hashed, expiring, single-use tokens.
     purpose: "verify_email" | "reset_password"
     """
+    __table_args__ = (
+        # find_valid_auth_token looks tokens up by (token_hash, purpose)
+        Index("ix_authtoken_token_hash_purpose", "token_hash", "purpose"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
 
     user_id: int = Field(index=True, foreign_key="user.id")
@@ -70,12 +289,85 @@ class AuthToken(SQLModel, table=True):
 def init_db():
     # Creates User/AuthToken/Questionnaire tables (because models are imported)
     SQLModel.metadata.create_all(engine)
+    ensure_columns()
+    ensure_indexes()
+    ensure_export_columns(engine)
+    seed_data_generation(engine)
+
+    written = run_once(engine, "questionnaire_facts", backfill_facts)
+    if written:
+        logger.info("Backfilled questionnaire_facts for %d submitted questionnaires", written)
+
+    written = run_once(engine, "questionnaire_drug", backfill_drug_rows)
+    if written:
+        logger.info("Backfilled %d questionnaire_drug rows", written)
+
+    ensure_search_index(engine)
+    written = run_once(engine, "questionnaire_search", backfill_search_rows)
+    if written:
+        logger.info("Backfilled questionnaire_search for %d questionnaires", written)
+
+    written = run_once(engine, "signature_blob", backfill_signature_blobs)
+    if written:
+        logger.info("Moved signatures of %d questionnaires to signature_blob", written)
+
+    with Session(engine) as session:
+        seed_registry(session)
+
+    written = seed_change_log(engine)
+    if written:
+        logger.info("Seeded questionnaire_change with %d existing questionnaires", written)
+
+
+def ensure_columns():
+    """
+    create_all() doesn't alter existing tables either, so add nullable
+    columns introduced later to existing databases.
+    """
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in existing or not col.nullable:
+                    continue
+                conn.execute(text(
+                    f"ALTER TABLE {preparer.format_table(table)} "
+                    f"ADD COLUMN {preparer.format_column(col)} {col.type.compile(dialect=engine.dialect)}"
+                ))
+
+
+def ensure_indexes():
+    """
+    create_all() only creates indexes for brand new tables, so add any
+    indexes introduced later to existing databases as well.
+    """
+    for table in SQLModel.metadata.sorted_tables:
+        for idx in table.indexes:
+            idx.create(bind=engine, checkfirst=True)
 
 
 def get_session():
     return Session(engine)
 
 
+def get_read_session() -> Session:
+    """
+    Session for read-only admin/analytics queries: the replica when one is
+    configured, reachable and fresh enough, otherwise the primary.
+    Never write through this session.
+    """
+    if replica_is_usable():
+        return Session(replica_engine)
+    return Session(engine)
+
+
+def get_async_session() -> AsyncSession:
+    # No expiry on commit: attributes stay readable without an implicit (sync) reload
+    return AsyncSession(async_engine, expire_on_commit=False)
+
+
 def get_user_by_email(session: Session, email: str) -> Optional[User]:
     return session.exec(select(User).where(User.email == email)).first()
 
@@ -84,6 +376,10 @@ def get_user_by_id(session: Session, user_id: int) -> Optional[User]:
     return session.get(User, user_id)
 
 
+async def get_user_by_id_async(session: AsyncSession, user_id: int) -> Optional[User]:
+    return await session.get(User, user_id)
+
+
 # -----------------------------
 # Token helpers
 # -----------------------------
@@ -143,6 +439,40 @@ def mark_auth_token_used(session: Session, token_id: int) -> None:
     session.commit()
 
 
+AUTH_TOKEN_PURGE_BATCH_SIZE = int(os.getenv("AUTH_TOKEN_PURGE_BATCH_SIZE", "500"))
+
+
+def purge_expired_auth_tokens(batch_size: int = AUTH_TOKEN_PURGE_BATCH_SIZE) -> int:
+    """
+    Deletes expired or already-used tokens in small batches (one short
+    transaction per batch, so the table is never locked for long).
+    Returns the number of rows removed.
+    """
+    # expires_at/used_at are ISO strings in UTC, so string comparison is safe
+    now = utcnow_iso()
+    removed = 0
+
+    while True:
+        with get_session() as session:
+            ids = session.exec(
+                select(AuthToken.id)
+                .where(or_(AuthToken.used_at.is_not(None), AuthToken.expires_at <= now))
+                .order_by(AuthToken.id)
+                .limit(batch_size)
+            ).all()
+            if not ids:
+                break
+
+            session.exec(delete(AuthToken).where(AuthToken.id.in_(ids)))
+            session.commit()
+            removed += len(ids)
+
+        if len(ids) < batch_size:
+            break
+
+    return removed
+
+
 def set_user_verified(session: Session, user_id: int) -> None:
     u = session.get(User, user_id)
     if not u:
@@ -21,8 +21,10 @@ from app.auth.security import (
 from app.auth.db import (
     init_db,
     get_session,
+    get_async_session,
     get_user_by_email,
     get_user_by_id,
+    get_user_by_id_async,
     User,
 )
 
@@ -73,7 +75,7 @@ def clear_session_cookie(resp: Response):
     )
 
 
-def get_current_user(request: Request, response: Response) -> User:
+async def get_current_user(request: Request, response: Response) -> User:
     token = request.cookies.get(COOKIE_NAME)
     if not token:
         raise HTTPException(status_code=401, detail="Not logged in")
@@ -86,8 +88,10 @@ def get_current_user(request: Request, response: Response) -> User:
     if not user_id:
         raise HTTPException(status_code=401, detail="Invalid session")
 
-    with get_session() as session:
-        user = get_user_by_id(session, int(user_id))
+    # Runs on every authenticated request, so it uses the async engine
+    # rather than tying up a threadpool worker.
+    async with get_async_session() as session:
+        user = await get_user_by_id_async(session, int(user_id))
         if not user or not user.is_active:
             raise HTTPException(status_code=401, detail="Account inactive")
 
@@ -155,7 +159,7 @@ def logout(response: Response):
 
 
 @router.get("/me")
-def me(user: User = Depends(get_current_user)):
+async def me(user: User = Depends(get_current_user)):
     return {"ok": True, "email": user.email, "role": user.role}
 
 
@@ -1,18 +1,86 @@
+import asyncio
+import logging
+import os
+
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
 from app.api.questionnaires import router as questionnaires_router
 from app.api.admin import router as admin_router
 from app.auth.router import router as auth_router
-from app.auth.db import init_db
+from app.auth.db import get_session, init_db, purge_expired_auth_tokens, async_engine
+from app.services.export_jobs import fail_interrupted_jobs, purge_expired_jobs
+from app.services.facet_index import facet_index
+
+logger = logging.getLogger(__name__)
+
+# How often expired/used auth tokens are purged (0 = only once at startup)
+AUTH_TOKEN_PURGE_INTERVAL_SECONDS = int(os.getenv("AUTH_TOKEN_PURGE_INTERVAL_SECONDS", "3600"))
+
+# How often expired export job artifacts are removed (0 = only once at startup)
+EXPORT_JOB_PURGE_INTERVAL_SECONDS = int(os.getenv("EXPORT_JOB_PURGE_INTERVAL_SECONDS", "3600"))
 
 app = FastAPI(title="FTS Questionnaire API")
 
+
+async def _purge_auth_tokens_periodically():
+    while True:
+        await asyncio.sleep(AUTH_TOKEN_PURGE_INTERVAL_SECONDS)
+        try:
+            removed = await run_in_threadpool(purge_expired_auth_tokens)
+            logger.info("Auth token purge removed %d rows", removed)
+        except Exception:
+            logger.exception("Auth token purge failed")
+
+
+async def _purge_export_jobs_periodically():
+    while True:
+        await asyncio.sleep(EXPORT_JOB_PURGE_INTERVAL_SECONDS)
+        try:
+            failed = await run_in_threadpool(fail_interrupted_jobs)
+            if failed:
+                logger.warning("Marked %d interrupted export jobs as failed", failed)
+            removed = await run_in_threadpool(purge_expired_jobs)
+            logger.info("Export job purge removed %d jobs", removed)
+        except Exception:
+            logger.exception("Export job purge failed")
+
+
 @app.on_event("startup")
 def _startup():
     init_db()
 
+    with get_session() as session:
+        facet_index.rebuild(session)
+
+    removed = purge_expired_auth_tokens()
+    logger.info("Auth token purge removed %d rows", removed)
+
+    failed = fail_interrupted_jobs()
+    if failed:
+        logger.warning("Marked %d interrupted export jobs as failed", failed)
+    removed = purge_expired_jobs()
+    logger.info("Export job purge removed %d jobs", removed)
+
+
+@app.on_event("startup")
+async def _start_background_jobs():
+    if AUTH_TOKEN_PURGE_INTERVAL_SECONDS > 0:
+        app.state.auth_token_purge_task = asyncio.create_task(_purge_auth_tokens_periodically())
+    if EXPORT_JOB_PURGE_INTERVAL_SECONDS > 0:
+        app.state.export_job_purge_task = asyncio.create_task(_purge_export_jobs_periodically())
+
+
+@app.on_event("shutdown")
+async def _shutdown():
+    for name in ("auth_token_purge_task", "export_job_purge_task"):
+        task = getattr(app.state, name, None)
+        if task:
+            task.cancel()
+    await async_engine.dispose()
+
 
 # CORS (cookies require allow_credentials + explicit origins)
 app.add_middleware(
@@ -27,6 +95,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # The list's change-feed cursor, read by the dashboard
+    expose_headers=["X-Last-Event-Id"],
 )
 
 @app.get("/health")
@@ -0,0 +1,38 @@
+from __future__ import annotations
+from typing import Callable
+
+from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session
+
+from app.questionnaires.models import BackfillMarker
+
+
+def run_once(engine, name: str, backfill: Callable[..., int]) -> int:
+    """
+    Runs backfill(engine) unless it completed before. The marker is only
+    written after it returns, so an interrupted backfill resumes next boot.
+    Returns rows written.
+    """
+    with Session(engine) as session:
+        if session.get(BackfillMarker, name) is not None:
+            return 0
+
+    written = backfill(engine)
+    with Session(engine) as session:
+        session.add(BackfillMarker(name=name))
+        try:
+            session.commit()
+        except IntegrityError:
+            session.rollback()  # another worker finished it at the same time
+    return written
+
+
+def reset_markers(engine) -> None:
+    """
+    Forgets completed backfills, e.g. after rows were loaded without their
+    derived tables (snapshot restore), so the next init_db runs them again.
+    """
+    with Session(engine) as session:
+        session.exec(delete(BackfillMarker))
+        session.commit()
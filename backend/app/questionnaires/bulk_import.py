@@ -0,0 +1,306 @@
+"""
+Bulk import of questionnaires from the old file-based storage
+(one JSON document per questionnaire, named <id>.json).
+
+Files are parsed, validated and normalised in a process pool; rows are
+upserted on id in batches, together with their facts, drug, search and
+signature rows and a change-log entry, one transaction per batch. An
+existing row is only overwritten when the file's updated_at is newer:
+
+    python -m app.questionnaires.bulk_import                 # backend/data/questionnaires
+    python -m app.questionnaires.bulk_import --dir /mnt/old --workers 8 --batch-size 2000
+
+After each batch the last imported file name is written to the checkpoint
+file; a rerun continues after it (files are processed in name order).
+Rerunning from scratch (--restart) only rewrites rows still older than
+their file, so questionnaires edited in the app since the import are kept.
+Restart the API afterwards so its in-memory facet/stats indexes include
+the imported rows.
+"""
+from __future__ import annotations
+from datetime import datetime, timezone
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import json
+import os
+import sys
+import time
+
+from sqlalchemy import delete, insert
+
+from app.questionnaires.changes import bump_generation
+from app.questionnaires.drugs import build_drug_rows
+from app.questionnaires.facts import build_facts
+from app.questionnaires.models import (
+    Questionnaire,
+    QuestionnaireChange,
+    QuestionnaireDrug,
+    QuestionnaireFacts,
+    QuestionnaireSearch,
+    SignatureBlob,
+)
+from app.questionnaires.search import build_search_row
+from app.questionnaires.signatures import split_signatures
+
+
+DEFAULT_IMPORT_DIR = Path(__file__).resolve().parents[2] / "data" / "questionnaires"
+CHECKPOINT_NAME = ".import_checkpoint.json"
+# List of the old storage, not a questionnaire
+LEGACY_INDEX_NAME = "index.json"
+
+DEFAULT_BATCH_SIZE = 1000
+# Files handed to a worker at a time
+PARSE_CHUNK_SIZE = 64
+# Seconds between progress lines
+REPORT_EVERY = 5.0
+
+STATUSES = ("draft", "submitted")
+DERIVED_TABLES = (QuestionnaireFacts, QuestionnaireDrug, QuestionnaireSearch)
+
+
+# -----------------------------
+# Parsing (runs in the worker processes)
+# -----------------------------
+def _timestamp(value: Any) -> Optional[str]:
+    """
+    Naive UTC ISO string like the rest of the table; None if blank.
+    """
+    if value in (None, ""):
+        return None
+    d = datetime.fromisoformat(str(value).strip().replace("Z", "+00:00"))
+    if d.tzinfo is not None:
+        d = d.astimezone(timezone.utc).replace(tzinfo=None)
+    return d.isoformat()
+
+
+def normalise_record(raw: Any, fallback_id: str, fallback_ts: str) -> Questionnaire:
+    """
+    Validated Questionnaire from one legacy document. Raises ValueError.
+    """
+    if not isinstance(raw, dict):
+        raise ValueError("not a JSON object")
+    data = raw.get("data")
+    if not isinstance(data, dict):
+        raise ValueError("data is not an object")
+
+    qid = str(raw.get("id") or fallback_id).strip()
+    case_number = str(raw.get("case_number") or data.get("case_number") or "").strip()
+    if not case_number:
+        raise ValueError("case_number is required")
+
+    version = int(raw.get("version") or 1)
+    if version < 1:
+        raise ValueError(f"invalid version {version}")
+
+    status = raw.get("status") if raw.get("status") in STATUSES else "draft"
+    created_at = _timestamp(raw.get("created_at")) or fallback_ts
+    updated_at = _timestamp(raw.get("updated_at")) or created_at
+    submitted_at = (_timestamp(raw.get("submitted_at")) or updated_at) if status == "submitted" else None
+
+    user_id = raw.get("user_id")
+    return Questionnaire(
+        id=qid,
+        case_number=case_number,
+        version=version,
+        status=status,
+        created_at=created_at,
+        updated_at=updated_at,
+        submitted_at=submitted_at,
+        redo_of_id=raw.get("redo_of_id") or None,
+        user_id=int(user_id) if user_id not in (None, "") else None,
+        user_email=raw.get("user_email") or None,
+        data=data,
+    )
+
+
+def parse_file(path: str) -> Tuple[str, Optional[Dict[str, List[Dict[str, Any]]]], Optional[str]]:
+    """
+    (file name, rows per table, error). Rows are plain dicts so they pickle
+    cheaply back to the writer.
+    """
+    p = Path(path)
+    try:
+        with open(p, "rb") as f:
+            raw = json.load(f)
+        mtime = datetime.fromtimestamp(p.stat().st_mtime, tz=timezone.utc).replace(tzinfo=None)
+        q = normalise_record(raw, p.stem, mtime.isoformat())
+    except (OSError, ValueError, TypeError) as e:
+        return p.name, None, f"{type(e).__name__}: {e}"
+
+    q.data, blobs = split_signatures(q.data)
+    drugs = [r.model_dump(exclude={"id"}) for r in build_drug_rows(q)]
+    return p.name, {
+        "questionnaire": [q.model_dump()],
+        "facts": [build_facts(q).model_dump()] if q.status == "submitted" else [],
+        "drugs": drugs,
+        "search": [build_search_row(q).model_dump()],
+        "blobs": [b.model_dump() for b in blobs],
+    }, None
+
+
+# -----------------------------
+# Loading
+# -----------------------------
+def _dialect_insert(engine):
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif engine.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        raise RuntimeError(f"Unsupported database: {engine.dialect.name}")
+    return dialect_insert
+
+
+def write_batch(engine, records: List[Dict[str, List[Dict[str, Any]]]]) -> int:
+    """
+    Upserts one batch in a single transaction (executemany, which
+    SQLAlchemy sends as multi-row VALUES pages). Existing rows are only
+    updated when the file is newer; derived rows, change rows and the
+    generation bump follow the rows actually written. Returns their count.
+    """
+    dialect_insert = _dialect_insert(engine)
+
+    # Last occurrence wins: one statement may not upsert the same id twice
+    by_id = {r["questionnaire"][0]["id"]: r for r in records}
+
+    upsert = dialect_insert(Questionnaire)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[Questionnaire.id],
+        set_={c.name: upsert.excluded[c.name] for c in Questionnaire.__table__.columns if c.name != "id"},
+        # Never revert an edit made in the app since the file was written
+        where=Questionnaire.updated_at < upsert.excluded.updated_at,
+    ).returning(Questionnaire.id)
+    now = datetime.utcnow().isoformat()
+
+    with engine.begin() as conn:
+        ids = list(conn.execute(upsert, [r["questionnaire"][0] for r in by_id.values()]).scalars())
+        if not ids:
+            return 0
+        records = [by_id[qid] for qid in ids]
+
+        blobs = {b["hash"]: b for r in records for b in r["blobs"]}
+        if blobs:
+            conn.execute(dialect_insert(SignatureBlob).on_conflict_do_nothing(), list(blobs.values()))
+
+        for model in DERIVED_TABLES:
+            conn.execute(delete(model).where(model.questionnaire_id.in_(ids)))
+        for model, key in ((QuestionnaireFacts, "facts"), (QuestionnaireDrug, "drugs"), (QuestionnaireSearch, "search")):
+            rows = [row for r in records for row in r[key]]
+            if rows:
+                conn.execute(insert(model), rows)
+
+        conn.execute(insert(QuestionnaireChange), [
+            {"questionnaire_id": qid, "op": "upsert", "changed_at": now} for qid in ids
+        ])
+        conn.execute(bump_generation())
+    return len(ids)
+
+
+def read_checkpoint(path: Path) -> Optional[str]:
+    try:
+        return json.loads(path.read_text()).get("last_file")
+    except (OSError, ValueError):
+        return None
+
+
+def write_checkpoint(path: Path, last_file: str, rows: int) -> None:
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps({"last_file": last_file, "rows": rows, "at": datetime.utcnow().isoformat()}))
+    tmp.replace(path)
+
+
+def run_import(
+    engine,
+    directory: Path,
+    workers: int,
+    batch_size: int,
+    checkpoint: Path,
+    restart: bool = False,
+    out=sys.stdout,
+) -> Dict[str, Any]:
+    files = sorted(
+        f for f in directory.glob("*.json")
+        if f.name != LEGACY_INDEX_NAME and not f.name.startswith(".")  # checkpoint
+    )
+    last_file = None if restart else read_checkpoint(checkpoint)
+    if last_file:
+        files = [f for f in files if f.name > last_file]
+        print(f"resuming after {last_file}", file=out)
+
+    total = len(files)
+    written = skipped = done = 0
+    errors: List[Tuple[str, str]] = []
+    batch: List[Dict[str, Any]] = []
+    t0 = last_report = time.perf_counter()
+
+    def flush(name: Optional[str]):
+        nonlocal written
+        if batch:
+            written += write_batch(engine, batch)
+            batch.clear()
+        if name:
+            write_checkpoint(checkpoint, name, written)
+
+    # Results arrive in file order, so the checkpoint always marks a prefix
+    with Pool(workers) as pool:
+        name = None
+        for name, record, error in pool.imap(parse_file, map(str, files), chunksize=PARSE_CHUNK_SIZE):
+            done += 1
+            if error:
+                skipped += 1
+                errors.append((name, error))
+            else:
+                batch.append(record)
+            if len(batch) >= batch_size:
+                flush(name)
+
+            now = time.perf_counter()
+            if now - last_report >= REPORT_EVERY:
+                last_report = now
+                rate = written / (now - t0)
+                print(f"{done}/{total} files, {written} rows, {rate:,.0f} rows/s", file=out)
+        flush(name)
+
+    elapsed = time.perf_counter() - t0
+    for name, error in errors[:20]:
+        print(f"skipped {name}: {error}", file=out)
+    if len(errors) > 20:
+        print(f"... and {len(errors) - 20} more", file=out)
+    print(
+        f"imported {written} rows from {total} files in {elapsed:.1f}s "
+        f"({written / elapsed if elapsed else 0:,.0f} rows/s), {skipped} skipped",
+        file=out,
+    )
+    return {"files": total, "rows": written, "skipped": skipped, "seconds": elapsed}
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--dir", type=Path, default=DEFAULT_IMPORT_DIR)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    ap.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    ap.add_argument("--checkpoint", type=Path, help=f"default: <dir>/{CHECKPOINT_NAME}")
+    ap.add_argument("--restart", action="store_true", help="ignore the checkpoint and import every file")
+    args = ap.parse_args(argv)
+
+    if not args.dir.is_dir():
+        ap.error(f"{args.dir} is not a directory")
+
+    from app.auth.db import engine, init_db
+
+    init_db()
+    result = run_import(
+        engine,
+        args.dir,
+        workers=max(1, args.workers),
+        batch_size=max(1, args.batch_size),
+        checkpoint=args.checkpoint or args.dir / CHECKPOINT_NAME,
+        restart=args.restart,
+    )
+    return 1 if result["skipped"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
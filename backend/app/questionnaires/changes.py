@@ -0,0 +1,121 @@
+from __future__ import annotations
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+import os
+import uuid
+
+from sqlalchemy import event, func, insert, literal, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from app.questionnaires.models import DataGeneration, Questionnaire, QuestionnaireChange
+
+
+# Changes younger than this are held back from the delta export, so a
+# transaction that took a lower seq but commits later is not skipped
+CHANGES_SETTLE_SECONDS = float(os.getenv("CHANGES_SETTLE_SECONDS", "2"))
+
+
+def change_row(qid: str, op: str = "upsert") -> QuestionnaireChange:
+    """
+    Add to the session of the write it records, before commit. Inserting
+    it also bumps the data generation in that transaction.
+    """
+    return QuestionnaireChange(questionnaire_id=qid, op=op)
+
+
+def bump_generation():
+    """
+    UPDATE for writes that insert change rows without the ORM (bulk import).
+    """
+    return update(DataGeneration).where(DataGeneration.id == 1).values(value=DataGeneration.value + 1)
+
+
+@event.listens_for(QuestionnaireChange, "after_insert")
+def _bump_generation_on_change(mapper, connection, target) -> None:
+    # Same connection, so the counter commits (or rolls back) with the write
+    connection.execute(bump_generation())
+
+
+def seed_change_log(engine) -> int:
+    """
+    First run: one upsert per existing questionnaire (oldest first), so
+    since=0 returns the full table. Returns rows written.
+    """
+    with Session(engine) as session:
+        if session.exec(select(QuestionnaireChange.seq).limit(1)).first() is not None:
+            return 0
+
+        result = session.exec(
+            insert(QuestionnaireChange).from_select(
+                ["questionnaire_id", "op", "changed_at"],
+                select(Questionnaire.id, literal("upsert"), Questionnaire.updated_at)
+                .order_by(Questionnaire.updated_at, Questionnaire.id),
+            )
+        )
+        session.commit()
+        return result.rowcount or 0
+
+
+def seed_data_generation(engine) -> None:
+    """
+    Creates the data_generation row with a fresh epoch if there is none.
+    """
+    with Session(engine) as session:
+        if session.get(DataGeneration, 1) is not None:
+            return
+        session.add(DataGeneration(id=1, epoch=uuid.uuid4().hex))
+        try:
+            session.commit()
+        except IntegrityError:
+            session.rollback()  # another worker created it
+
+
+def new_data_epoch():
+    """
+    UPDATE starting a new epoch, for writes that replace the data wholesale.
+    """
+    return (
+        update(DataGeneration)
+        .where(DataGeneration.id == 1)
+        .values(epoch=uuid.uuid4().hex, value=DataGeneration.value + 1)
+    )
+
+
+def data_generation(session: Session) -> str:
+    """
+    Global data generation, "<epoch>:<counter>". The counter moves in the
+    transaction of every create/update/finalize/redo/delete (on any worker),
+    so it is visible exactly when the write is.
+    """
+    # A query, not session.get: repeated calls must see new commits
+    row = session.exec(select(DataGeneration.epoch, DataGeneration.value).where(DataGeneration.id == 1)).first()
+    return f"{row.epoch}:{row.value}" if row else ""
+
+
+def settled_watermark(session: Session) -> int:
+    """
+    Highest seq the delta export may hand out as a cursor right now.
+    """
+    cutoff = (datetime.utcnow() - timedelta(seconds=CHANGES_SETTLE_SECONDS)).isoformat()
+    seq = session.exec(
+        select(func.max(QuestionnaireChange.seq)).where(QuestionnaireChange.changed_at <= cutoff)
+    ).one()
+    return seq or 0
+
+
+def changed_since(session: Session, since: int, upto: int, limit: Optional[int] = None) -> List[Tuple[str, int]]:
+    """
+    (questionnaire_id, last seq) for every questionnaire changed in
+    (since, upto], ordered by last seq. Repeated changes collapse to one.
+    """
+    last_seq = func.max(QuestionnaireChange.seq).label("last_seq")
+    stmt = (
+        select(QuestionnaireChange.questionnaire_id, last_seq)
+        .where(QuestionnaireChange.seq > since, QuestionnaireChange.seq <= upto)
+        .group_by(QuestionnaireChange.questionnaire_id)
+        .order_by(last_seq)
+    )
+    if limit:
+        stmt = stmt.limit(limit)
+    return [(qid, seq) for qid, seq in session.exec(stmt)]
@@ -0,0 +1,93 @@
+from __future__ import annotations
+from typing import Any, List
+
+from sqlalchemy import delete, exists
+from sqlmodel import Session, select
+
+from app.questionnaires.models import Questionnaire, QuestionnaireDrug
+
+
+BACKFILL_BATCH_SIZE = 500
+
+# data key -> (kind, date field)
+DRUG_LISTS = {
+    "drug_use": ("use", "date_of_last_use"),
+    "drug_exposure": ("exposure", "date_of_last_exposure"),
+}
+
+
+def _norm(s: Any) -> str:
+    return ("" if s is None else str(s)).strip()
+
+
+def build_drug_rows(q: Questionnaire) -> List[QuestionnaireDrug]:
+    data = q.data if isinstance(q.data, dict) else {}
+
+    rows: List[QuestionnaireDrug] = []
+    seen = set()
+    for list_key, (kind, date_key) in DRUG_LISTS.items():
+        items = data.get(list_key) or []
+        if not isinstance(items, list):
+            continue
+        for it in items:
+            if not isinstance(it, dict):
+                continue
+            name = _norm(it.get("drug_name"))
+            if not name:
+                continue
+            status = _norm(it.get("status")).lower()
+            if (kind, name, status) in seen:
+                continue
+            seen.add((kind, name, status))
+            rows.append(QuestionnaireDrug(
+                questionnaire_id=q.id,
+                kind=kind,
+                drug_name=name,
+                status=status,
+                date_of_last_use=_norm(it.get(date_key)),
+            ))
+    return rows
+
+
+def delete_drug_rows_stmt(qid: str):
+    return delete(QuestionnaireDrug).where(QuestionnaireDrug.questionnaire_id == qid)
+
+
+def drug_status_exists(kind: str, drug_name: str, status: str):
+    """
+    EXISTS clause: the outer Questionnaire has a drug row with this kind/name/status.
+    """
+    return exists().where(
+        QuestionnaireDrug.questionnaire_id == Questionnaire.id,
+        QuestionnaireDrug.kind == kind,
+        QuestionnaireDrug.drug_name == drug_name,
+        QuestionnaireDrug.status == status,
+    )
+
+
+def backfill_drug_rows(engine, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """
+    Creates drug rows for questionnaires saved before the table existed.
+    Walks ids in order so records without any drug entries are visited once.
+    Returns drug rows written.
+    """
+    written = 0
+    last_id = ""
+    while True:
+        with Session(engine) as session:
+            qs = session.exec(
+                select(Questionnaire)
+                .where(Questionnaire.id > last_id)
+                .where(~exists().where(QuestionnaireDrug.questionnaire_id == Questionnaire.id))
+                .order_by(Questionnaire.id)
+                .limit(batch_size)
+            ).all()
+            if not qs:
+                return written
+
+            for q in qs:
+                rows = build_drug_rows(q)
+                session.add_all(rows)
+                written += len(rows)
+            session.commit()
+            last_id = qs[-1].id
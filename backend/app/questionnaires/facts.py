@@ -0,0 +1,57 @@
+from __future__ import annotations
+from typing import Any
+
+from sqlalchemy import delete
+from sqlmodel import Session, select
+
+from app.questionnaires.models import Questionnaire, QuestionnaireFacts
+from app.services.admin_export import derived_drug_lists
+from app.services.export_query import FILTER_FIELDS
+
+
+BACKFILL_BATCH_SIZE = 500
+
+
+def _norm(s: Any) -> str:
+    return ("" if s is None else str(s)).strip()
+
+
+def build_facts(q: Questionnaire) -> QuestionnaireFacts:
+    data = q.data if isinstance(q.data, dict) else {}
+
+    return QuestionnaireFacts(
+        questionnaire_id=q.id,
+        case_number=q.case_number,
+        version=q.version,
+        submitted_at=q.submitted_at or q.updated_at or q.created_at,
+        **{field: _norm(data.get(field)) for field in FILTER_FIELDS},
+        **derived_drug_lists(data),
+    )
+
+
+def delete_facts_stmt(qid: str):
+    return delete(QuestionnaireFacts).where(QuestionnaireFacts.questionnaire_id == qid)
+
+
+def backfill_facts(engine, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """
+    Creates facts rows for submitted questionnaires that don't have one yet
+    (records finalized before the table existed). Returns rows written.
+    """
+    written = 0
+    while True:
+        with Session(engine) as session:
+            qs = session.exec(
+                select(Questionnaire)
+                .outerjoin(QuestionnaireFacts, QuestionnaireFacts.questionnaire_id == Questionnaire.id)
+                .where(Questionnaire.status == "submitted")
+                .where(QuestionnaireFacts.questionnaire_id.is_(None))
+                .limit(batch_size)
+            ).all()
+            if not qs:
+                return written
+
+            for q in qs:
+                session.add(build_facts(q))
+            session.commit()
+            written += len(qs)
@@ -1,7 +1,7 @@
 from typing import Optional, Dict, Any
 from datetime import datetime
 from sqlmodel import SQLModel, Field
-from sqlalchemy import Column
+from sqlalchemy import Column, Index, LargeBinary
 import os
 
 # Use JSONB on Postgres; fallback to JSON on SQLite for local dev
@@ -15,6 +15,11 @@ else:
 
 
 class Questionnaire(SQLModel, table=True):
+    __table_args__ = (
+        # Latest version per case (export latest_only, next_version_for_case)
+        Index("ix_questionnaire_case_number_version", "case_number", "version"),
+    )
+
     id: str = Field(primary_key=True, index=True)
 
     case_number: str = Field(index=True)
@@ -31,3 +36,169 @@ class Questionnaire(SQLModel, table=True):
     user_email: Optional[str] = Field(default=None, index=True)
 
     data: Dict[str, Any] = Field(default_factory=dict, sa_column=Column(JSON_TYPE))
+
+
+class QuestionnaireFacts(SQLModel, table=True):
+    """
+    Narrow, typed projection of a SUBMITTED questionnaire's filterable answers.
+    Written in the same transaction as finalize (see app.questionnaires.facts),
+    so exports/options can filter and build dropdowns without parsing data.
+    """
+    __tablename__ = "questionnaire_facts"
+
+    questionnaire_id: str = Field(primary_key=True, foreign_key="questionnaire.id")
+
+    case_number: str = Field(index=True)
+    version: int = Field(default=1)
+    # submitted_at, falling back to updated_at/created_at like the export filters
+    submitted_at: str = Field(index=True)
+
+    natural_hair_colour: str = Field(default="", index=True)
+    sex_at_birth: str = Field(default="", index=True)
+    testing_type: str = Field(default="", index=True)
+
+    hair_dyed_bleached: str = Field(default="", index=True)
+    hair_thermal_applications: str = Field(default="", index=True)
+    frequent_swimming: str = Field(default="", index=True)
+    frequent_sunbeds: str = Field(default="", index=True)
+    frequent_sprays_on_sites: str = Field(default="", index=True)
+    pregnant_last_12_months: str = Field(default="", index=True)
+    hair_cut_in_last_12_months: str = Field(default="", index=True)
+    hair_removed_body_hair_last_12_months: str = Field(default="", index=True)
+
+    # Derived columns (same values as flatten_record)
+    drug_use_used_list: str = Field(default="")
+    drug_exposure_exposed_list: str = Field(default="")
+
+
+class QuestionnaireDrug(SQLModel, table=True):
+    """
+    One row per questionnaire x drug_use/drug_exposure entry, kept in sync with
+    data on create/update/finalize (see app.questionnaires.drugs), so
+    "who used drug X" is an index lookup instead of a scan of every document.
+    """
+    __tablename__ = "questionnaire_drug"
+    __table_args__ = (
+        Index("ix_questionnaire_drug_kind_name_status", "kind", "drug_name", "status"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    questionnaire_id: str = Field(index=True, foreign_key="questionnaire.id")
+
+    kind: str  # use | exposure
+    drug_name: str  # trimmed
+    status: str = Field(default="")  # trimmed, lower-case: used / not used / exposed / not exposed
+
+    # date_of_last_use (drug_use) or date_of_last_exposure (drug_exposure)
+    date_of_last_use: str = Field(default="")
+
+
+class QuestionnaireSearch(SQLModel, table=True):
+    """
+    Searchable text of every questionnaire (drafts included), kept in sync
+    with data on create/update/finalize/redo (see app.questionnaires.search).
+    Indexed with pg_trgm/tsvector on Postgres and an FTS5 table on SQLite.
+    """
+    __tablename__ = "questionnaire_search"
+
+    questionnaire_id: str = Field(primary_key=True, foreign_key="questionnaire.id")
+
+    case_key: str = Field(index=True)  # lower-case case_number, for prefix autocomplete
+    client_name: str = Field(default="")
+    collector_name: str = Field(default="")
+    notes: str = Field(default="")  # free-text answers, newline separated
+
+
+class SignatureBlob(SQLModel, table=True):
+    """
+    Signature image, stored once per content: hash is the sha256 of the
+    compacted PNG. Questionnaire.data holds "signature:<hash>" references in
+    place of the base64 data URIs (see app.questionnaires.signatures).
+    """
+    __tablename__ = "signature_blob"
+
+    hash: str = Field(primary_key=True)
+    png: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    width: int = Field(default=0)
+    height: int = Field(default=0)
+    created_at: str = Field(default_factory=lambda: datetime.utcnow().isoformat())
+
+
+class ExportColumn(SQLModel, table=True):
+    """
+    Registry of CSV export columns (flattened "data.*" keys). schema_version
+    is bumped whenever new keys are registered, so exports can report which
+    column set they were written with.
+    """
+    __tablename__ = "export_column"
+
+    name: str = Field(primary_key=True)
+    schema_version: int = Field(default=1, index=True)
+    added_at: str = Field(default_factory=lambda: datetime.utcnow().isoformat())
+
+
+class QuestionnaireChange(SQLModel, table=True):
+    """
+    Append-only change log: one row per create/update/finalize/redo/delete,
+    written in the same transaction as the change. seq is the cursor of the
+    delta export (/admin/export/changes); rows whose questionnaire no longer
+    exists are the tombstones.
+    """
+    __tablename__ = "questionnaire_change"
+
+    seq: Optional[int] = Field(default=None, primary_key=True)
+    questionnaire_id: str = Field(index=True)
+    op: str  # upsert | delete
+    changed_at: str = Field(default_factory=lambda: datetime.utcnow().isoformat(), index=True)
+
+
+class DataGeneration(SQLModel, table=True):
+    """
+    Single row: value is incremented in every transaction that writes a
+    change row (see app.questionnaires.changes); epoch is replaced when the
+    data is replaced wholesale (a new database, a snapshot restore). Export
+    cache keys use both, so they never outlive the data they describe.
+    """
+    __tablename__ = "data_generation"
+
+    id: int = Field(default=1, primary_key=True)
+    epoch: str
+    value: int = Field(default=0)
+
+
+class ExportJob(SQLModel, table=True):
+    """
+    Background export (see app.services.export_jobs). The artifact is written
+    to EXPORT_JOBS_DIR and served with Range support until it expires.
+    """
+    __tablename__ = "export_job"
+
+    id: str = Field(primary_key=True)
+    format: str  # json | csv | parquet | arrow | zip
+    params: Dict[str, Any] = Field(default_factory=dict, sa_column=Column(JSON_TYPE))
+    status: str = Field(default="queued", index=True)  # queued|running|done|failed
+
+    rows_written: int = Field(default=0)
+    rows_estimated: Optional[int] = Field(default=None)
+    size_bytes: Optional[int] = Field(default=None)
+    filename: Optional[str] = Field(default=None)
+    error: Optional[str] = Field(default=None)
+
+    user_id: Optional[int] = Field(default=None, index=True)
+    created_at: str = Field(default_factory=lambda: datetime.utcnow().isoformat(), index=True)
+    finished_at: Optional[str] = Field(default=None)
+    # Refreshed by the process running the job while it is queued/running;
+    # a stale one means that process is gone
+    heartbeat_at: Optional[str] = Field(default_factory=lambda: datetime.utcnow().isoformat())
+
+
+class BackfillMarker(SQLModel, table=True):
+    """
+    One row per one-off startup backfill that has completed, so init_db
+    does not rescan the questionnaires on every boot
+    (see app.questionnaires.backfills).
+    """
+    __tablename__ = "backfill_marker"
+
+    name: str = Field(primary_key=True)
+    completed_at: str = Field(default_factory=lambda: datetime.utcnow().isoformat())
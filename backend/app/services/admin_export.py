@@ -1,5 +1,5 @@
 from __future__ import annotations
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, List, Optional
 import json
 import csv
 import io
@@ -40,6 +40,25 @@ def _safe_scalar(v: Any) -> str:
     return json.dumps(v, ensure_ascii=False)
 
 
+def derived_drug_lists(data: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Comma-joined names of drugs marked used / Exposed.
+    """
+    used = []
+    for d in (data.get("drug_use") or []):
+        if (d or {}).get("status") == "used":
+            used.append((d or {}).get("drug_name"))
+    exposed = []
+    for d in (data.get("drug_exposure") or []):
+        if (d or {}).get("status") == "Exposed":
+            exposed.append((d or {}).get("drug_name"))
+
+    return {
+        "drug_use_used_list": ", ".join([x for x in used if x]),
+        "drug_exposure_exposed_list": ", ".join([x for x in exposed if x]),
+    }
+
+
 def flatten_record(record: Dict[str, Any], columns: Optional[List[str]] = None) -> Dict[str, Any]:
     """
     Returns a flat dict suitable for CSV/table.
@@ -60,17 +79,7 @@ def flatten_record(record: Dict[str, Any], columns: Optional[List[str]] = None)
     data = record.get("data") or {}
 
     # helpful derived columns
-    used = []
-    for d in (data.get("drug_use") or []):
-        if (d or {}).get("status") == "used":
-            used.append((d or {}).get("drug_name"))
-    exposed = []
-    for d in (data.get("drug_exposure") or []):
-        if (d or {}).get("status") == "Exposed":
-            exposed.append((d or {}).get("drug_name"))
-
-    base["drug_use_used_list"] = ", ".join([x for x in used if x])
-    base["drug_exposure_exposed_list"] = ", ".join([x for x in exposed if x])
+    base.update(derived_drug_lists(data))
 
     if columns:
         for col in columns:
@@ -86,21 +95,47 @@ def flatten_record(record: Dict[str, Any], columns: Optional[List[str]] = None)
     return base
 
 
-def make_csv(flat_rows: List[Dict[str, Any]]) -> str:
-    if not flat_rows:
-        return ""
+def flatten(obj: Any, prefix: str = "", out: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Flattens nested JSON into dot keys. Lists are JSON-stringified.
+    """
+    if out is None:
+        out = {}
+
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            key = f"{prefix}.{k}" if prefix else str(k)
+            flatten(v, key, out)
+    elif isinstance(obj, list):
+        out[prefix] = json.dumps(obj, ensure_ascii=False)
+    else:
+        out[prefix] = obj
 
-    # union of all headers
-    headers = []
-    seen = set()
-    for r in flat_rows:
-        for k in r.keys():
-            if k not in seen:
-                seen.add(k)
-                headers.append(k)
+    return out
+
+
+def make_csv(flat_rows: Iterable[Dict[str, Any]], fieldnames: Optional[List[str]] = None) -> str:
+    """
+    With fieldnames (e.g. from the column registry) rows are written in a
+    single pass and may be any iterable; without, the header is the union of
+    all row keys, which needs every row up front.
+    """
+    if fieldnames is None:
+        flat_rows = list(flat_rows)
+        if not flat_rows:
+            return ""
+
+        # union of all headers
+        fieldnames = []
+        seen = set()
+        for r in flat_rows:
+            for k in r.keys():
+                if k not in seen:
+                    seen.add(k)
+                    fieldnames.append(k)
 
     buf = io.StringIO()
-    writer = csv.DictWriter(buf, fieldnames=headers, extrasaction="ignore")
+    writer = csv.DictWriter(buf, fieldnames=fieldnames, extrasaction="ignore")
     writer.writeheader()
     for r in flat_rows:
         writer.writerow(r)
@@ -1,5 +1,5 @@
 from __future__ import annotations
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional
 
 
 def get_path(obj: Any, path: str) -> Any:
@@ -106,3 +106,171 @@ def apply_filters(
         if ok:
             out.append(r)
     return out
+
+
+# -----------------------------
+# Compiled rules
+# -----------------------------
+# Same rule language as match_rule, turned into closures once per request:
+# paths are split and operator/literal handling is chosen up front, so
+# evaluating a record does no parsing or op dispatch.
+
+Predicate = Callable[[Any], bool]
+
+OPS = ("eq", "neq", "contains", "in", "gte", "lte")
+
+
+def compile_path(path: str) -> Callable[[Any], Any]:
+    if not isinstance(path, str) or not path:
+        raise ValueError("Rule field must be a non-empty string")
+    parts = tuple(path.split("."))
+
+    if len(parts) == 1:
+        (key,) = parts
+
+        def get_one(obj: Any) -> Any:
+            if isinstance(obj, dict):
+                return obj.get(key)
+            return getattr(obj, key, None) if obj is not None else None
+        return get_one
+
+    if len(parts) == 2:
+        first, second = parts
+
+        def get_two(obj: Any) -> Any:
+            if isinstance(obj, dict):
+                cur = obj.get(first)
+            else:
+                cur = getattr(obj, first, None) if obj is not None else None
+            if isinstance(cur, dict):
+                return cur.get(second)
+            return getattr(cur, second, None) if cur is not None else None
+        return get_two
+
+    def get(obj: Any) -> Any:
+        cur = obj
+        for part in parts:
+            if cur is None:
+                return None
+            if isinstance(cur, dict):
+                cur = cur.get(part)
+            else:
+                cur = getattr(cur, part, None)
+        return cur
+    return get
+
+
+def compile_op(op: str, expected: Any) -> Predicate:
+    """
+    Predicate on a value, equivalent to match_op(value, op, expected) except
+    that gte/lte on incomparable values (e.g. None) is False instead of raising.
+    """
+    if op == "eq":
+        return lambda v: v == expected
+    if op == "neq":
+        return lambda v: v != expected
+    if op == "contains":
+        needle = str(expected).lower()
+        return lambda v: v is not None and needle in str(v).lower()
+    if op == "in":
+        if expected is None:
+            return lambda v: False
+        if isinstance(expected, (list, tuple, set, frozenset)):
+            try:
+                choices = frozenset(expected)
+            except TypeError:
+                choices = None
+            if choices is not None:
+                def in_set(v: Any) -> bool:
+                    try:
+                        return v in choices
+                    except TypeError:  # unhashable value
+                        return v in expected
+                return in_set
+        return lambda v: v in expected
+    if op == "gte":
+        def gte(v: Any) -> bool:
+            try:
+                return v >= expected
+            except TypeError:
+                return False
+        return gte
+    if op == "lte":
+        def lte(v: Any) -> bool:
+            try:
+                return v <= expected
+            except TypeError:
+                return False
+        return lte
+
+    raise ValueError(f"Unknown op: {op}")
+
+
+def compile_condition(cond: Dict[str, Any]) -> Predicate:
+    if not isinstance(cond, dict):
+        raise ValueError("Rule must be an object")
+    get = compile_path(cond.get("field"))
+    op = cond.get("op", "eq")
+    expected = cond.get("value")
+
+    # Fused closures for the common ops: one call per record instead of two
+    if op == "eq":
+        return lambda obj: get(obj) == expected
+    if op == "neq":
+        return lambda obj: get(obj) != expected
+    if op == "contains":
+        needle = str(expected).lower()
+
+        def contains(obj: Any) -> bool:
+            v = get(obj)
+            return v is not None and needle in (v if type(v) is str else str(v)).lower()
+        return contains
+
+    test = compile_op(op, expected)
+    return lambda obj: test(get(obj))
+
+
+def compile_rule(rule: Dict[str, Any]) -> Predicate:
+    if not isinstance(rule, dict):
+        raise ValueError("Rule must be an object")
+
+    if "any" in rule:
+        any_spec = rule["any"]
+        if not isinstance(any_spec, dict):
+            raise ValueError("'any' must be an object")
+        get_list = compile_path(any_spec.get("field"))
+        where = tuple(compile_condition(c) for c in (any_spec.get("where") or []))
+
+        def any_item(record: Any) -> bool:
+            arr = get_list(record) or []
+            if not isinstance(arr, list):
+                return False
+            for item in arr:
+                for cond in where:
+                    if not cond(item):
+                        break
+                else:
+                    return True
+            return False
+        return any_item
+
+    return compile_condition(rule)
+
+
+def compile_rules(rules: Optional[List[Dict[str, Any]]]) -> Predicate:
+    """
+    One predicate for a list of rules (all must match). Raises ValueError
+    on malformed rules or unknown ops.
+    """
+    compiled = tuple(compile_rule(r) for r in (rules or []))
+    if not compiled:
+        return lambda record: True
+    if len(compiled) == 1:
+        return compiled[0]
+
+    def all_rules(record: Any) -> bool:
+        for p in compiled:
+            if not p(record):
+                return False
+        return True
+    return all_rules
@@ -0,0 +1,111 @@
+from __future__ import annotations
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set
+import asyncio
+import json
+import os
+import threading
+
+
+# Recent events kept in memory for exact Last-Event-ID replay; older ids
+# are replayed from the questionnaire_change log instead
+CHANGE_FEED_BUFFER_SIZE = int(os.getenv("CHANGE_FEED_BUFFER_SIZE", "2000"))
+# Events a slow client may fall behind by before its stream is closed
+# (it reconnects with Last-Event-ID and catches up through replay)
+CHANGE_FEED_QUEUE_SIZE = int(os.getenv("CHANGE_FEED_QUEUE_SIZE", "500"))
+CHANGE_FEED_HEARTBEAT_SECONDS = float(os.getenv("CHANGE_FEED_HEARTBEAT_SECONDS", "15"))
+# Sent to EventSource as the reconnect delay
+CHANGE_FEED_RETRY_MS = 3000
+
+
+@dataclass
+class ChangeEvent:
+    id: int  # questionnaire_change.seq of the write
+    event: str  # create | update | finalize | delete
+    data: Dict[str, Any]  # q_to_index_row fields; just {"id": ...} for delete
+
+    def encode(self) -> str:
+        payload = json.dumps(self.data, ensure_ascii=False, separators=(",", ":"))
+        return f"id: {self.id}\nevent: {self.event}\ndata: {payload}\n\n"
+
+
+class _Subscriber:
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=CHANGE_FEED_QUEUE_SIZE)
+        self.overflowed = False
+
+    def offer(self, event: Optional[ChangeEvent]) -> None:
+        # Runs on the subscriber's event loop
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)  # wakes the stream, which then closes
+
+
+class ChangeFeed:
+    """
+    In-process publish/subscribe for questionnaire writes. The write
+    endpoints publish after commit (from the event loop or a worker thread);
+    every open SSE stream gets the event. Event ids are change-log seqs, so
+    a reconnecting client can resume with Last-Event-ID from the buffer, or
+    from the change log once the buffer no longer covers it.
+
+    Live events only reach streams served by the same process; with several
+    workers, clients still catch up from the change log when they reconnect.
+    The buffer only holds this process's events, so callers must check it
+    against the log before using it (see buffered_since).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._recent: deque = deque(maxlen=CHANGE_FEED_BUFFER_SIZE)
+        self._covered_after: Optional[int] = None  # buffer holds every local event after this id
+        self._subscribers: Set[_Subscriber] = set()
+
+    def publish(self, event: str, seq: int, data: Dict[str, Any]) -> None:
+        item = ChangeEvent(id=seq, event=event, data=data)
+        with self._lock:
+            if self._covered_after is None:
+                self._covered_after = seq - 1
+            elif len(self._recent) == self._recent.maxlen:
+                self._covered_after = self._recent[0].id
+            self._recent.append(item)
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            try:
+                sub.loop.call_soon_threadsafe(sub.offer, item)
+            except RuntimeError:
+                pass  # loop closed; the stream is gone
+
+    def subscribe(self) -> _Subscriber:
+        sub = _Subscriber(asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: _Subscriber) -> None:
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def buffered_since(self, last_id: int) -> Optional[List[ChangeEvent]]:
+        """
+        Buffered events after last_id, or None if the buffer no longer
+        reaches back that far (or never did, e.g. after a restart).
+        Only events published by this process: writes of other workers or
+        the bulk importer are missing, so compare the ids with the change
+        log and replay from it when they differ.
+        """
+        with self._lock:
+            if self._covered_after is None or last_id < self._covered_after:
+                return None
+            return [e for e in self._recent if e.id > last_id]
+
+
+change_feed = ChangeFeed()
@@ -0,0 +1,164 @@
+from __future__ import annotations
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from app.questionnaires.models import ExportColumn
+from app.services.admin_export import flatten
+
+
+# Questionnaire-level columns written before the data.* columns
+BASE_FIELDS = [
+    "id",
+    "case_number",
+    "version",
+    "status",
+    "created_at",
+    "updated_at",
+    "submitted_at",
+    "redo_of_id",
+    "user_id",
+    "user_email",
+]
+
+# Keys that are not (yet) registered end up here as a JSON object
+EXTRA_COLUMN = "_extra_fields"
+
+# Top-level data keys of the questionnaire form (schema version 1)
+SCHEMA_DATA_FIELDS = [
+    "alcohol_consumed_last_12_months",
+    "alcohol_last_consumed_date",
+    "alcohol_last_date_unsure",
+    "alcohol_other_info",
+    "alcohol_weekly_options",
+    "blood_borne_infections",
+    "case_number",
+    "client_name",
+    "client_print_name",
+    "client_signature_date",
+    "client_signature_png",
+    "collector_name",
+    "collector_print_name",
+    "collector_signature_date",
+    "collector_signature_png",
+    "consent",
+    "dob",
+    "drug_exposure",
+    "drug_exposure_any",
+    "drug_exposure_other_info",
+    "drug_use",
+    "drug_use_other_info",
+    "ethnicity",
+    "ethnicity_other_detail",
+    "frequent_sprays_frequency",
+    "frequent_sprays_on_sites",
+    "frequent_sunbeds",
+    "frequent_sunbeds_frequency",
+    "frequent_swimming",
+    "frequent_swimming_frequency",
+    "hair_cut_in_last_12_months",
+    "hair_cut_shaved_to_skin",
+    "hair_dyed_bleached",
+    "hair_last_cut_date",
+    "hair_last_cut_unsure",
+    "hair_last_dyed_bleached_date",
+    "hair_last_shave_date",
+    "hair_last_shave_unsure",
+    "hair_removed_body_hair_last_12_months",
+    "hair_removed_from",
+    "hair_removed_sites_arms",
+    "hair_removed_sites_arms_last_shaved_date",
+    "hair_removed_sites_arms_last_shaved_last_collection",
+    "hair_removed_sites_arms_last_shaved_unsure",
+    "hair_removed_sites_back",
+    "hair_removed_sites_back_last_shaved_date",
+    "hair_removed_sites_back_last_shaved_last_collection",
+    "hair_removed_sites_back_last_shaved_unsure",
+    "hair_removed_sites_chest",
+    "hair_removed_sites_chest_last_shaved_date",
+    "hair_removed_sites_chest_last_shaved_last_collection",
+    "hair_removed_sites_chest_last_shaved_unsure",
+    "hair_removed_sites_legs",
+    "hair_removed_sites_legs_last_shaved_date",
+    "hair_removed_sites_legs_last_shaved_last_collection",
+    "hair_removed_sites_legs_last_shaved_unsure",
+    "hair_removed_sites_underarms",
+    "hair_removed_sites_underarms_last_shaved_date",
+    "hair_removed_sites_underarms_last_shaved_last_collection",
+    "hair_removed_sites_underarms_last_shaved_unsure",
+    "hair_thermal_applications",
+    "hair_thermal_frequency",
+    "hair_wash_frequency",
+    "has_other_medications",
+    "nails_contact_bleach",
+    "natural_hair_colour",
+    "occupation",
+    "other_medications_details",
+    "pregnancy_due_date_not_applicable",
+    "pregnancy_due_date_unsure",
+    "pregnancy_due_or_birth_date",
+    "pregnancy_outcome",
+    "pregnancy_weeks",
+    "pregnant_last_12_months",
+    "refusal_print_name",
+    "refusal_signature_date",
+    "refusal_signature_png",
+    "sex_at_birth",
+    "sprays_sites_arms",
+    "sprays_sites_back",
+    "sprays_sites_chest",
+    "sprays_sites_legs",
+    "sprays_sites_scalp",
+    "testing_type",
+]
+
+
+def data_columns(data: Dict[str, Any]) -> Set[str]:
+    """
+    CSV column names ("data.<flattened key>") a data document produces.
+    """
+    if not isinstance(data, dict):
+        return set()
+    return {f"data.{k}" for k in flatten(data).keys()}
+
+
+def seed_registry(session: Session) -> int:
+    """
+    Registers the form schema on an empty registry. Returns columns added.
+    """
+    if session.exec(select(ExportColumn.name).limit(1)).first() is not None:
+        return 0
+    return register_columns(session, [f"data.{k}" for k in SCHEMA_DATA_FIELDS])
+
+
+def register_columns(session: Session, names: Iterable[str]) -> int:
+    """
+    Adds any names not registered yet under a new schema version (and commits).
+    Returns the number of columns added.
+    """
+    names = set(names)
+    if not names:
+        return 0
+
+    known = set(session.exec(select(ExportColumn.name).where(ExportColumn.name.in_(names))).all())
+    new = sorted(names - known)
+    if not new:
+        return 0
+
+    current = session.exec(select(func.max(ExportColumn.schema_version))).one() or 0
+    for name in new:
+        session.add(ExportColumn(name=name, schema_version=current + 1))
+    session.commit()
+    return len(new)
+
+
+def load_registry(session: Session) -> Tuple[int, List[str]]:
+    """
+    (schema_version, header) where header is the sorted base + registered
+    data columns followed by EXTRA_COLUMN.
+    """
+    rows = session.exec(select(ExportColumn.name, ExportColumn.schema_version)).all()
+    version = max((v for _, v in rows), default=0)
+    header = sorted(set(BASE_FIELDS) | {name for name, _ in rows})
+    return version, header + [EXTRA_COLUMN]
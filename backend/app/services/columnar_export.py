@@ -0,0 +1,314 @@
+from __future__ import annotations
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+import io
+import json
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from app.services.column_registry import EXTRA_COLUMN, SCHEMA_DATA_FIELDS
+from app.services.export_query import FILTER_FIELDS
+
+
+# -----------------------------
+# Column typing
+# -----------------------------
+LIST_FIELDS = {"blood_borne_infections", "alcohol_weekly_options"}
+
+CATEGORICAL_FIELDS = set(FILTER_FIELDS) | {
+    "consent",
+    "ethnicity",
+    "blood_borne_infections",
+    "has_other_medications",
+    "alcohol_consumed_last_12_months",
+    "drug_exposure_any",
+    "hair_cut_shaved_to_skin",
+    "hair_thermal_frequency",
+    "hair_wash_frequency",
+    "nails_contact_bleach",
+    "frequent_swimming_frequency",
+    "frequent_sunbeds_frequency",
+    "frequent_sprays_frequency",
+    "pregnancy_outcome",
+}
+
+# Tick boxes / "unsure" flags
+BOOL_FIELDS = {
+    k for k in SCHEMA_DATA_FIELDS
+    if k.endswith(("_unsure", "_not_applicable", "_last_collection"))
+    or (k.startswith(("hair_removed_sites_", "sprays_sites_")) and not k.endswith("_date"))
+}
+
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+TIMESTAMP = pa.timestamp("us")
+
+DRUG_USE_PERIOD = pa.struct([
+    ("start_date_of_use", pa.string()),
+    ("date_of_last_use", pa.string()),
+    ("unsure_date", pa.bool_()),
+    ("level_of_use", pa.string()),
+    ("prescribed", pa.bool_()),
+    ("has_change", pa.bool_()),
+])
+
+DRUG_USE = pa.struct([
+    ("drug_name", pa.string()),
+    ("status", pa.string()),
+    ("start_date_of_use", pa.string()),
+    ("date_of_last_use", pa.string()),
+    ("unsure_date", pa.bool_()),
+    ("level_of_use", pa.string()),
+    ("prescribed", pa.bool_()),
+    ("has_change", pa.bool_()),
+    ("periods", pa.list_(DRUG_USE_PERIOD)),
+])
+
+DRUG_EXPOSURE_PERIOD = pa.struct([
+    ("start_date_of_exposure", pa.string()),
+    ("date_of_last_exposure", pa.string()),
+    ("unsure_date", pa.bool_()),
+    ("level_of_exposure", pa.string()),
+    ("type_of_exposure", pa.list_(pa.string())),
+    ("has_change", pa.bool_()),
+])
+
+DRUG_EXPOSURE = pa.struct([
+    ("drug_name", pa.string()),
+    ("status", pa.string()),
+    ("start_date_of_exposure", pa.string()),
+    ("date_of_last_exposure", pa.string()),
+    ("unsure_date", pa.bool_()),
+    ("level_of_exposure", pa.string()),
+    ("type_of_exposure", pa.list_(pa.string())),
+    ("has_change", pa.bool_()),
+    ("periods", pa.list_(DRUG_EXPOSURE_PERIOD)),
+])
+
+NESTED_FIELDS = {
+    "drug_use": pa.list_(DRUG_USE),
+    "drug_exposure": pa.list_(DRUG_EXPOSURE),
+}
+
+BASE_SCHEMA = [
+    ("id", pa.string()),
+    ("case_number", pa.string()),
+    ("version", pa.int32()),
+    ("status", CATEGORY),
+    ("created_at", TIMESTAMP),
+    ("updated_at", TIMESTAMP),
+    ("submitted_at", TIMESTAMP),
+    ("redo_of_id", pa.string()),
+    ("user_id", pa.int64()),
+    ("user_email", pa.string()),
+]
+
+
+def data_field_type(key: str) -> pa.DataType:
+    if key in NESTED_FIELDS:
+        return NESTED_FIELDS[key]
+    if key in LIST_FIELDS:
+        return pa.list_(pa.string())
+    if key in CATEGORICAL_FIELDS:
+        return CATEGORY
+    if key in BOOL_FIELDS:
+        return pa.bool_()
+    return pa.string()
+
+
+def build_schema(registered_columns: Iterable[str]) -> pa.Schema:
+    """
+    Base columns, then one typed column per registered data.* column,
+    then EXTRA_COLUMN for keys that are not registered yet.
+    """
+    keys = sorted({c.split(".", 1)[1] for c in registered_columns if c.startswith("data.")})
+    fields = [pa.field(name, typ) for name, typ in BASE_SCHEMA]
+    fields += [pa.field(f"data.{k}", data_field_type(k)) for k in keys]
+    fields.append(pa.field(EXTRA_COLUMN, pa.string()))
+    return pa.schema(fields)
+
+
+def type_name(typ: pa.DataType) -> str:
+    """
+    Plain type name for API schemas (list/boolean/number/datetime/string).
+    """
+    if pa.types.is_list(typ):
+        return "list"
+    if pa.types.is_boolean(typ):
+        return "boolean"
+    if pa.types.is_integer(typ):
+        return "number"
+    if pa.types.is_timestamp(typ):
+        return "datetime"
+    return "string"
+
+
+# -----------------------------
+# Value coercion (stored JSON is loosely typed)
+# -----------------------------
+def _str(v: Any) -> Optional[str]:
+    if v is None:
+        return None
+    return v if isinstance(v, str) else str(v)
+
+
+def _bool(v: Any) -> Optional[bool]:
+    if v is None or v == "":
+        return None
+    if isinstance(v, str):
+        return v.strip().lower() in ("true", "yes", "1")
+    return bool(v)
+
+
+def _str_list(v: Any) -> List[str]:
+    if isinstance(v, list):
+        return [str(x) for x in v if x is not None]
+    if v in (None, "", False):
+        return []
+    return [str(v)]
+
+
+def _ts(v: Any) -> Optional[datetime]:
+    if not v:
+        return None
+    try:
+        return datetime.fromisoformat(str(v).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+def _int(v: Any) -> Optional[int]:
+    try:
+        return int(v) if v is not None and v != "" else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _coerce_struct(item: Any, typ: pa.StructType) -> Optional[Dict[str, Any]]:
+    if not isinstance(item, dict):
+        return None
+    out = {}
+    for f in typ:
+        v = item.get(f.name)
+        out[f.name] = _coerce(v, f.type)
+    return out
+
+
+def _coerce(v: Any, typ: pa.DataType) -> Any:
+    if pa.types.is_struct(typ):
+        return _coerce_struct(v, typ)
+    if pa.types.is_list(typ):
+        inner = typ.value_type
+        if pa.types.is_struct(inner):
+            return [_coerce_struct(x, inner) for x in (v if isinstance(v, list) else [])]
+        return _str_list(v)
+    if pa.types.is_boolean(typ):
+        return _bool(v)
+    if pa.types.is_timestamp(typ):
+        return _ts(v)
+    if pa.types.is_integer(typ):
+        return _int(v)
+    return _str(v)
+
+
+def _data_paths(obj: Any, prefix: str, out: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Like flatten(), but lists stay lists (they become list columns).
+    """
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            _data_paths(v, f"{prefix}.{k}", out)
+    else:
+        out[prefix] = obj
+    return out
+
+
+def record_to_row(record: Dict[str, Any], clean_data: Dict[str, Any], schema: pa.Schema) -> Dict[str, Any]:
+    row = {name: _coerce(record.get(name), schema.field(name).type) for name, _ in BASE_SCHEMA}
+
+    values = _data_paths(clean_data, "data", {})
+    extra = {}
+    for name, v in values.items():
+        idx = schema.get_field_index(name)
+        if idx < 0:
+            extra[name] = v
+            continue
+        row[name] = _coerce(v, schema.field(idx).type)
+
+    row[EXTRA_COLUMN] = json.dumps(extra, ensure_ascii=False, default=str) if extra else None
+    return row
+
+
+# -----------------------------
+# Writers
+# -----------------------------
+class ChunkSink(io.RawIOBase):
+    """
+    Write-only file object whose contents can be drained as it fills, so a
+    Parquet/Arrow/ZIP file can be streamed while it is written.
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._buf += b
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def drain(self) -> bytes:
+        out = bytes(self._buf)
+        self._buf.clear()
+        return out
+
+
+def _batches(rows: Iterable[Dict[str, Any]], schema: pa.Schema, batch_size: int) -> Iterator[pa.RecordBatch]:
+    batch: List[Dict[str, Any]] = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield pa.RecordBatch.from_pylist(batch, schema=schema)
+            batch = []
+    if batch:
+        yield pa.RecordBatch.from_pylist(batch, schema=schema)
+
+
+def iter_parquet(rows: Iterable[Dict[str, Any]], schema: pa.Schema, batch_size: int) -> Iterator[bytes]:
+    """
+    One row group per batch_size rows; bytes are yielded as each row group
+    is written (the footer comes last).
+    """
+    sink = ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        for batch in _batches(rows, schema, batch_size):
+            writer.write_batch(batch, row_group_size=batch_size)
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def iter_arrow_ipc(rows: Iterable[Dict[str, Any]], schema: pa.Schema, batch_size: int) -> Iterator[bytes]:
+    """
+    Arrow IPC stream format: schema message, then one record batch message
+    per batch_size rows.
+    """
+    sink = ChunkSink()
+    writer = pa.ipc.new_stream(sink, schema)
+    try:
+        for batch in _batches(rows, schema, batch_size):
+            writer.write_batch(batch)
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
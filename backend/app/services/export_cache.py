@@ -0,0 +1,159 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, Optional
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+# On-disk cache of finished export responses. Keys combine the normalised
+# filter params with the data generation (data_generation epoch and counter)
+# and anything else the output depends on, so a key never goes stale: new
+# data simply produces a new key. Keys start with a tag of their generation,
+# and publishing an entry removes every other generation's entries, so data
+# that was since changed or deleted does not stay on disk.
+
+DEFAULT_EXPORT_CACHE_DIR = Path(__file__).resolve().parent.parent / "data" / "export_cache"
+EXPORT_CACHE_DIR = Path(os.getenv("EXPORT_CACHE_DIR", str(DEFAULT_EXPORT_CACHE_DIR))).resolve()
+
+# Total size kept on disk; least recently used entries are removed first (0 = disabled)
+EXPORT_CACHE_MAX_MB = int(os.getenv("EXPORT_CACHE_MAX_MB", "1024"))
+EXPORT_CACHE_MAX_BYTES = EXPORT_CACHE_MAX_MB * 1024 * 1024
+
+_evict_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return EXPORT_CACHE_MAX_BYTES > 0
+
+
+def normalise_params(params: Dict[str, str]) -> Dict[str, str]:
+    """
+    Blank filters dropped, values trimmed: equivalent requests share a key.
+    """
+    out = {}
+    for k, v in params.items():
+        v = (v or "").strip()
+        if v:
+            out[k] = v
+    return out
+
+
+def generation_tag(generation: str) -> str:
+    return hashlib.sha256(generation.encode("utf-8")).hexdigest()[:12]
+
+
+def cache_key(fmt: str, params: Dict[str, str], generation: str, **variant: Any) -> str:
+    """
+    "<generation tag>-<digest>"; also the entry's file name (plus extension).
+    """
+    body = json.dumps(
+        {"format": fmt, "params": normalise_params(params), "generation": generation, **variant},
+        sort_keys=True,
+        default=str,
+    )
+    return f"{generation_tag(generation)}-{hashlib.sha256(body.encode('utf-8')).hexdigest()}"
+
+
+def etag_for(key: str) -> str:
+    return f'"{key}"'
+
+
+def lookup(key: str, ext: str) -> Optional[Path]:
+    """
+    Cached file for key, marked as recently used; None on a miss.
+    """
+    path = EXPORT_CACHE_DIR / f"{key}.{ext}"
+    try:
+        os.utime(path)  # mtime = last use, for LRU eviction
+    except FileNotFoundError:
+        return None
+    return path
+
+
+def tee(key: str, ext: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Yields the export while writing it to the cache; the entry is only
+    published once the stream has completed (a dropped download leaves
+    nothing behind).
+    """
+    final = EXPORT_CACHE_DIR / f"{key}.{ext}"
+    part = EXPORT_CACHE_DIR / f"{key}.{uuid.uuid4().hex}.part"
+    try:
+        EXPORT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        f = open(part, "wb")
+    except OSError:
+        logger.exception("Export cache unavailable")
+        yield from chunks
+        return
+
+    try:
+        with f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        part.replace(final)
+    finally:
+        part.unlink(missing_ok=True)
+
+    purge_other_generations(key)
+    evict()
+
+
+def purge_other_generations(key: str) -> int:
+    """
+    Removes entries of every generation but key's. Returns entries removed.
+    (An export that started before a write may publish after it and purge the
+    newer entries; they are simply produced again on the next request.)
+    """
+    prefix = key.split("-", 1)[0] + "-"
+    with _evict_lock:
+        removed = 0
+        for path in EXPORT_CACHE_DIR.iterdir():
+            if path.suffix == ".part" or path.name.startswith(prefix):
+                continue
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                continue
+            except OSError:  # e.g. still being served on Windows; the LRU gets it later
+                logger.warning("Could not remove stale export cache entry %s", path.name)
+                continue
+            removed += 1
+        return removed
+
+
+def evict(max_bytes: Optional[int] = None) -> int:
+    """
+    Removes least recently used entries until the cache fits in max_bytes.
+    Returns entries removed.
+    """
+    max_bytes = EXPORT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    if not EXPORT_CACHE_DIR.is_dir():
+        return 0
+
+    with _evict_lock:
+        entries = []
+        for path in EXPORT_CACHE_DIR.iterdir():
+            if path.suffix == ".part":
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        return removed
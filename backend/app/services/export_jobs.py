@@ -0,0 +1,209 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Iterator, Optional, Set
+import gzip
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import or_, update
+from sqlmodel import select
+
+from app.auth.db import get_session
+from app.questionnaires.models import ExportJob
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_EXPORT_JOBS_DIR = Path(__file__).resolve().parent.parent / "data" / "exports"
+EXPORT_JOBS_DIR = Path(os.getenv("EXPORT_JOBS_DIR", str(DEFAULT_EXPORT_JOBS_DIR))).resolve()
+
+EXPORT_JOB_WORKERS = int(os.getenv("EXPORT_JOB_WORKERS", "2"))
+EXPORT_JOB_RETENTION_HOURS = float(os.getenv("EXPORT_JOB_RETENTION_HOURS", "24"))
+
+# Every process refreshes heartbeat_at of its queued/running jobs this
+# often; jobs not refreshed for EXPORT_JOB_STALE_SECONDS belong to a process
+# that stopped and are failed by fail_interrupted_jobs (on any worker)
+EXPORT_JOB_HEARTBEAT_SECONDS = float(os.getenv("EXPORT_JOB_HEARTBEAT_SECONDS", "30"))
+EXPORT_JOB_STALE_SECONDS = float(os.getenv("EXPORT_JOB_STALE_SECONDS", "120"))
+
+# rows_written is saved at most this often while a job runs
+PROGRESS_INTERVAL_SECONDS = 1.0
+
+# Formats that are compressed internally are written as-is
+GZIP_FORMATS = {"json", "csv"}
+
+_executor = ThreadPoolExecutor(max_workers=EXPORT_JOB_WORKERS, thread_name_prefix="export-job")
+
+# Jobs submitted in this process that have not finished yet
+_owned: Set[str] = set()
+_owned_lock = threading.Lock()
+_heartbeat_thread: Optional[threading.Thread] = None
+
+# Called with a per-record progress callback; yields the artifact's bytes
+StreamFactory = Callable[[Callable[[], None]], Iterator[bytes]]
+
+
+def artifact_path(job: ExportJob) -> Optional[Path]:
+    return EXPORT_JOBS_DIR / job.filename if job.filename else None
+
+
+def submit_job(job_id: str, make_stream: StreamFactory) -> None:
+    global _heartbeat_thread
+    with _owned_lock:
+        _owned.add(job_id)
+        if _heartbeat_thread is None:
+            _heartbeat_thread = threading.Thread(target=_heartbeat_loop, name="export-job-heartbeat", daemon=True)
+            _heartbeat_thread.start()
+    _executor.submit(_run_job, job_id, make_stream)
+
+
+def _heartbeat_loop() -> None:
+    while True:
+        time.sleep(EXPORT_JOB_HEARTBEAT_SECONDS)
+        with _owned_lock:
+            job_ids = list(_owned)
+        if not job_ids:
+            continue
+        try:
+            with get_session() as session:
+                session.exec(
+                    update(ExportJob)
+                    .where(ExportJob.id.in_(job_ids))
+                    .values(heartbeat_at=datetime.utcnow().isoformat())
+                )
+                session.commit()
+        except Exception:
+            logger.exception("Export job heartbeat failed")
+
+
+def _update(job_id: str, **values) -> None:
+    with get_session() as session:
+        job = session.get(ExportJob, job_id)
+        if job is None:
+            return
+        for k, v in values.items():
+            setattr(job, k, v)
+        session.add(job)
+        session.commit()
+
+
+class _Progress:
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.rows = 0
+        self._saved_at = time.monotonic()
+
+    def __call__(self) -> None:
+        self.rows += 1
+        now = time.monotonic()
+        if now - self._saved_at >= PROGRESS_INTERVAL_SECONDS:
+            self._saved_at = now
+            _update(self.job_id, rows_written=self.rows)
+
+
+def _run_job(job_id: str, make_stream: StreamFactory) -> None:
+    try:
+        _execute_job(job_id, make_stream)
+    finally:
+        with _owned_lock:
+            _owned.discard(job_id)
+
+
+def _execute_job(job_id: str, make_stream: StreamFactory) -> None:
+    with get_session() as session:
+        job = session.get(ExportJob, job_id)
+        if job is None:
+            return
+        fmt = job.format
+
+    filename = f"export_{job_id}.{fmt}" + (".gz" if fmt in GZIP_FORMATS else "")
+    final = EXPORT_JOBS_DIR / filename
+    part = final.with_name(final.name + ".part")
+    progress = _Progress(job_id)
+
+    _update(job_id, status="running", heartbeat_at=datetime.utcnow().isoformat())
+    try:
+        EXPORT_JOBS_DIR.mkdir(parents=True, exist_ok=True)
+        opener = gzip.open if fmt in GZIP_FORMATS else open
+        with opener(part, "wb") as f:
+            for chunk in make_stream(progress):
+                f.write(chunk)
+        part.replace(final)
+    except Exception as e:
+        logger.exception("Export job %s failed", job_id)
+        part.unlink(missing_ok=True)
+        _update(
+            job_id,
+            status="failed",
+            error=str(e) or e.__class__.__name__,
+            rows_written=progress.rows,
+            finished_at=datetime.utcnow().isoformat(),
+        )
+        return
+
+    _update(
+        job_id,
+        status="done",
+        filename=filename,
+        rows_written=progress.rows,
+        size_bytes=final.stat().st_size,
+        finished_at=datetime.utcnow().isoformat(),
+    )
+
+
+def fail_interrupted_jobs() -> int:
+    """
+    Jobs that were queued/running when their process stopped never finish;
+    mark them failed once their heartbeat is stale. Jobs of live workers
+    are left alone. Returns jobs updated.
+    """
+    cutoff = (datetime.utcnow() - timedelta(seconds=EXPORT_JOB_STALE_SECONDS)).isoformat()
+    with get_session() as session:
+        jobs = session.exec(
+            select(ExportJob)
+            .where(ExportJob.status.in_(["queued", "running"]))
+            .where(or_(ExportJob.heartbeat_at.is_(None), ExportJob.heartbeat_at < cutoff))
+        ).all()
+        for job in jobs:
+            job.status = "failed"
+            job.error = "Interrupted: the server running it stopped"
+            job.finished_at = datetime.utcnow().isoformat()
+            session.add(job)
+        session.commit()
+        return len(jobs)
+
+
+def purge_expired_jobs() -> int:
+    """
+    Deletes finished jobs (and their artifacts) older than the retention
+    period, plus stray .part files. Returns jobs removed.
+    """
+    cutoff = (datetime.utcnow() - timedelta(hours=EXPORT_JOB_RETENTION_HOURS)).isoformat()
+    with get_session() as session:
+        jobs = session.exec(
+            select(ExportJob)
+            .where(ExportJob.status.in_(["done", "failed"]))
+            .where(ExportJob.finished_at <= cutoff)
+        ).all()
+        for job in jobs:
+            path = artifact_path(job)
+            if path:
+                path.unlink(missing_ok=True)
+            session.delete(job)
+        session.commit()
+
+        active = set(session.exec(
+            select(ExportJob.id).where(ExportJob.status.in_(["queued", "running"]))
+        ).all())
+
+    if EXPORT_JOBS_DIR.is_dir():
+        for part in EXPORT_JOBS_DIR.glob("*.part"):
+            job_id = part.name.split("_", 1)[-1].split(".", 1)[0]
+            if job_id not in active:
+                part.unlink(missing_ok=True)
+
+    return len(jobs)
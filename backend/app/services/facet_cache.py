@@ -0,0 +1,156 @@
+from __future__ import annotations
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+import hashlib
+import json
+import os
+import threading
+import time
+
+from sqlalchemy import and_, or_
+from sqlmodel import Session, select
+
+from app.questionnaires.changes import data_generation
+from app.questionnaires.models import Questionnaire, QuestionnaireDrug, QuestionnaireFacts
+
+
+# Response key -> questionnaire_facts column
+FACT_OPTION_KEYS = {
+    "natural_hair_colours": "natural_hair_colour",
+    "sex_at_birth": "sex_at_birth",
+    "testing_types": "testing_type",
+
+    "hair_dyed_bleached": "hair_dyed_bleached",
+    "hair_thermal_applications": "hair_thermal_applications",
+    "frequent_swimming": "frequent_swimming",
+    "frequent_sunbeds": "frequent_sunbeds",
+    "frequent_sprays_on_sites": "frequent_sprays_on_sites",
+    "pregnant_last_12_months": "pregnant_last_12_months",
+    "hair_cut_in_last_12_months": "hair_cut_in_last_12_months",
+    "hair_removed_body_hair_last_12_months": "hair_removed_body_hair_last_12_months",
+}
+
+# Response key -> (questionnaire_drug kind, status)
+DRUG_OPTION_KEYS = {
+    "drug_use_used_names": ("use", "used"),
+    "drug_exposure_exposed_names": ("exposure", "exposed"),
+}
+
+OPTION_KEYS = list(FACT_OPTION_KEYS) + list(DRUG_OPTION_KEYS)
+
+# Safety net for multi-worker deployments, where another worker's
+# finalize/delete does not reach this process's cache
+FACET_CACHE_MAX_AGE_SECONDS = int(os.getenv("FACET_CACHE_MAX_AGE_SECONDS", "300"))
+
+# Reads a rebuild repeats when writes land during it (then it swaps anyway)
+REBUILD_ATTEMPTS = 3
+
+Facets = Dict[str, Iterable[str]]
+
+
+def record_facets(facts: QuestionnaireFacts, drug_rows: Iterable[QuestionnaireDrug]) -> Facets:
+    """
+    The option values one submitted questionnaire contributes.
+    """
+    out: Dict[str, set] = {key: set() for key in OPTION_KEYS}
+    for key, column in FACT_OPTION_KEYS.items():
+        v = getattr(facts, column)
+        if v:
+            out[key].add(v)
+    for d in drug_rows:
+        for key, (kind, status) in DRUG_OPTION_KEYS.items():
+            if d.kind == kind and d.status == status:
+                out[key].add(d.drug_name)
+    return out
+
+
+class FacetCache:
+    """
+    Distinct export-option values with a reference count per value
+    (= number of submitted questionnaires having it), so finalize/delete can
+    update it incrementally and a value disappears with its last record.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Optional[Dict[str, Counter]] = None
+        self._built_at = 0.0
+        self._snapshot: Optional[Tuple[Dict[str, List[str]], str]] = None
+
+    def _apply(self, facets: Facets, delta: int) -> None:
+        with self._lock:
+            if self._counts is None:
+                return  # not built yet; the first read builds from the DB
+            for key, values in facets.items():
+                counter = self._counts[key]
+                for v in values:
+                    counter[v] += delta
+                    if counter[v] <= 0:
+                        del counter[v]
+            self._snapshot = None
+
+    def add(self, facets: Facets) -> None:
+        self._apply(facets, 1)
+
+    def remove(self, facets: Facets) -> None:
+        self._apply(facets, -1)
+
+    def rebuild(self, session: Session) -> None:
+        for attempt in range(REBUILD_ATTEMPTS):
+            generation = data_generation(session)
+            counts = self._load(session)
+            with self._lock:
+                # A write committed after the read may already have called
+                # add()/remove() on the old counts; swapping would lose it
+                if data_generation(session) != generation and attempt + 1 < REBUILD_ATTEMPTS:
+                    continue
+                self._counts = counts
+                self._built_at = time.monotonic()
+                self._snapshot = None
+                return
+
+    def _load(self, session: Session) -> Dict[str, Counter]:
+        counts: Dict[str, Counter] = {key: Counter() for key in OPTION_KEYS}
+
+        rows = session.exec(select(*[getattr(QuestionnaireFacts, c) for c in FACT_OPTION_KEYS.values()]))
+        for row in rows:
+            for key, column in FACT_OPTION_KEYS.items():
+                v = getattr(row, column)
+                if v:
+                    counts[key][v] += 1
+
+        drug_rows = session.exec(
+            select(QuestionnaireDrug.kind, QuestionnaireDrug.status, QuestionnaireDrug.drug_name)
+            .join(Questionnaire, Questionnaire.id == QuestionnaireDrug.questionnaire_id)
+            .where(Questionnaire.status == "submitted")
+            .where(or_(*[
+                and_(QuestionnaireDrug.kind == kind, QuestionnaireDrug.status == status)
+                for kind, status in DRUG_OPTION_KEYS.values()
+            ]))
+        )
+        by_kind = {v: k for k, v in DRUG_OPTION_KEYS.items()}
+        for kind, status, drug_name in drug_rows:
+            counts[by_kind[(kind, status)]][drug_name] += 1
+        return counts
+
+    def is_fresh(self) -> bool:
+        return (
+            self._counts is not None
+            and time.monotonic() - self._built_at < FACET_CACHE_MAX_AGE_SECONDS
+        )
+
+    def snapshot(self) -> Tuple[Dict[str, List[str]], str]:
+        """
+        (options payload, ETag). Only re-sorted after a change; otherwise the
+        same objects are returned.
+        """
+        with self._lock:
+            if self._snapshot is None:
+                payload = {key: sorted(self._counts[key]) for key in OPTION_KEYS}
+                body = json.dumps(payload, sort_keys=True).encode("utf-8")
+                etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                self._snapshot = (payload, etag)
+            return self._snapshot
+
+
+facet_cache = FacetCache()
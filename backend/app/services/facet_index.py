@@ -0,0 +1,296 @@
+from __future__ import annotations
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import os
+import threading
+import time
+
+import numpy as np
+from sqlmodel import Session, select
+
+from app.questionnaires.changes import data_generation
+from app.questionnaires.models import Questionnaire, QuestionnaireDrug, QuestionnaireFacts
+from app.services.export_query import FILTER_FIELDS
+
+
+# Export filter param -> (questionnaire_drug kind, status)
+DRUG_PARAMS = {
+    "drug_used_name": ("use", "used"),
+    "drug_exposed_name": ("exposure", "exposed"),
+}
+
+# Every export filter param with a bitmap per value
+FACET_FIELDS = list(FILTER_FIELDS) + list(DRUG_PARAMS)
+
+# Same safety net as the facet cache for multi-worker deployments
+FACET_INDEX_MAX_AGE_SECONDS = int(os.getenv("FACET_INDEX_MAX_AGE_SECONDS", "300"))
+
+# Reads a rebuild repeats when writes land during it (then it swaps anyway)
+REBUILD_ATTEMPTS = 3
+
+INITIAL_CAPACITY = 1024  # rows; always a multiple of 64
+
+Bitmap = np.ndarray  # uint64 words, bit i = row i
+
+
+def _row_values(facts, drug_rows: Iterable) -> List[Tuple[str, str]]:
+    """
+    (facet field, value) pairs of one submitted questionnaire.
+    """
+    values = [(field, getattr(facts, field)) for field in FILTER_FIELDS if getattr(facts, field)]
+    by_kind = {v: k for k, v in DRUG_PARAMS.items()}
+    for d in drug_rows:
+        param = by_kind.get((d.kind, d.status))
+        if param:
+            values.append((param, d.drug_name))
+    return list(dict.fromkeys(values))
+
+
+def _popcount(bitmap: Bitmap) -> int:
+    return int(np.bitwise_count(bitmap).sum())
+
+
+class FacetIndex:
+    """
+    Bitmap index over SUBMITTED questionnaires: one bitset per value of each
+    export filter field and per drug (used / exposed), plus an alive bitset.
+    A filter combination is an AND of bitsets, and its count a popcount, so
+    the export page can show live counts without querying the database.
+
+    Same results as record_passes_filters (values come from
+    questionnaire_facts / questionnaire_drug, which are normalised the same
+    way). A `latest` bitset marks the highest submitted version of each case
+    for latest_only. Rebuilt at startup and once older than
+    FACET_INDEX_MAX_AGE_SECONDS, updated by finalize and delete.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built = False
+        self._built_at = 0.0
+        self._reset(INITIAL_CAPACITY)
+
+    def _reset(self, capacity: int) -> None:
+        self._size = 0
+        self._slots: Dict[str, int] = {}
+        self._values: Dict[int, List[Tuple[str, str]]] = {}  # row -> what it is indexed under
+        self._alive: Bitmap = np.zeros(capacity // 64, dtype=np.uint64)
+        self._latest: Bitmap = np.zeros(capacity // 64, dtype=np.uint64)
+        self._cases: Dict[str, Dict[int, int]] = {}  # case_number -> {version: row}, alive rows only
+        self._row_case: Dict[int, Tuple[str, int]] = {}
+        self._submitted = np.zeros(capacity, dtype="U32")
+        self._bitmaps: Dict[str, Dict[str, Bitmap]] = {field: {} for field in FACET_FIELDS}
+
+    # -----------------------------
+    # Writes
+    # -----------------------------
+    def _grow(self) -> None:
+        words = len(self._alive) * 2
+
+        def grown(bm: Bitmap) -> Bitmap:
+            out = np.zeros(words, dtype=np.uint64)
+            out[:len(bm)] = bm
+            return out
+
+        self._alive = grown(self._alive)
+        self._latest = grown(self._latest)
+        submitted = np.zeros(words * 64, dtype="U32")
+        submitted[:len(self._submitted)] = self._submitted
+        self._submitted = submitted
+        self._bitmaps = {
+            field: {v: grown(bm) for v, bm in values.items()}
+            for field, values in self._bitmaps.items()
+        }
+
+    def _set(self, bm: Bitmap, row: int, on: bool) -> None:
+        bit = np.uint64(1 << (row & 63))
+        if on:
+            bm[row >> 6] |= bit
+        else:
+            bm[row >> 6] &= ~bit
+
+    def _set_latest(self, case: str) -> None:
+        versions = self._cases.get(case)
+        if not versions:
+            self._cases.pop(case, None)
+            return
+        top = max(versions)
+        for version, row in versions.items():
+            self._set(self._latest, row, version == top)
+
+    def _clear_row(self, row: int) -> None:
+        self._set(self._alive, row, False)
+        self._set(self._latest, row, False)
+        case = self._row_case.pop(row, None)
+        if case is not None:
+            self._cases[case[0]].pop(case[1], None)
+            self._set_latest(case[0])
+        for field, value in self._values.pop(row, []):
+            bm = self._bitmaps[field].get(value)
+            if bm is not None:
+                self._set(bm, row, False)
+
+    def _put(self, qid: str, case: Tuple[str, int], submitted_at: str, values: List[Tuple[str, str]]) -> None:
+        row = self._slots.get(qid)
+        if row is None:
+            if self._size == len(self._alive) * 64:
+                self._grow()
+            row = self._slots[qid] = self._size
+            self._size += 1
+        else:
+            self._clear_row(row)
+
+        self._set(self._alive, row, True)
+        self._row_case[row] = case
+        self._cases.setdefault(case[0], {})[case[1]] = row
+        self._set_latest(case[0])
+        self._submitted[row] = submitted_at or ""
+        self._values[row] = values
+        for field, value in values:
+            bm = self._bitmaps[field].get(value)
+            if bm is None:
+                bm = self._bitmaps[field][value] = np.zeros(len(self._alive), dtype=np.uint64)
+            self._set(bm, row, True)
+
+    def add(self, facts: QuestionnaireFacts, drug_rows: Iterable[QuestionnaireDrug]) -> None:
+        with self._lock:
+            if self._built:
+                self._put(
+                    facts.questionnaire_id,
+                    (facts.case_number, facts.version),
+                    facts.submitted_at,
+                    _row_values(facts, drug_rows),
+                )
+
+    def remove(self, qid: str) -> None:
+        with self._lock:
+            row = self._slots.get(qid)
+            if row is not None:
+                self._clear_row(row)
+
+    def rebuild(self, session: Session) -> None:
+        for attempt in range(REBUILD_ATTEMPTS):
+            generation = data_generation(session)
+            facts = session.exec(select(
+                QuestionnaireFacts.questionnaire_id,
+                QuestionnaireFacts.case_number,
+                QuestionnaireFacts.version,
+                QuestionnaireFacts.submitted_at,
+                *[getattr(QuestionnaireFacts, field) for field in FILTER_FIELDS],
+            )).all()
+            drug_rows = session.exec(
+                select(QuestionnaireDrug.questionnaire_id, QuestionnaireDrug.kind,
+                       QuestionnaireDrug.status, QuestionnaireDrug.drug_name)
+                .join(Questionnaire, Questionnaire.id == QuestionnaireDrug.questionnaire_id)
+                .where(Questionnaire.status == "submitted")
+            ).all()
+            drugs_by_qid: Dict[str, list] = {}
+            for d in drug_rows:
+                drugs_by_qid.setdefault(d.questionnaire_id, []).append(d)
+
+            with self._lock:
+                # A write committed after the read may already have called
+                # add()/remove() on the old bitmaps; resetting would lose it
+                if data_generation(session) != generation and attempt + 1 < REBUILD_ATTEMPTS:
+                    continue
+                self._load(facts, drugs_by_qid)
+                return
+
+    def _load(self, facts: List[Any], drugs_by_qid: Dict[str, list]) -> None:
+        # Caller holds the lock
+        capacity = INITIAL_CAPACITY
+        while capacity < len(facts):
+            capacity *= 2
+        self._reset(capacity)
+        n = len(facts)
+
+        # Build each bitset as a bool column, then pack it once
+        columns: Dict[str, Dict[str, np.ndarray]] = {field: {} for field in FACET_FIELDS}
+        for row, f in enumerate(facts):
+            self._slots[f.questionnaire_id] = row
+            self._row_case[row] = (f.case_number, f.version)
+            self._cases.setdefault(f.case_number, {})[f.version] = row
+            self._submitted[row] = f.submitted_at or ""
+            values = _row_values(f, drugs_by_qid.get(f.questionnaire_id, []))
+            self._values[row] = values
+            for field, value in values:
+                col = columns[field].get(value)
+                if col is None:
+                    col = columns[field][value] = np.zeros(capacity, dtype=bool)
+                col[row] = True
+
+        def pack(col: np.ndarray) -> Bitmap:
+            return np.packbits(col, bitorder="little").view(np.uint64).copy()
+
+        self._size = n
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:n] = True
+        self._alive = pack(alive)
+        latest = np.zeros(capacity, dtype=bool)
+        for versions in self._cases.values():
+            latest[versions[max(versions)]] = True
+        self._latest = pack(latest)
+        self._bitmaps = {
+            field: {v: pack(col) for v, col in values.items()}
+            for field, values in columns.items()
+        }
+        self._built = True
+        self._built_at = time.monotonic()
+
+    def is_fresh(self) -> bool:
+        return self._built and time.monotonic() - self._built_at < FACET_INDEX_MAX_AGE_SECONDS
+
+    # -----------------------------
+    # Reads
+    # -----------------------------
+    def _date_bitmap(self, submitted_from: Optional[str], submitted_to: Optional[str]) -> Optional[Bitmap]:
+        if not submitted_from and not submitted_to:
+            return None
+        mask = np.ones(len(self._submitted), dtype=bool)
+        if submitted_from:
+            mask &= self._submitted >= submitted_from
+        if submitted_to:
+            mask &= self._submitted <= submitted_to
+        return np.packbits(mask, bitorder="little").view(np.uint64)
+
+    def _match(self, params: Dict[str, str], date_bm: Optional[Bitmap], skip: Optional[str] = None) -> Bitmap:
+        result = self._latest.copy() if params.get("latest_only") else self._alive.copy()
+        if date_bm is not None:
+            result &= date_bm
+        for field in FACET_FIELDS:
+            value = params.get(field)
+            if not value or field == skip:
+                continue
+            bm = self._bitmaps[field].get(value)
+            if bm is None:
+                result[:] = 0
+                return result
+            result &= bm
+        return result
+
+    def query(
+        self,
+        params: Dict[str, str],
+        submitted_from: Optional[str] = None,
+        submitted_to: Optional[str] = None,
+        facets: bool = True,
+    ) -> Dict[str, object]:
+        """
+        {"count": N, "facets": {field: {value: count}}}. A field's facet
+        counts apply every other filter but not its own, so they show what
+        the count would become when that dropdown is changed.
+        submitted_from / submitted_to are ISO strings (inclusive bounds).
+        """
+        with self._lock:
+            date_bm = self._date_bitmap(submitted_from, submitted_to)
+            out: Dict[str, object] = {"count": _popcount(self._match(params, date_bm))}
+            if facets:
+                counts: Dict[str, Dict[str, int]] = {}
+                for field in FACET_FIELDS:
+                    base = self._match(params, date_bm, skip=field)
+                    values = {v: _popcount(base & bm) for v, bm in self._bitmaps[field].items()}
+                    counts[field] = {v: c for v, c in sorted(values.items()) if c}
+                out["facets"] = counts
+            return out
+
+
+facet_index = FacetIndex()
@@ -0,0 +1,352 @@
+from __future__ import annotations
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import math
+import re
+
+from sqlalchemy import String, and_, cast, exists, false, func, literal, not_, or_, select
+from sqlalchemy.dialects.postgresql import JSONPATH
+from sqlalchemy.sql.elements import ColumnElement
+
+from app.questionnaires.models import Questionnaire
+
+
+# Translate admin_filters rules into WHERE clauses so filtering runs in the
+# database. A rule that cannot be expressed with the same meaning as
+# compile_rules() is returned untranslated and must be evaluated in memory.
+#
+# - questionnaire columns (status, case_number, ...): plain column comparisons
+# - data.* on Postgres: one jsonpath predicate per rule, applied with the
+#   JSONB @? operator (same as jsonb_path_exists, and served by the
+#   jsonb_path_ops GIN index)
+# - data.* on SQLite: JSON1 json_type/json_extract, json_each for "any"
+#
+# Translations keep Python's semantics (missing == None, True == 1, gte/lte
+# on incomparable types is a non-match). The exception is "contains" on
+# data values: SQL matches strings exactly but can only narrow down other
+# types (str(["a"]) etc.), so such rules are also re-checked in memory.
+# SQLite's lower() only folds ASCII, so "contains" with a non-ASCII needle
+# is left to Python there.
+
+Rule = Dict[str, Any]
+
+COLUMN_TYPES = {
+    "id": str,
+    "case_number": str,
+    "version": int,
+    "status": str,
+    "created_at": str,
+    "updated_at": str,
+    "submitted_at": str,
+    "redo_of_id": str,
+    "user_id": int,
+    "user_email": str,
+}
+
+
+def _is_scalar(v: Any) -> bool:
+    if isinstance(v, float):
+        return math.isfinite(v)
+    return isinstance(v, (str, int, bool))
+
+
+def _like_pattern(needle: str) -> str:
+    escaped = needle.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _lower_in_sql(needle: str, dialect: str) -> bool:
+    return dialect != "sqlite" or needle.isascii()
+
+
+def _eq_values(v: Any) -> List[Any]:
+    """
+    JSON values Python considers == v (True == 1 == 1.0).
+    """
+    if isinstance(v, bool):
+        return [v, int(v)]
+    if isinstance(v, (int, float)) and v in (0, 1):
+        return [v, bool(v)]
+    return [v]
+
+
+def _split(field: Any) -> Optional[List[str]]:
+    if not isinstance(field, str) or not field:
+        return None
+    parts = field.split(".")
+    return parts if all(parts) else None
+
+
+# -----------------------------
+# Questionnaire columns
+# -----------------------------
+def _column_clause(name: str, op: str, expected: Any, dialect: str) -> Optional[ColumnElement]:
+    col = getattr(Questionnaire, name)
+    typ = COLUMN_TYPES[name]
+
+    def same_type(v: Any) -> bool:
+        return v is None or (isinstance(v, typ) and not isinstance(v, bool))
+
+    if op in ("eq", "neq"):
+        if not same_type(expected):
+            return None
+        eq = col.is_(None) if expected is None else col == expected
+        if op == "eq":
+            return eq
+        return col.is_not(None) if expected is None else or_(col.is_(None), col != expected)
+
+    if op == "contains":
+        if expected is None or not _lower_in_sql(str(expected), dialect):
+            return None
+        text_col = col if typ is str else cast(col, String)
+        return func.lower(text_col).like(_like_pattern(str(expected).lower()), escape="\\")
+
+    if op == "in":
+        if not isinstance(expected, list) or not all(same_type(v) for v in expected):
+            return None
+        values = [v for v in expected if v is not None]
+        clauses = [col.in_(values)] if values else []
+        if None in expected:
+            clauses.append(col.is_(None))
+        return or_(*clauses) if clauses else false()
+
+    if op in ("gte", "lte"):
+        if expected is None or not same_type(expected):
+            return None
+        if typ is str and dialect == "postgresql":
+            col = col.collate("C")  # compare like Python: by code point
+        return col >= expected if op == "gte" else col <= expected
+
+    return None
+
+
+# -----------------------------
+# data.* on Postgres (jsonpath)
+# -----------------------------
+_REGEX_SPECIAL = re.compile(r"([\\.^$|?*+()\[\]{}])")
+
+
+def _jp_path(base: str, parts: List[str]) -> str:
+    return base + "".join("." + json.dumps(p) for p in parts)
+
+
+def _jp_condition(a: str, op: str, expected: Any) -> Optional[Tuple[str, bool]]:
+    """
+    (jsonpath boolean expression, exact) for one comparison on accessor `a`.
+    Expressions never evaluate to "unknown", so they can be negated.
+    Arrays are excluded explicitly because lax mode would otherwise compare
+    their elements; the guard is a negated == because on a missing key
+    .type() yields nothing, so any comparison with it is false.
+    """
+    not_array = f'!({a}.type() == "array")'
+    if op in ("eq", "neq"):
+        if expected is None:
+            cond = f'({not_array} && !exists({a} ? (@.type() != "null")))'
+        elif _is_scalar(expected):
+            alts = " || ".join(f"@ == {json.dumps(v)}" for v in _eq_values(expected))
+            cond = f'({not_array} && exists({a} ? ({alts})))'
+        else:
+            return None
+        return (cond if op == "eq" else f"!{cond}"), True
+
+    if op == "contains":
+        if expected is None:
+            return None
+        pattern = _REGEX_SPECIAL.sub(r"\\\1", str(expected).lower())
+        strings = f'({a}.type() == "string" && {a} like_regex {json.dumps(pattern)} flag "i")'
+        others = f'({a}.type() != "string" && {a}.type() != "null")'
+        return f"({strings} || {others})", False
+
+    if op == "in":
+        if not isinstance(expected, list):
+            return None
+        conds = [_jp_condition(a, "eq", v) for v in expected]
+        if any(c is None for c in conds):
+            return None
+        return ("(" + " || ".join(c for c, _ in conds) + ")" if conds else "false"), True
+
+    if op in ("gte", "lte"):
+        cmp = ">=" if op == "gte" else "<="
+        if isinstance(expected, str):
+            return f'({a}.type() == "string" && {a} {cmp} {json.dumps(expected)})', True
+        if not _is_scalar(expected):
+            return None
+        # Numbers and booleans compare with each other in Python
+        bound = int(expected) if isinstance(expected, bool) else expected
+        conds = [f'({a}.type() == "number" && {a} {cmp} {json.dumps(bound)})']
+        for b in (True, False):
+            if (b >= expected) if op == "gte" else (b <= expected):
+                conds.append(f'({a}.type() == "boolean" && exists({a} ? (@ == {json.dumps(b)})))')
+        return "(" + " || ".join(conds) + ")", True
+
+    return None
+
+
+def _pg_rule(rule: Rule) -> Optional[Tuple[str, bool]]:
+    if "any" in rule:
+        spec = rule["any"]
+        parts = _split(spec.get("field")) if isinstance(spec, dict) else None
+        if not parts or parts[0] != "data" or len(parts) < 2:
+            return None
+        arr = _jp_path("@", parts[1:])
+        conds = []
+        for cond in spec.get("where") or []:
+            item_parts = _split(cond.get("field")) if isinstance(cond, dict) else None
+            if not item_parts:
+                return None
+            c = _jp_condition(_jp_path("@", item_parts), cond.get("op", "eq"), cond.get("value"))
+            if c is None:
+                return None
+            conds.append(c)
+        where = " && ".join(c for c, _ in conds) if conds else "true"
+        exact = all(e for _, e in conds)
+        return f'({arr}.type() == "array" && exists({arr}[*] ? ({where})))', exact
+
+    parts = _split(rule.get("field"))
+    if not parts or parts[0] != "data" or len(parts) < 2:
+        return None
+    return _jp_condition(_jp_path("@", parts[1:]), rule.get("op", "eq"), rule.get("value"))
+
+
+# -----------------------------
+# data.* on SQLite (JSON1)
+# -----------------------------
+NUMBER_TYPES = ["integer", "real"]
+
+
+def _json_path(parts: List[str]) -> str:
+    return "$" + "".join("." + json.dumps(p) for p in parts)
+
+
+def _sqlite_condition(doc, parts: List[str], op: str, expected: Any) -> Optional[Tuple[ColumnElement, bool]]:
+    path = _json_path(parts)
+    typ = func.json_type(doc, path)
+    val = func.json_extract(doc, path)  # booleans come back as 1 / 0
+
+    def eq_clause(v: Any) -> Optional[ColumnElement]:
+        if v is None:
+            return or_(typ.is_(None), typ == "null")
+        if isinstance(v, str):
+            return and_(typ == "text", val == v)
+        if not _is_scalar(v):
+            return None
+        alts = []
+        for alt in _eq_values(v):
+            if isinstance(alt, bool):
+                alts.append(typ == ("true" if alt else "false"))
+            else:
+                alts.append(and_(typ.in_(NUMBER_TYPES), val == alt))
+        return or_(*alts)
+
+    if op in ("eq", "neq"):
+        eq = eq_clause(expected)
+        if eq is None:
+            return None
+        return (eq if op == "eq" else not_(func.coalesce(eq, false()))), True
+
+    if op == "contains":
+        if expected is None or not _lower_in_sql(str(expected), "sqlite"):
+            return None
+        strings = and_(
+            typ == "text",
+            func.lower(val).like(_like_pattern(str(expected).lower()), escape="\\"),
+        )
+        others = typ.in_(NUMBER_TYPES + ["true", "false", "array", "object"])
+        return or_(strings, others), False
+
+    if op == "in":
+        if not isinstance(expected, list):
+            return None
+        clauses = [eq_clause(v) for v in expected]
+        if any(c is None for c in clauses):
+            return None
+        return (or_(*clauses) if clauses else false()), True
+
+    if op in ("gte", "lte"):
+        if isinstance(expected, str):
+            guard = typ == "text"
+        elif _is_scalar(expected):
+            guard = typ.in_(NUMBER_TYPES + ["true", "false"])
+        else:
+            return None
+        bound = int(expected) if isinstance(expected, bool) else expected
+        return and_(guard, val >= bound if op == "gte" else val <= bound), True
+
+    return None
+
+
+def _sqlite_rule(rule: Rule) -> Optional[Tuple[ColumnElement, bool]]:
+    doc = Questionnaire.data
+
+    if "any" in rule:
+        spec = rule["any"]
+        parts = _split(spec.get("field")) if isinstance(spec, dict) else None
+        if not parts or parts[0] != "data" or len(parts) < 2:
+            return None
+        path = _json_path(parts[1:])
+        items = func.json_each(doc, path).table_valued("value", "type").alias("item")
+        # Non-object items behave like dicts without the key (get_path -> None)
+        item_doc = func.iif(items.c.type == "object", items.c.value, literal(None))
+
+        conds = [(func.json_type(doc, path) == "array", True)]
+        for cond in spec.get("where") or []:
+            item_parts = _split(cond.get("field")) if isinstance(cond, dict) else None
+            if not item_parts:
+                return None
+            c = _sqlite_condition(item_doc, item_parts, cond.get("op", "eq"), cond.get("value"))
+            if c is None:
+                return None
+            conds.append(c)
+        clause = exists(select(literal(1)).select_from(items).where(*[c for c, _ in conds]))
+        return clause, all(e for _, e in conds)
+
+    parts = _split(rule.get("field"))
+    if not parts or parts[0] != "data" or len(parts) < 2:
+        return None
+    return _sqlite_condition(doc, parts[1:], rule.get("op", "eq"), rule.get("value"))
+
+
+# -----------------------------
+# Entry point
+# -----------------------------
+def rule_to_sql(rule: Rule, dialect: str) -> Optional[Tuple[ColumnElement, bool]]:
+    """
+    (clause, exact) or None if the rule can't be translated. A clause that
+    is not exact selects a superset; the rule must still be checked in memory.
+    """
+    if not isinstance(rule, dict):
+        return None
+
+    if "any" not in rule:
+        parts = _split(rule.get("field"))
+        if parts and len(parts) == 1 and parts[0] in COLUMN_TYPES:
+            clause = _column_clause(parts[0], rule.get("op", "eq"), rule.get("value"), dialect)
+            return (clause, True) if clause is not None else None
+
+    if dialect == "postgresql":
+        translated = _pg_rule(rule)
+        if translated is None:
+            return None
+        predicate, exact = translated
+        return Questionnaire.data.op("@?")(cast(literal(f"$ ? ({predicate})"), JSONPATH)), exact
+    if dialect == "sqlite":
+        return _sqlite_rule(rule)
+    return None
+
+
+def rules_to_sql(rules: Optional[List[Rule]], dialect: str) -> Tuple[List[ColumnElement], List[Rule]]:
+    """
+    (WHERE clauses, rules left for in-memory evaluation).
+    """
+    clauses: List[ColumnElement] = []
+    remaining: List[Rule] = []
+    for rule in rules or []:
+        translated = rule_to_sql(rule, dialect)
+        if translated is None:
+            remaining.append(rule)
+            continue
+        clause, exact = translated
+        clauses.append(clause)
+        if not exact:
+            remaining.append(rule)
+    return clauses, remaining
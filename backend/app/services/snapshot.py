@@ -0,0 +1,321 @@
+"""
+Consistent snapshot backup / restore of users, auth tokens and questionnaires.
+
+    python -m app.services.snapshot backup --out /backups/snap-2026-10-19
+    python -m app.services.snapshot restore /backups/snap-2026-10-19
+
+A snapshot is a directory with gzip-compressed NDJSON chunks (one row per
+line, at most --chunk-rows rows per chunk) and manifest.json listing every
+chunk with its row count and sha256. All tables are read in one read-only
+transaction, so the snapshot is consistent.
+
+Restore verifies each chunk against the manifest, then loads each table
+into the empty tables in one transaction (chunks are decompressed in
+parallel). If it fails part way, the tables it already loaded are emptied
+again, so the database is left as it was and the restore can be rerun once
+the cause is fixed. Derived tables (facts, drug, search rows, change log)
+are not in the snapshot; they are rebuilt from the restored questionnaires
+by init_db afterwards.
+"""
+from __future__ import annotations
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import os
+import sys
+import time
+
+from sqlalchemy import LargeBinary, Table, delete, func, insert, select, text
+
+from app.auth.db import AuthToken, User
+from app.questionnaires.backfills import reset_markers
+from app.questionnaires.changes import new_data_epoch
+from app.questionnaires.models import Questionnaire, SignatureBlob
+
+
+SNAPSHOT_FORMAT = "questionnaire-snapshot"
+SNAPSHOT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+
+DEFAULT_CHUNK_ROWS = 10_000
+GZIP_LEVEL = 6
+
+# Restore order: auth tokens reference users. signature_blob is included
+# because questionnaire data references its rows.
+SNAPSHOT_TABLES: List[Table] = [
+    User.__table__,
+    AuthToken.__table__,
+    Questionnaire.__table__,
+    SignatureBlob.__table__,
+]
+# Tables with a serial id (Postgres sequences to reset after restore)
+SERIAL_TABLES: List[Table] = [User.__table__, AuthToken.__table__]
+
+
+def _binary_columns(table: Table) -> List[str]:
+    return [c.name for c in table.columns if isinstance(c.type, LargeBinary)]
+
+
+def _sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _rate(n: float, seconds: float) -> float:
+    return n / seconds if seconds > 0 else 0.0
+
+
+# -----------------------------
+# Backup
+# -----------------------------
+def _write_chunk(path: Path, lines: List[bytes]) -> Dict[str, Any]:
+    # Runs in the pool: zlib releases the GIL, so chunks compress in parallel
+    with gzip.open(path, "wb", compresslevel=GZIP_LEVEL) as f:
+        f.writelines(lines)
+    return {"file": path.name, "rows": len(lines), "bytes": path.stat().st_size, "sha256": _sha256(path)}
+
+
+def _snapshot_connection(engine):
+    conn = engine.connect()
+    if engine.dialect.name == "postgresql":
+        conn = conn.execution_options(isolation_level="REPEATABLE READ")
+        conn.begin()
+        conn.execute(text("SET TRANSACTION READ ONLY"))
+    else:
+        # pysqlite only opens transactions for writes; reads need an explicit one
+        conn.exec_driver_sql("BEGIN")
+    return conn
+
+
+def backup(engine, out: Path, chunk_rows: int = DEFAULT_CHUNK_ROWS, workers: int = 4, log=sys.stdout) -> Dict[str, Any]:
+    """
+    Writes a snapshot to `out` (created; must be empty). Returns the manifest.
+    """
+    out.mkdir(parents=True, exist_ok=True)
+    if any(out.iterdir()):
+        raise ValueError(f"{out} is not empty")
+
+    t0 = time.perf_counter()
+    manifest: Dict[str, Any] = {
+        "format": SNAPSHOT_FORMAT,
+        "version": SNAPSHOT_VERSION,
+        "created_at": datetime.utcnow().isoformat(),
+        "dialect": engine.dialect.name,
+        "tables": [],
+    }
+
+    conn = _snapshot_connection(engine)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for table in SNAPSHOT_TABLES:
+                binary = _binary_columns(table)
+                pending = []
+                rows = 0
+                lines: List[bytes] = []
+                result = conn.execution_options(stream_results=True, yield_per=chunk_rows).execute(
+                    select(table).order_by(*table.primary_key.columns)
+                )
+                for row in result.mappings():
+                    record = dict(row)
+                    for col in binary:
+                        if record[col] is not None:
+                            record[col] = base64.b64encode(record[col]).decode("ascii")
+                    lines.append(json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n")
+                    if len(lines) >= chunk_rows:
+                        pending.append(pool.submit(_write_chunk, out / f"{table.name}-{len(pending) + 1:05d}.ndjson.gz", lines))
+                        rows += len(lines)
+                        lines = []
+                if lines:
+                    pending.append(pool.submit(_write_chunk, out / f"{table.name}-{len(pending) + 1:05d}.ndjson.gz", lines))
+                    rows += len(lines)
+
+                manifest["tables"].append({
+                    "name": table.name,
+                    "rows": rows,
+                    "columns": [c.name for c in table.columns],
+                    "binary_columns": binary,
+                    "chunks": [f.result() for f in pending],
+                })
+                print(f"{table.name}: {rows} rows", file=log)
+    finally:
+        conn.rollback()
+        conn.close()
+
+    elapsed = time.perf_counter() - t0
+    total_rows = sum(t["rows"] for t in manifest["tables"])
+    total_bytes = sum(c["bytes"] for t in manifest["tables"] for c in t["chunks"])
+    manifest["seconds"] = round(elapsed, 3)
+    (out / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2))
+
+    print(
+        f"backup: {total_rows} rows, {total_bytes / 1e6:.1f} MB in {elapsed:.1f}s "
+        f"({_rate(total_rows, elapsed):,.0f} rows/s, {_rate(total_bytes / 1e6, elapsed):.1f} MB/s)",
+        file=log,
+    )
+    return manifest
+
+
+# -----------------------------
+# Restore
+# -----------------------------
+def read_manifest(src: Path) -> Dict[str, Any]:
+    manifest = json.loads((src / MANIFEST_NAME).read_text())
+    if manifest.get("format") != SNAPSHOT_FORMAT or manifest.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"{src} is not a version {SNAPSHOT_VERSION} snapshot")
+    return manifest
+
+
+def verify(src: Path, manifest: Dict[str, Any]) -> None:
+    """
+    Checks every chunk against the manifest before anything is loaded.
+    """
+    for entry in manifest["tables"]:
+        for chunk in entry["chunks"]:
+            path = src / chunk["file"]
+            if not path.is_file():
+                raise ValueError(f"Missing chunk: {chunk['file']}")
+            if _sha256(path) != chunk["sha256"]:
+                raise ValueError(f"Checksum mismatch: {chunk['file']}")
+
+
+def _read_chunk(table: Table, src: Path, chunk: Dict[str, Any], binary: List[str]) -> List[Dict[str, Any]]:
+    path = src / chunk["file"]
+    columns = {c.name for c in table.columns}
+    rows = []
+    with gzip.open(path, "rb") as f:
+        for line in f:
+            record = {k: v for k, v in json.loads(line).items() if k in columns}
+            for col in binary:
+                if record.get(col) is not None:
+                    record[col] = base64.b64decode(record[col])
+            rows.append(record)
+    if len(rows) != chunk["rows"]:
+        raise ValueError(f"Row count mismatch: {chunk['file']}")
+    return rows
+
+
+def _read_chunks(pool, table: Table, src: Path, entry: Dict[str, Any], window: int) -> Iterator[List[Dict[str, Any]]]:
+    # In manifest order, with at most `window` chunks decoded ahead
+    binary = entry.get("binary_columns", [])
+    pending: deque = deque()
+    for chunk in entry["chunks"]:
+        pending.append(pool.submit(_read_chunk, table, src, chunk, binary))
+        if len(pending) > window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _empty_tables(engine, tables: List[Table]) -> None:
+    with engine.begin() as conn:
+        for table in reversed(tables):  # dependants first
+            conn.execute(delete(table))
+
+
+def _reset_sequences(engine) -> None:
+    # Rows were inserted with their ids; move serial sequences past them
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as conn:
+        for table in SERIAL_TABLES:
+            name = engine.dialect.identifier_preparer.format_table(table)
+            conn.execute(text(
+                f"SELECT setval(pg_get_serial_sequence(:table, 'id'), COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) "
+                f"FROM {name}"
+            ), {"table": name})
+
+
+def restore(engine, src: Path, workers: int = 4, log=sys.stdout) -> Dict[str, Any]:
+    """
+    Loads a snapshot into empty tables; on failure they are emptied again.
+    Returns {"rows", "seconds"}.
+    """
+    manifest = read_manifest(src)
+    verify(src, manifest)
+    tables = {t.name: t for t in SNAPSHOT_TABLES}
+
+    with engine.connect() as conn:
+        for entry in manifest["tables"]:
+            table = tables.get(entry["name"])
+            if table is None:
+                raise ValueError(f"Unknown table in snapshot: {entry['name']}")
+            if conn.execute(select(func.count()).select_from(table)).scalar():
+                raise ValueError(f"Table {table.name} is not empty")
+
+    t0 = time.perf_counter()
+    total = 0
+    loaded: List[Table] = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for entry in manifest["tables"]:
+                table = tables[entry["name"]]
+                t_table = time.perf_counter()
+                rows = 0
+                # One transaction per table; tables load in order (foreign keys)
+                with engine.begin() as conn:
+                    loaded.append(table)
+                    for chunk_rows in _read_chunks(pool, table, src, entry, workers):
+                        if chunk_rows:
+                            conn.execute(insert(table), chunk_rows)
+                            rows += len(chunk_rows)
+                total += rows
+                print(f"{table.name}: {rows} rows ({_rate(rows, time.perf_counter() - t_table):,.0f} rows/s)", file=log)
+    except BaseException:
+        print("restore failed; emptying the tables loaded so far", file=log)
+        _empty_tables(engine, loaded)
+        raise
+
+    _reset_sequences(engine)
+    with engine.begin() as conn:
+        conn.execute(new_data_epoch())  # export cache keys of the old data must not match
+    # Derived rows are not in the snapshot; let init_db backfill them again
+    reset_markers(engine)
+    elapsed = time.perf_counter() - t0
+    print(f"restore: {total} rows in {elapsed:.1f}s ({_rate(total, elapsed):,.0f} rows/s)", file=log)
+    return {"rows": total, "seconds": elapsed}
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    b = sub.add_parser("backup", help="write a snapshot")
+    b.add_argument("--out", type=Path, required=True)
+    b.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    b.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+
+    r = sub.add_parser("restore", help="load a snapshot into an empty database")
+    r.add_argument("src", type=Path)
+    r.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+
+    args = ap.parse_args(argv)
+
+    from app.auth.db import engine, init_db
+
+    try:
+        if args.command == "backup":
+            backup(engine, args.out, chunk_rows=max(1, args.chunk_rows), workers=max(1, args.workers))
+        else:
+            init_db()  # tables must exist
+            restore(engine, args.src, workers=max(1, args.workers))
+            t0 = time.perf_counter()
+            init_db()  # rebuild derived tables from the restored rows
+            print(f"derived tables rebuilt in {time.perf_counter() - t0:.1f}s")
+    except (OSError, ValueError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
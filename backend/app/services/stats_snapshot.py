@@ -0,0 +1,247 @@
+from __future__ import annotations
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import os
+import threading
+import time
+
+import numpy as np
+from sqlmodel import Session, select
+
+from app.questionnaires.changes import data_generation
+from app.questionnaires.models import Questionnaire, QuestionnaireDrug, QuestionnaireFacts
+from app.services.export_query import FILTER_FIELDS
+
+
+# Group-by dimensions: the facts filter fields plus submission month/year
+DIMENSIONS = list(FILTER_FIELDS) + ["submitted_month", "submitted_year"]
+
+# (questionnaire_drug kind, status) behind the drug_used / drug_exposed flags
+DRUG_FLAGS = {
+    "drug_used": ("use", "used"),
+    "drug_exposed": ("exposure", "exposed"),
+}
+
+# Same safety net as the facet cache for multi-worker deployments
+STATS_SNAPSHOT_MAX_AGE_SECONDS = int(os.getenv("STATS_SNAPSHOT_MAX_AGE_SECONDS", "300"))
+
+# Reads a rebuild repeats when writes land during it (then it swaps anyway)
+REBUILD_ATTEMPTS = 3
+
+INITIAL_CAPACITY = 1024
+
+
+def _dimension_values(facts: QuestionnaireFacts) -> Dict[str, str]:
+    values = {field: getattr(facts, field) or "" for field in FILTER_FIELDS}
+    submitted = facts.submitted_at or ""
+    values["submitted_month"] = submitted[:7]
+    values["submitted_year"] = submitted[:4]
+    return values
+
+
+def _drug_flags(drug_rows: Iterable[QuestionnaireDrug]) -> Dict[str, set]:
+    out: Dict[str, set] = {flag: set() for flag in DRUG_FLAGS}
+    for d in drug_rows:
+        for flag, (kind, status) in DRUG_FLAGS.items():
+            if d.kind == kind and d.status == status:
+                out[flag].add(d.drug_name)
+    return out
+
+
+class StatsSnapshot:
+    """
+    Column store of SUBMITTED questionnaires for aggregate stats: one int32
+    code array per dimension (values dictionary-encoded), one bool array per
+    drug flag, and an `alive` mask. finalize appends a row and delete clears
+    its alive bit, so aggregates never go back to the JSON documents.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built_at: Optional[float] = None
+        self._reset(INITIAL_CAPACITY)
+
+    def _reset(self, capacity: int) -> None:
+        self._size = 0
+        self._slots: Dict[str, int] = {}  # questionnaire id -> row
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._codes = {dim: np.zeros(capacity, dtype=np.int32) for dim in DIMENSIONS}
+        self._dicts: Dict[str, List[str]] = {dim: [] for dim in DIMENSIONS}
+        self._lookup: Dict[str, Dict[str, int]] = {dim: {} for dim in DIMENSIONS}
+        self._drugs: Dict[str, Dict[str, np.ndarray]] = {flag: {} for flag in DRUG_FLAGS}
+
+    # -----------------------------
+    # Writes
+    # -----------------------------
+    def _grow(self) -> None:
+        capacity = len(self._alive) * 2
+
+        def grown(arr: np.ndarray) -> np.ndarray:
+            out = np.zeros(capacity, dtype=arr.dtype)
+            out[:len(arr)] = arr
+            return out
+
+        self._alive = grown(self._alive)
+        self._codes = {dim: grown(a) for dim, a in self._codes.items()}
+        self._drugs = {
+            flag: {name: grown(a) for name, a in columns.items()}
+            for flag, columns in self._drugs.items()
+        }
+
+    def _code(self, dim: str, value: str) -> int:
+        lookup = self._lookup[dim]
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(self._dicts[dim])
+            self._dicts[dim].append(value)
+        return code
+
+    def _put(self, qid: str, dims: Dict[str, str], drugs: Dict[str, set]) -> None:
+        row = self._slots.get(qid)
+        if row is None:
+            if self._size == len(self._alive):
+                self._grow()
+            row = self._slots[qid] = self._size
+            self._size += 1
+
+        self._alive[row] = True
+        for dim in DIMENSIONS:
+            self._codes[dim][row] = self._code(dim, dims[dim])
+        for flag, names in drugs.items():
+            columns = self._drugs[flag]
+            for name, column in columns.items():
+                column[row] = name in names
+            for name in names - columns.keys():
+                column = columns[name] = np.zeros(len(self._alive), dtype=bool)
+                column[row] = True
+
+    def add(self, facts: QuestionnaireFacts, drug_rows: Iterable[QuestionnaireDrug]) -> None:
+        with self._lock:
+            if self._built_at is None:
+                return  # not built yet; the first read builds from the DB
+            self._put(facts.questionnaire_id, _dimension_values(facts), _drug_flags(drug_rows))
+
+    def remove(self, qid: str) -> None:
+        with self._lock:
+            row = self._slots.get(qid)
+            if row is not None:
+                self._alive[row] = False
+
+    def rebuild(self, session: Session) -> None:
+        """
+        Bulk load: columns are encoded in Python lists and converted to
+        arrays once, instead of row-by-row _put calls.
+        """
+        for attempt in range(REBUILD_ATTEMPTS):
+            generation = data_generation(session)
+            facts = session.exec(select(
+                QuestionnaireFacts.questionnaire_id,
+                QuestionnaireFacts.submitted_at,
+                *[getattr(QuestionnaireFacts, field) for field in FILTER_FIELDS],
+            )).all()
+            drug_rows = session.exec(
+                select(QuestionnaireDrug.questionnaire_id, QuestionnaireDrug.kind,
+                       QuestionnaireDrug.status, QuestionnaireDrug.drug_name)
+                .join(Questionnaire, Questionnaire.id == QuestionnaireDrug.questionnaire_id)
+                .where(Questionnaire.status == "submitted")
+            ).all()
+
+            with self._lock:
+                # A write committed after the read may already have called
+                # add()/remove() on the old columns; resetting would lose it
+                if data_generation(session) != generation and attempt + 1 < REBUILD_ATTEMPTS:
+                    continue
+                self._load(facts, drug_rows)
+                return
+
+    def _load(self, facts: List[Any], drug_rows: List[Any]) -> None:
+        # Caller holds the lock
+        capacity = INITIAL_CAPACITY
+        while capacity < len(facts):
+            capacity *= 2
+        self._reset(capacity)
+
+        codes: Dict[str, List[int]] = {dim: [] for dim in DIMENSIONS}
+        for row, f in enumerate(facts):
+            self._slots[f.questionnaire_id] = row
+            for dim, value in _dimension_values(f).items():
+                codes[dim].append(self._code(dim, value))
+
+        n = len(facts)
+        self._size = n
+        self._alive[:n] = True
+        for dim in DIMENSIONS:
+            self._codes[dim][:n] = codes[dim]
+
+        by_flag = {(kind, status): flag for flag, (kind, status) in DRUG_FLAGS.items()}
+        for qid, kind, status, drug_name in drug_rows:
+            flag = by_flag.get((kind, status))
+            row = self._slots.get(qid)
+            if flag is None or row is None:
+                continue
+            column = self._drugs[flag].get(drug_name)
+            if column is None:
+                column = self._drugs[flag][drug_name] = np.zeros(capacity, dtype=bool)
+            column[row] = True
+
+        self._built_at = time.monotonic()
+
+    def is_fresh(self) -> bool:
+        return (
+            self._built_at is not None
+            and time.monotonic() - self._built_at < STATS_SNAPSHOT_MAX_AGE_SECONDS
+        )
+
+    # -----------------------------
+    # Reads
+    # -----------------------------
+    def _flag(self, ratio: Tuple[str, str]) -> np.ndarray:
+        kind, value = ratio
+        n = self._size
+        if kind in DRUG_FLAGS:
+            column = self._drugs[kind].get(value)
+            return column[:n] if column is not None else np.zeros(n, dtype=bool)
+        code = self._lookup[kind].get(value)
+        if code is None:
+            return np.zeros(n, dtype=bool)
+        return self._codes[kind][:n] == code
+
+    def aggregate(self, group_by: List[str], ratio: Optional[Tuple[str, str]] = None) -> Dict[str, Any]:
+        """
+        Count per combination of the group_by dimensions; with ratio =
+        (dimension or drug flag, value), also how many rows in each group
+        match it and the matching fraction.
+        """
+        with self._lock:
+            n = self._size
+            alive = self._alive[:n]
+            cards = [max(len(self._dicts[dim]), 1) for dim in group_by]
+
+            key = np.zeros(n, dtype=np.int64)
+            for dim, card in zip(group_by, cards):
+                key = key * card + self._codes[dim][:n]
+            key = key[alive]
+
+            size = int(np.prod(cards)) if group_by else 1
+            counts = np.bincount(key, minlength=size)
+            matches = None
+            if ratio is not None:
+                matches = np.bincount(key, weights=self._flag(ratio)[alive], minlength=size)
+
+            groups = []
+            nonzero = np.flatnonzero(counts)
+            decoded = np.unravel_index(nonzero, cards) if group_by else []
+            for i, k in enumerate(nonzero):
+                group: Dict[str, Any] = {
+                    dim: self._dicts[dim][int(decoded[j][i])] if self._dicts[dim] else ""
+                    for j, dim in enumerate(group_by)
+                }
+                group["count"] = int(counts[k])
+                if matches is not None:
+                    group["matches"] = int(matches[k])
+                    group["ratio"] = round(float(matches[k]) / int(counts[k]), 4)
+                groups.append(group)
+
+            return {"total": int(alive.sum()), "groups": groups}
+
+
+stats_snapshot = StatsSnapshot()
@@ -0,0 +1,164 @@
+from __future__ import annotations
+from tempfile import SpooledTemporaryFile
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+import csv
+import io
+import json
+import os
+import zipfile
+
+from app.services.column_registry import EXTRA_COLUMN
+from app.services.columnar_export import (
+    DRUG_EXPOSURE,
+    DRUG_EXPOSURE_PERIOD,
+    DRUG_USE,
+    DRUG_USE_PERIOD,
+    NESTED_FIELDS,
+    ChunkSink,
+)
+
+
+# Long-format export: a ZIP of CSV tables linked by id instead of nested
+# lists stored as JSON in one cell.
+#
+#   questionnaires.csv            id, ...                  (no drug_use / drug_exposure columns)
+#   drug_use.csv                  drug_use_id, questionnaire_id, position, ...
+#   drug_use_periods.csv          period_id, drug_use_id, questionnaire_id, position, ...
+#   drug_exposure.csv             drug_exposure_id, questionnaire_id, position, ...
+#   drug_exposure_periods.csv     period_id, drug_exposure_id, questionnaire_id, position, ...
+#
+# Child ids are "<questionnaire id>-u<n>" / "-e<n>" and "<parent id>-p<n>".
+# Keys not in the known item shape go to _extra_fields as JSON, like the CSV export.
+
+# Child tables are spooled in memory up to this size, then on disk
+TABLE_EXPORT_SPOOL_BYTES = int(os.getenv("TABLE_EXPORT_SPOOL_BYTES", str(16 * 1024 * 1024)))
+
+COPY_CHUNK_CHARS = 1024 * 1024
+
+NESTED_COLUMNS = {f"data.{k}" for k in NESTED_FIELDS}
+
+
+def _fields(struct, skip=("periods",)) -> List[str]:
+    return [f.name for f in struct if f.name not in skip]
+
+
+# table -> (link columns, item columns)
+CHILD_TABLES: Dict[str, Tuple[List[str], List[str]]] = {
+    "drug_use": (["drug_use_id", "questionnaire_id", "position"], _fields(DRUG_USE)),
+    "drug_use_periods": (["period_id", "drug_use_id", "questionnaire_id", "position"], _fields(DRUG_USE_PERIOD)),
+    "drug_exposure": (["drug_exposure_id", "questionnaire_id", "position"], _fields(DRUG_EXPOSURE)),
+    "drug_exposure_periods": (
+        ["period_id", "drug_exposure_id", "questionnaire_id", "position"],
+        _fields(DRUG_EXPOSURE_PERIOD),
+    ),
+}
+
+# data key -> (item table, period table, item id column, id suffix)
+NESTED_TABLES = {
+    "drug_use": ("drug_use", "drug_use_periods", "drug_use_id", "u"),
+    "drug_exposure": ("drug_exposure", "drug_exposure_periods", "drug_exposure_id", "e"),
+}
+
+
+def table_header(table: str) -> List[str]:
+    links, fields = CHILD_TABLES[table]
+    return links + fields + [EXTRA_COLUMN]
+
+
+def _cell(v: Any) -> Any:
+    if v is None:
+        return ""
+    if isinstance(v, list):
+        return "; ".join("" if x is None else str(x) for x in v)
+    if isinstance(v, dict):
+        return json.dumps(v, ensure_ascii=False, default=str)
+    return v
+
+
+def _item_row(table: str, links: Dict[str, Any], item: Dict[str, Any]) -> Dict[str, Any]:
+    fields = CHILD_TABLES[table][1]
+    row = {**links, **{k: _cell(item.get(k)) for k in fields}}
+    extra = {k: v for k, v in item.items() if k not in fields and k != "periods"}
+    if extra:
+        row[EXTRA_COLUMN] = json.dumps(extra, ensure_ascii=False, default=str)
+    return row
+
+
+def child_rows(qid: str, data: Dict[str, Any]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    (table, row) for every drug_use / drug_exposure item and period of one
+    questionnaire. Non-dict items are skipped.
+    """
+    for key, (table, period_table, id_col, suffix) in NESTED_TABLES.items():
+        items = data.get(key)
+        if not isinstance(items, list):
+            continue
+        for i, item in enumerate(items, 1):
+            if not isinstance(item, dict):
+                continue
+            item_id = f"{qid}-{suffix}{i}"
+            yield table, _item_row(table, {id_col: item_id, "questionnaire_id": qid, "position": i}, item)
+
+            periods = item.get("periods")
+            if not isinstance(periods, list):
+                continue
+            for j, period in enumerate(periods, 1):
+                if not isinstance(period, dict):
+                    continue
+                links = {"period_id": f"{item_id}-p{j}", id_col: item_id, "questionnaire_id": qid, "position": j}
+                yield period_table, _item_row(period_table, links, period)
+
+
+def iter_table_zip(
+    rows: Iterable[Tuple[Dict[str, Any], Dict[str, Any]]],
+    fieldnames: List[str],
+    chunk_rows: int,
+) -> Iterator[bytes]:
+    """
+    Streams the ZIP. `rows` yields (questionnaires.csv row, clean data) per
+    record. questionnaires.csv is compressed and sent while records are
+    read; the child tables are spooled during the same pass and appended
+    after it, so the database is scanned once.
+    """
+    sink = ChunkSink()
+    spools = {
+        table: SpooledTemporaryFile(max_size=TABLE_EXPORT_SPOOL_BYTES, mode="w+", newline="", encoding="utf-8")
+        for table in CHILD_TABLES
+    }
+    try:
+        writers = {}
+        for table, spool in spools.items():
+            writers[table] = csv.DictWriter(spool, fieldnames=table_header(table), extrasaction="ignore")
+            writers[table].writeheader()
+
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            with zf.open("questionnaires.csv", "w", force_zip64=True) as entry:
+                text = io.TextIOWrapper(entry, encoding="utf-8", newline="")
+                writer = csv.DictWriter(text, fieldnames=fieldnames, extrasaction="ignore")
+                writer.writeheader()
+                for n, (flat, data) in enumerate(rows, 1):
+                    writer.writerow({k: flat.get(k, "") for k in fieldnames})
+                    for table, row in child_rows(flat["id"], data):
+                        writers[table].writerow(row)
+                    if n % chunk_rows == 0:
+                        text.flush()
+                        yield sink.drain()
+                text.flush()
+                text.detach()  # the ZipFile closes the entry
+            yield sink.drain()
+
+            for table, spool in spools.items():
+                spool.seek(0)
+                with zf.open(f"{table}.csv", "w", force_zip64=True) as entry:
+                    while True:
+                        chunk = spool.read(COPY_CHUNK_CHARS)
+                        if not chunk:
+                            break
+                        entry.write(chunk.encode("utf-8"))
+                        yield sink.drain()
+                spool.close()
+
+        yield sink.drain()
+    finally:
+        for spool in spools.values():
+            spool.close()
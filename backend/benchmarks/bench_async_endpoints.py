@@ -0,0 +1,128 @@
+"""
+Load test: async questionnaire endpoints vs the previous sync (threadpool) path.
+
+Both variants run in-process behind the same ASGI app and hit the configured
+database, so run it once per backend:
+
+    AUTH_DB_PATH=/tmp/bench.sqlite python -m benchmarks.bench_async_endpoints
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_async_endpoints --concurrency 500
+
+The sync variant is the old handler body (`def` + blocking Session), which
+Starlette runs on its fixed-size threadpool; the async variant is the real
+handler from app.api.questionnaires.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+import httpx
+from fastapi import FastAPI, HTTPException
+
+from app.api.questionnaires import get_questionnaire, list_questionnaires, q_to_full_record, q_to_index_row
+from app.auth.db import get_session, init_db
+from app.questionnaires.models import Questionnaire
+from sqlmodel import select
+
+
+def sync_get_questionnaire(qid: str):
+    with get_session() as session:
+        q = session.get(Questionnaire, qid)
+        if not q:
+            raise HTTPException(status_code=404, detail="Not found")
+        return q_to_full_record(q)
+
+
+def sync_list_questionnaires():
+    with get_session() as session:
+        qs = session.exec(select(Questionnaire).order_by(Questionnaire.created_at.desc())).all()
+        return [q_to_index_row(q) for q in qs]
+
+
+bench_app = FastAPI()
+bench_app.get("/sync/questionnaires")(sync_list_questionnaires)
+bench_app.get("/sync/questionnaires/{qid}")(sync_get_questionnaire)
+bench_app.get("/async/questionnaires")(list_questionnaires)
+bench_app.get("/async/questionnaires/{qid}")(get_questionnaire)
+
+
+def seed(n: int) -> list:
+    ids = []
+    with get_session() as session:
+        for i in range(n):
+            qid = uuid.uuid4().hex
+            session.add(Questionnaire(id=qid, case_number=f"BENCH-{i}", data={"notes": "x" * 2048}))
+            ids.append(qid)
+        session.commit()
+    return ids
+
+
+def cleanup(ids: list):
+    with get_session() as session:
+        for qid in ids:
+            q = session.get(Questionnaire, qid)
+            if q:
+                session.delete(q)
+        session.commit()
+
+
+async def run(client: httpx.AsyncClient, paths: list, concurrency: int) -> dict:
+    sem = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(path):
+        nonlocal errors
+        async with sem:
+            t0 = time.perf_counter()
+            r = await client.get(path)
+            latencies.append(time.perf_counter() - t0)
+            if r.status_code != 200:
+                errors += 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(p) for p in paths))
+    elapsed = time.perf_counter() - t0
+
+    latencies.sort()
+    return {
+        "rps": len(paths) / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+        "errors": errors,
+    }
+
+
+async def main_async(args):
+    ids = seed(args.records)
+    try:
+        transport = httpx.ASGITransport(app=bench_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name in ("get", "list"):
+                for variant in ("sync", "async"):
+                    if name == "get":
+                        paths = [f"/{variant}/questionnaires/{ids[i % len(ids)]}" for i in range(args.requests)]
+                    else:
+                        paths = [f"/{variant}/questionnaires"] * max(1, args.requests // 10)
+                    res = await run(client, paths, args.concurrency)
+                    print(
+                        f"{name:5s} {variant:5s}  {res['rps']:8.1f} req/s  "
+                        f"p50 {res['p50_ms']:7.1f} ms  p99 {res['p99_ms']:7.1f} ms  errors {res['errors']}"
+                    )
+    finally:
+        cleanup(ids)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--concurrency", type=int, default=200)
+    ap.add_argument("--requests", type=int, default=4000)
+    ap.add_argument("--records", type=int, default=200)
+    args = ap.parse_args(argv)
+
+    init_db()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Concurrent draft-save throughput against the configured database.
+
+Uses the same engine as the app, so run it once per backend:
+
+    # SQLite (WAL + busy_timeout pragmas)
+    AUTH_DB_PATH=/tmp/bench.sqlite python -m benchmarks.bench_db_writes
+
+    # Postgres
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_db_writes --threads 32
+
+Each worker creates one draft and then saves it repeatedly, the way the
+questionnaire autosave does.
+"""
+import argparse
+import sys
+import threading
+import time
+import uuid
+
+from sqlalchemy.exc import OperationalError
+
+from app.auth.db import engine, get_session, init_db, pool_stats
+from app.questionnaires.models import Questionnaire
+
+
+def worker(saves: int, errors: list, latencies: list):
+    qid = uuid.uuid4().hex
+    with get_session() as session:
+        session.add(Questionnaire(id=qid, case_number=f"BENCH-{qid[:8]}", data={"n": 0}))
+        session.commit()
+
+    for n in range(saves):
+        t0 = time.perf_counter()
+        try:
+            with get_session() as session:
+                q = session.get(Questionnaire, qid)
+                q.data = {"n": n, "notes": "x" * 512}
+                session.add(q)
+                session.commit()
+        except OperationalError as e:
+            errors.append(str(e.orig))
+            continue
+        latencies.append(time.perf_counter() - t0)
+
+    with get_session() as session:
+        session.delete(session.get(Questionnaire, qid))
+        session.commit()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--threads", type=int, default=16)
+    ap.add_argument("--saves", type=int, default=50, help="saves per thread")
+    args = ap.parse_args(argv)
+
+    init_db()
+
+    errors: list = []
+    latencies: list = []
+    threads = [
+        threading.Thread(target=worker, args=(args.saves, errors, latencies))
+        for _ in range(args.threads)
+    ]
+
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] if latencies else 0.0
+    p99 = latencies[int(len(latencies) * 0.99)] if latencies else 0.0
+
+    print(f"backend:     {engine.dialect.name}")
+    print(f"threads:     {args.threads} x {args.saves} saves")
+    print(f"throughput:  {len(latencies) / elapsed:.1f} saves/s")
+    print(f"latency:     p50 {p50 * 1000:.1f} ms, p99 {p99 * 1000:.1f} ms")
+    print(f"errors:      {len(errors)}")
+    for e in sorted(set(errors))[:5]:
+        print(f"  {e}")
+    print(f"pool:        {pool_stats()}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
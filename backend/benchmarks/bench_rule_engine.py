@@ -0,0 +1,109 @@
+"""
+Interpreted (apply_filters / match_rule) vs compiled (compile_rules) rule evaluation.
+
+Runs in memory on synthetic records shaped like questionnaire exports:
+
+    python -m benchmarks.bench_rule_engine --records 100000
+
+Both engines must select the same records; the script exits non-zero if not.
+"""
+import argparse
+import random
+import sys
+import time
+
+from app.services.admin_filters import apply_filters, compile_rules
+
+
+COLOURS = ["Brown", "Blonde", "Black", "Red", "Grey"]
+DRUGS = ["Cannabis", "Powder Cocaine", "Crack Cocaine", "Heroin", "MDMA", "Ketamine", "Amphetamine"]
+
+RULE_SETS = {
+    "eq": [
+        {"field": "status", "op": "eq", "value": "submitted"},
+        {"field": "data.natural_hair_colour", "op": "eq", "value": "Brown"},
+    ],
+    "contains+in": [
+        {"field": "data.drug_use_other_info", "op": "contains", "value": "WEEKEND"},
+        {"field": "data.testing_type", "op": "in", "value": ["Hair", "Nails"]},
+    ],
+    "range": [
+        {"field": "submitted_at", "op": "gte", "value": "2024-01-01"},
+        {"field": "submitted_at", "op": "lte", "value": "2024-12-31T23:59:59"},
+    ],
+    "any": [
+        {"any": {"field": "data.drug_use", "where": [
+            {"field": "drug_name", "op": "eq", "value": "Powder Cocaine"},
+            {"field": "status", "op": "eq", "value": "used"},
+        ]}},
+    ],
+}
+
+
+def make_records(n: int, seed: int = 1):
+    rnd = random.Random(seed)
+    records = []
+    for i in range(n):
+        submitted = f"{rnd.choice([2023, 2024, 2025])}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}T10:00:00"
+        records.append({
+            "id": f"{i:032x}",
+            "case_number": f"C{i % 5000}",
+            "status": rnd.choice(["submitted", "submitted", "draft"]),
+            "submitted_at": submitted,
+            "data": {
+                "natural_hair_colour": rnd.choice(COLOURS),
+                "testing_type": rnd.choice(["Hair", "Nails", "Both"]),
+                "drug_use_other_info": rnd.choice(["", "weekends only", "daily", "Weekend binge"]),
+                "drug_use": [
+                    {"drug_name": d, "status": rnd.choice(["used", "Not Used"])}
+                    for d in rnd.sample(DRUGS, rnd.randint(0, 4))
+                ],
+            },
+        })
+    return records
+
+
+def best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--records", type=int, default=100_000)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args(argv)
+
+    records = make_records(args.records)
+    print(f"records:     {len(records)}")
+
+    mismatches = 0
+    for name, rules in RULE_SETS.items():
+        predicate = compile_rules(rules)
+
+        interpreted = apply_filters(records, rules)
+        compiled = [r for r in records if predicate(r)]
+        if [r["id"] for r in interpreted] != [r["id"] for r in compiled]:
+            mismatches += 1
+
+        t_interp = best_of(lambda: apply_filters(records, rules), args.repeat)
+        t_comp = best_of(lambda: [r for r in records if predicate(r)], args.repeat)
+
+        print(
+            f"{name:12} matched {len(compiled):7}   "
+            f"interpreted {t_interp * 1000:8.1f} ms   "
+            f"compiled {t_comp * 1000:8.1f} ms   "
+            f"x{t_interp / t_comp:.1f}"
+        )
+
+    if mismatches:
+        print(f"MISMATCH in {mismatches} rule set(s)")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""
+Questionnaire search latency (case number prefix, names, free text).
+
+Seeds synthetic questionnaires into the configured database, times
+search_ids() for a few typical queries and removes the seeded rows again:
+
+    AUTH_DB_PATH=/tmp/bench.sqlite python -m benchmarks.bench_search --records 100000
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_search
+"""
+import argparse
+import random
+import sys
+import time
+import uuid
+
+from sqlalchemy import delete, insert
+
+from app.auth.db import engine, get_session, init_db
+from app.questionnaires.models import Questionnaire, QuestionnaireSearch
+from app.questionnaires.search import build_search_row, search_ids
+
+
+FIRST = ["James", "Olivia", "Mohammed", "Amelia", "Jack", "Isla", "Harry", "Ava", "Noah", "Emily"]
+LAST = ["Smith", "Jones", "Taylor", "Brown", "Williams", "Wilson", "Johnson", "Davies", "Patel", "Wright"]
+NOTES = ["weekends only", "daily use", "prescribed medication", "occasional at parties", "", "", ""]
+
+QUERIES = ["BENCH-12", "BENCH-4711", "smith", "olivia pat", "weekend", "prescrib", "nothingmatches"]
+
+
+def seed(n: int, batch_size: int = 5000) -> None:
+    rnd = random.Random(1)
+    for start in range(0, n, batch_size):
+        qs, rows = [], []
+        for i in range(start, min(start + batch_size, n)):
+            q = Questionnaire(
+                id=uuid.uuid4().hex,
+                case_number=f"BENCH-{i}",
+                data={
+                    "client_name": f"{rnd.choice(FIRST)} {rnd.choice(LAST)}",
+                    "collector_name": f"{rnd.choice(FIRST)} {rnd.choice(LAST)}",
+                    "drug_use_other_info": rnd.choice(NOTES),
+                },
+            )
+            qs.append({"id": q.id, "case_number": q.case_number, "data": q.data,
+                       "version": 1, "status": "draft", "created_at": "", "updated_at": ""})
+            rows.append(build_search_row(q).model_dump())
+        with engine.begin() as conn:
+            conn.execute(insert(Questionnaire), qs)
+            conn.execute(insert(QuestionnaireSearch), rows)
+
+
+def cleanup() -> None:
+    with engine.begin() as conn:
+        ids = Questionnaire.__table__.select().with_only_columns(Questionnaire.id).where(
+            Questionnaire.case_number.like("BENCH-%")
+        )
+        conn.execute(delete(QuestionnaireSearch).where(QuestionnaireSearch.questionnaire_id.in_(ids)))
+        conn.execute(delete(Questionnaire).where(Questionnaire.case_number.like("BENCH-%")))
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--records", type=int, default=100_000)
+    ap.add_argument("--limit", type=int, default=20)
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args(argv)
+
+    init_db()
+    cleanup()
+    t0 = time.perf_counter()
+    seed(args.records)
+    print(f"seeded:      {args.records} in {time.perf_counter() - t0:.1f}s ({engine.dialect.name})")
+
+    slow = 0
+    try:
+        with get_session() as session:
+            for query in QUERIES:
+                times = []
+                for _ in range(args.repeat):
+                    t0 = time.perf_counter()
+                    ids = search_ids(session, query, args.limit)
+                    times.append(time.perf_counter() - t0)
+                times.sort()
+                p50, p95 = times[len(times) // 2], times[int(len(times) * 0.95) - 1]
+                slow += p95 > 0.05
+                print(f"{query!r:18} hits {len(ids):3}   p50 {p50 * 1000:6.1f} ms   p95 {p95 * 1000:6.1f} ms")
+    finally:
+        cleanup()
+
+    if slow:
+        print(f"{slow} query(s) above 50 ms at p95")
+    return 1 if slow else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
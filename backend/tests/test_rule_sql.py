@@ -0,0 +1,120 @@
+"""
+rules_to_sql must select the same questionnaires as compile_rules. Runs on
+SQLite; the Postgres variant runs when DATABASE_URL points at Postgres
+(in a scratch schema inside a rolled-back transaction).
+"""
+import os
+
+import pytest
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from app.questionnaires.models import Questionnaire
+from app.services.admin_filters import compile_rules
+from app.services.rule_sql import _jp_condition, rules_to_sql
+
+
+DATA = [
+    {"client_name": "Zoë Brontë", "notes": "ÉCOLE", "drug_use": [{"drug_name": "Cannabis", "status": "used"}]},
+    {"client_name": "zoë brontë", "notes": "école", "drug_use": [{"drug_name": "CANNABIS", "status": "not used"}]},
+    {"client_name": "Jürgen Straße", "notes": "straße", "drug_use": [{"drug_name": "Ätzend", "status": "used"}]},
+    {"client_name": "John Smith", "notes": 42, "drug_use": "none"},
+    {"client_name": None, "notes": ["ÉCOLE"], "drug_use": []},
+    {"client_name": "ANNA", "notes": True},
+]
+
+RULES = [
+    [{"field": "data.client_name", "op": "contains", "value": "zoë"}],
+    [{"field": "data.client_name", "op": "contains", "value": "ZOË"}],
+    [{"field": "data.client_name", "op": "contains", "value": "brontë"}],
+    [{"field": "data.client_name", "op": "contains", "value": "STRASSE"}],
+    [{"field": "data.client_name", "op": "contains", "value": "straße"}],
+    [{"field": "data.client_name", "op": "contains", "value": "anna"}],
+    [{"field": "data.notes", "op": "contains", "value": "école"}],
+    [{"field": "data.notes", "op": "contains", "value": "COLE"}],
+    [{"field": "data.notes", "op": "contains", "value": "4"}],
+    [{"field": "data.notes", "op": "contains", "value": "true"}],
+    [{"any": {"field": "data.drug_use", "where": [{"field": "drug_name", "op": "contains", "value": "cannabis"}]}}],
+    [{"any": {"field": "data.drug_use", "where": [{"field": "drug_name", "op": "contains", "value": "ätz"}]}}],
+    [{"field": "case_number", "op": "contains", "value": "casé"}],
+    [{"field": "case_number", "op": "contains", "value": "CASE"}],
+    [{"field": "user_email", "op": "contains", "value": "ÖRG"}],
+    # A missing key reads as None
+    [{"field": "data.client_name", "op": "eq", "value": None}],
+    [{"field": "data.client_name", "op": "neq", "value": None}],
+    [{"field": "data.drug_use", "op": "eq", "value": None}],
+    [{"field": "data.drug_use", "op": "neq", "value": None}],
+    [{"field": "data.drug_use", "op": "neq", "value": "none"}],
+    [{"field": "data.client_name", "op": "in", "value": [None, "ANNA"]}],
+    [{"any": {"field": "data.drug_use", "where": [{"field": "kind", "op": "eq", "value": None}]}}],
+    [{"any": {"field": "data.drug_use", "where": [{"field": "status", "op": "neq", "value": None}]}}],
+]
+
+
+def _load(session: Session) -> None:
+    for i, data in enumerate(DATA):
+        session.add(Questionnaire(
+            id=f"q{i}",
+            case_number=("CASÉ-" if i % 2 else "Case-") + str(i),
+            user_email="jörg@example.com" if i % 2 else "anna@example.com",
+            data=data,
+        ))
+    session.flush()
+
+
+def _check(session: Session, rules, dialect: str) -> None:
+    clauses, remaining = rules_to_sql(rules, dialect)
+    in_memory = compile_rules(remaining) if remaining else None
+
+    everything = session.exec(select(Questionnaire)).all()
+    narrowed = session.exec(select(Questionnaire).where(*clauses)).all()
+
+    expected = {q.id for q in everything if compile_rules(rules)(q.model_dump())}
+    got = {q.id for q in narrowed if in_memory is None or in_memory(q.model_dump())}
+    assert got == expected
+
+
+@pytest.fixture(scope="module")
+def engine(tmp_path_factory):
+    engine = create_engine(f"sqlite:///{tmp_path_factory.mktemp('db') / 'rules.sqlite'}")
+    SQLModel.metadata.create_all(engine, tables=[Questionnaire.__table__])
+    with Session(engine) as session:
+        _load(session)
+        session.commit()
+    return engine
+
+
+@pytest.mark.parametrize("rules", RULES)
+def test_sql_matches_python(engine, rules):
+    with Session(engine) as session:
+        _check(session, rules, "sqlite")
+
+
+@pytest.mark.skipif(
+    not os.getenv("DATABASE_URL", "").startswith("postgres"),
+    reason="needs DATABASE_URL pointing at a Postgres database",
+)
+@pytest.mark.parametrize("rules", RULES)
+def test_sql_matches_python_postgres(rules):
+    engine = create_engine(os.environ["DATABASE_URL"])
+    with engine.connect() as conn:
+        trans = conn.begin()
+        try:
+            # A scratch schema keeps the real questionnaire table out of it
+            conn.exec_driver_sql("CREATE SCHEMA rule_sql_test")
+            conn.exec_driver_sql("SET LOCAL search_path TO rule_sql_test")
+            SQLModel.metadata.create_all(conn, tables=[Questionnaire.__table__], checkfirst=False)
+            with Session(bind=conn) as session:
+                _load(session)
+                _check(session, rules, "postgresql")
+        finally:
+            trans.rollback()
+
+
+@pytest.mark.parametrize("op, expected", [("eq", None), ("neq", None), ("eq", "x"), ("neq", "x")])
+def test_jsonpath_array_guard_holds_for_missing_keys(op, expected):
+    # On a missing key .type() yields nothing, so `.type() != "array"` would
+    # be false; the guard must be a negated == to read the key as None
+    cond, exact = _jp_condition('@."k"', op, expected)
+    assert exact
+    assert '.type() != "array"' not in cond
+    assert '!(@."k".type() == "array")' in cond
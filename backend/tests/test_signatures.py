@@ -0,0 +1,74 @@
+"""
+Signature compaction and blob storage.
+"""
+import base64
+import io
+
+import pytest
+from PIL import Image, ImageDraw
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from app.questionnaires.models import SignatureBlob
+from app.questionnaires.signatures import compact_png, split_signatures, store_signature_blobs
+
+
+def _png(img: Image.Image) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _strokes(mode: str = "RGBA", background=(0, 0, 0, 0)) -> Image.Image:
+    # Drawn large and scaled down, so the edges are anti-aliased
+    img = Image.new("RGBA", (1200, 400), (0, 0, 0, 0))
+    ImageDraw.Draw(img).line([(300, 200), (400, 150), (500, 260), (650, 180), (800, 230)], fill=(0, 0, 0, 255), width=3)
+    img = img.resize((600, 200), Image.LANCZOS)
+    out = Image.new(mode, img.size, background)
+    out.paste(img, (0, 0), img)
+    return out
+
+
+def _faint() -> Image.Image:
+    # Ink values just around the quantisation boundary, far from the strokes
+    img = _strokes()
+    for x, a in ((20, 7), (30, 8), (40, 9), (580, 8), (590, 16)):
+        img.putpixel((x, 10), (0, 0, 0, a))
+    return img
+
+
+@pytest.mark.parametrize("levels", [2, 4, 16, 256])
+@pytest.mark.parametrize("make", [
+    _strokes,
+    lambda: _strokes("RGB", "white"),
+    lambda: _strokes("L", 255),
+    _faint,
+    lambda: Image.new("RGBA", (300, 100), (0, 0, 0, 0)),
+])
+def test_compact_png_is_idempotent(monkeypatch, levels, make):
+    monkeypatch.setattr("app.questionnaires.signatures.SIGNATURE_PNG_LEVELS", levels)
+    once, width, height = compact_png(_png(make()))
+    twice, width2, height2 = compact_png(once)
+    assert twice == once
+    assert (width2, height2) == (width, height)
+
+
+def test_compact_png_trims_to_strokes():
+    png, width, height = compact_png(_png(_strokes("RGB", "white")))
+    assert width < 600 and height < 200
+    assert Image.open(io.BytesIO(png)).size == (width, height)
+
+
+def test_store_signature_blobs_ignores_known_hashes(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'blobs.sqlite'}")
+    SQLModel.metadata.create_all(engine, tables=[SignatureBlob.__table__])
+    uri = "data:image/png;base64," + base64.b64encode(_png(_strokes())).decode("ascii")
+    _, blobs = split_signatures({"client_signature_png": uri, "collector_signature_png": uri})
+    assert len(blobs) == 1
+
+    for _ in range(2):
+        with Session(engine) as session:
+            store_signature_blobs(session, blobs)
+            session.commit()
+
+    with Session(engine) as session:
+        assert len(session.exec(select(SignatureBlob)).all()) == 1
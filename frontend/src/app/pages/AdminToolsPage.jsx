@@ -3,6 +3,7 @@ import { useNavigate } from "react-router-dom";
 import {
   adminExportJson,
   adminExportCsv,
+  adminExportTables,
   adminExportOptions,
   adminUsersList,
   adminUserCreate,
@@ -65,6 +66,9 @@ export default function AdminToolsPage() {
   const [drugUsedName, setDrugUsedName] = useState("");
   const [drugExposedName, setDrugExposedName] = useState("");
 
+  // Only the highest submitted version of each case number
+  const [latestOnly, setLatestOnly] = useState(false);
+
   const params = useMemo(() => {
     const p = {};
     if (submittedFrom) p.submitted_from = submittedFrom;
@@ -86,6 +90,8 @@ export default function AdminToolsPage() {
     if (drugUsedName) p.drug_used_name = drugUsedName;
     if (drugExposedName) p.drug_exposed_name = drugExposedName;
 
+    if (latestOnly) p.latest_only = "true";
+
     return p;
   }, [
     submittedFrom,
@@ -103,6 +109,7 @@ export default function AdminToolsPage() {
     bodyHairRemoved,
     drugUsedName,
     drugExposedName,
+    latestOnly,
   ]);
 
   const downloadBlob = (blob, filename) => {
@@ -137,6 +144,17 @@ export default function AdminToolsPage() {
       setStatus(e.message || "Export failed");
     }
   };
+
+  const onDownloadTables = async () => {
+    try {
+      setStatus("Preparing tables export...");
+      const blob = await adminExportTables(params);
+      downloadBlob(blob, "submitted_questionnaires_tables.zip");
+      setStatus("");
+    } catch (e) {
+      setStatus(e.message || "Export failed");
+    }
+  };
   // Users table state
   const [users, setUsers] = useState([]);
   const [usersLoading, setUsersLoading] = useState(true);
@@ -476,6 +494,17 @@ export default function AdminToolsPage() {
               ))}
             </select>
           </Field>
+
+          <Field label="Versions">
+            <label>
+              <input
+                type="checkbox"
+                checked={latestOnly}
+                onChange={(e) => setLatestOnly(e.target.checked)}
+              />{" "}
+              Latest version per case only
+            </label>
+          </Field>
         </div>
 
         <div style={styles.actions}>
@@ -485,6 +514,9 @@ export default function AdminToolsPage() {
           <button style={styles.secondaryBtn} onClick={onDownloadCsv}>
             Download CSV (all fields)
           </button>
+          <button style={styles.secondaryBtn} onClick={onDownloadTables}>
+            Download ZIP (drug tables)
+          </button>
         </div>
 
         {status ? <p style={styles.status}>{status}</p> : null}
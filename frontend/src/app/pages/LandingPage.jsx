@@ -3,6 +3,7 @@ import { useNavigate } from "react-router-dom";
 import {
   createQuestionnaire,
   listQuestionnaires,
+  subscribeQuestionnaireEvents,
   downloadQuestionnairePdf,
   getQuestionnaire,
   deleteQuestionnaire,
@@ -33,6 +34,8 @@ export default function LandingPage() {
 
   // user role for admin tools
   const [role, setRole] = useState(null);
+  // Change-feed seq the loaded list covers; the events resume from it
+  const [eventCursor, setEventCursor] = useState(null);
   const isAdmin = role === "admin" || role === "superadmin";
 
   const logout = async () => {
@@ -58,7 +61,7 @@ export default function LandingPage() {
   const load = async () => {
     try {
       setStatus("Loading records...");
-      const data = await listQuestionnaires();
+      const { rows: data, lastEventId } = await listQuestionnaires();
 
       data.sort((a, b) => {
         const da = new Date(a.updated_at || a.created_at || 0).getTime();
@@ -67,6 +70,7 @@ export default function LandingPage() {
       });
 
       setRows(data);
+      setEventCursor(lastEventId);
       setPage(1);
       setStatus("");
     } catch (e) {
@@ -110,6 +114,19 @@ export default function LandingPage() {
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [navigate]);
 
+  // Once online and loaded, patch the list from the change feed instead of
+  // refetching; starting at the list's seq replays writes made since the read
+  useEffect(() => {
+    if (!role || eventCursor == null) return undefined;
+
+    return subscribeQuestionnaireEvents((type, row) => {
+      setRows((prev) => {
+        const rest = prev.filter((r) => r.id !== row.id);
+        return type === "delete" ? rest : [row, ...rest];
+      });
+    }, eventCursor);
+  }, [role, eventCursor]);
+
   const filtered = useMemo(() => {
     const q = query.trim().toLowerCase();
     if (!q) return rows;
@@ -120,11 +120,29 @@ export async function finalizeQuestionnaire(id) {
   return handleFetch(res);
 }
 
+// { rows, lastEventId }: lastEventId is the change-feed seq the rows cover,
+// pass it to subscribeQuestionnaireEvents so later writes are replayed.
 export async function listQuestionnaires() {
   const res = await fetch(`${BASE}/questionnaires`, {
     credentials: "include",
   });
-  return handleFetch(res);
+  const rows = await handleFetch(res);
+  return { rows, lastEventId: res.headers.get("X-Last-Event-Id") };
+}
+
+// Live list updates (Server-Sent Events). onEvent(type, row) gets
+// "create" | "update" | "finalize" | "delete" (delete rows only have an id).
+// EventSource reconnects by itself and resumes from the last event id;
+// lastEventId (from listQuestionnaires) sets where the first connection starts.
+export function subscribeQuestionnaireEvents(onEvent, lastEventId) {
+  const query = lastEventId != null ? `?last_event_id=${encodeURIComponent(lastEventId)}` : "";
+  const source = new EventSource(`${BASE}/questionnaires/events${query}`, {
+    withCredentials: true,
+  });
+  for (const type of ["create", "update", "finalize", "delete"]) {
+    source.addEventListener(type, (e) => onEvent(type, JSON.parse(e.data)));
+  }
+  return () => source.close();
 }
 
 export async function downloadQuestionnairePdf(id) {
@@ -239,3 +257,14 @@ export async function adminExportCsv(params = {}) {
   if (!res.ok) throw new Error(await res.text());
   return res.blob();
 }
+
+// ZIP of CSV tables (questionnaires, drug use/exposure rows and periods) linked by id
+export async function adminExportTables(params = {}) {
+  const qs = new URLSearchParams(params).toString();
+  const res = await fetch(`${BASE}/admin/export/tables?${qs}`, {
+    method: "GET",
+    credentials: "include",
+  });
+  if (!res.ok) throw new Error(await res.text());
+  return res.blob();
+}